@@ -0,0 +1,327 @@
+"""Offline end-to-end load test of the scan pipeline.
+
+Boots the Flask app (with a throwaway database and upload folder) against the
+stub Groq server and either the stub OCR service or a real one, then runs
+concurrent virtual users through signup, scan, poll, history and chat:
+
+    cd backend/bench
+    python loadtest.py --users 8 --duration 60
+    python loadtest.py --ocr-url http://localhost:8000       # real OCR service
+    python loadtest.py --asgi                                # serve through asgi.py (uvicorn)
+    python loadtest.py --base-url http://localhost:5000      # an app you started yourself
+    python loadtest.py --basket 10                           # N single scans vs one basket of N
+
+Reports p50/p95/p99 latency and error rate per operation, end-to-end scan
+latency and completed scans per second. --json writes the same numbers to a
+file for comparing runs. --basket N instead times N single scans submitted
+together against one /api/scan/batch upload of N other products.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import numpy as np
+import requests
+from PIL import Image
+
+import stub_groq
+import stub_ocr
+
+FLASK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'flask_app')
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+
+
+class Recorder:
+    """Latency samples and error counts per operation, shared by all virtual users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_kinds = defaultdict(int)
+
+    def record(self, op, seconds, ok=True, kind=None):
+        with self._lock:
+            self.samples[op].append(seconds)
+            if not ok:
+                self.errors[op] += 1
+                self.error_kinds[f"{op}: {kind}"] += 1
+
+    def report(self, wall_seconds):
+        ops = {}
+        for op, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            ops[op] = {
+                "count": len(ordered),
+                "errors": self.errors[op],
+                "errorRate": round(self.errors[op] / len(ordered), 4),
+                "p50": percentile(ordered, 50),
+                "p95": percentile(ordered, 95),
+                "p99": percentile(ordered, 99),
+                "max": round(ordered[-1], 4),
+            }
+        completed = ops.get('scan', {}).get('count', 0) - ops.get('scan', {}).get('errors', 0)
+        return {
+            "wallSeconds": round(wall_seconds, 2),
+            "scansCompleted": completed,
+            "scansPerSecond": round(completed / wall_seconds, 3) if wall_seconds else 0,
+            "operations": ops,
+            "errors": dict(self.error_kinds),
+        }
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return None
+    rank = max(math.ceil(pct / 100 * len(ordered)) - 1, 0)
+    return round(ordered[rank], 4)
+
+
+def make_image(seed=None):
+    rng = np.random.default_rng(seed)
+    pixels = (rng.random((240, 320, 3)) * 255).astype('uint8')
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def timed(recorder, op, call):
+    started = time.perf_counter()
+    try:
+        response = call()
+    except requests.RequestException as e:
+        recorder.record(op, time.perf_counter() - started, ok=False, kind=type(e).__name__)
+        return None
+    ok = response.status_code < 400
+    recorder.record(op, time.perf_counter() - started, ok=ok, kind=None if ok else response.status_code)
+    return response if ok else None
+
+
+def virtual_user(base_url, args, recorder, deadline, images):
+    session = requests.Session()
+    name = f"bench_{uuid.uuid4().hex[:10]}"
+    credentials = {"username": name, "email": f"{name}@bench.local", "password": "bench-password"}
+    if timed(recorder, 'signup', lambda: session.post(f"{base_url}/api/signup", json=credentials)) is None:
+        return
+
+    while time.monotonic() < deadline:
+        image = random.choice(images) if images else make_image()
+        files = {'product_image': ('label.jpg', image, 'image/jpeg')}
+        submitted = time.perf_counter()
+        response = timed(recorder, 'scan_submit', lambda: session.post(f"{base_url}/api/scan", files=files))
+        if response is None:
+            time.sleep(args.think_ms / 1000)
+            continue
+
+        task_id = response.json()['task_id']
+        status, scan_id = None, None
+        while status not in TERMINAL_STATUSES and time.perf_counter() - submitted < args.scan_timeout:
+            time.sleep(args.poll_ms / 1000)
+            polled = timed(recorder, 'task_poll', lambda: session.get(f"{base_url}/api/tasks/{task_id}"))
+            if polled is not None:
+                data = polled.json()['data']
+                status = data['status']
+                scan_id = (data.get('result') or {}).get('scanId')
+        recorder.record('scan', time.perf_counter() - submitted, ok=status == 'COMPLETED',
+                        kind=status or 'timeout')
+
+        timed(recorder, 'history', lambda: session.get(f"{base_url}/api/history"))
+        for _ in range(args.chats_per_scan):
+            timed(recorder, 'chat', lambda: session.post(
+                f"{base_url}/api/chat", json={"query": "Is this healthy for me?", "scanId": scan_id}))
+        time.sleep(args.think_ms / 1000)
+
+
+def wait_for(session, url, timeout, poll_ms):
+    """Poll a task or basket URL until it reaches a terminal status; returns that status or 'timeout'."""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        response = session.get(url)
+        if response.status_code < 400:
+            status = response.json()['data']['status']
+            if status in TERMINAL_STATUSES:
+                return status
+        time.sleep(poll_ms / 1000)
+    return 'timeout'
+
+
+def wall_report(seconds, completed):
+    return {"wallSeconds": round(seconds, 2), "completed": completed,
+            "productsPerSecond": round(completed / seconds, 3) if seconds else 0}
+
+
+def basket_benchmark(base_url, args):
+    """N single scans submitted at once, then one basket of N new products; wall time and products/s of each."""
+    session = requests.Session()
+    name = f"bench_{uuid.uuid4().hex[:10]}"
+    session.post(f"{base_url}/api/signup",
+                 json={"username": name, "email": f"{name}@bench.local", "password": "bench-password"})
+    n = args.basket
+    report = {"products": n}
+
+    started = time.perf_counter()
+    task_ids = []
+    for _ in range(n):
+        files = {'product_image': ('label.jpg', make_image(), 'image/jpeg')}
+        task_ids.append(session.post(f"{base_url}/api/scan", files=files).json()['task_id'])
+    statuses = [wait_for(session, f"{base_url}/api/tasks/{task_id}", args.scan_timeout, args.poll_ms)
+                for task_id in task_ids]
+    report["single"] = wall_report(time.perf_counter() - started, statuses.count('COMPLETED'))
+
+    started = time.perf_counter()
+    files = [('product_image', (f'label{i}.jpg', make_image(), 'image/jpeg')) for i in range(n)]
+    batch_id = session.post(f"{base_url}/api/scan/batch", files=files).json()['batch_id']
+    wait_for(session, f"{base_url}/api/scan/batch/{batch_id}", args.scan_timeout, args.poll_ms)
+    counts = session.get(f"{base_url}/api/scan/batch/{batch_id}").json()['data']['counts']
+    report["basket"] = wall_report(time.perf_counter() - started, counts.get('COMPLETED', 0))
+    report["speedup"] = round(report["single"]["wallSeconds"] / report["basket"]["wallSeconds"], 2)
+    return report
+
+
+def start_stubs(args):
+    servers = []
+    groq = stub_groq.serve(args.groq_port, stub_groq.StubConfig(
+        stub_groq.FIXTURES_DIR, args.llm_first_token_ms, args.llm_token_ms, 0.2, args.llm_error_rate))
+    servers.append(groq)
+    ocr_url = args.ocr_url
+    if ocr_url is None:
+        ocr = stub_ocr.serve(args.ocr_port, stub_ocr.StubConfig(
+            stub_ocr.FIXTURES_DIR, args.ocr_latency_ms, 0.2, args.known_ratio, args.barcode_ratio))
+        servers.append(ocr)
+        ocr_url = f"http://127.0.0.1:{args.ocr_port}"
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers, f"http://127.0.0.1:{args.groq_port}", ocr_url
+
+
+def start_flask(args, groq_url, ocr_url, workdir):
+    env = dict(os.environ)
+    env.update({
+        "GROQ_API_KEY": "bench",
+        "GROQ_BASE_URL": groq_url,
+        "OCR_SERVICE_URL": ocr_url,
+        "OCR_LOCAL_FALLBACK": "false",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "UPLOAD_FOLDER": os.path.join(workdir, 'uploads'),
+        "SESSION_COOKIE_SECURE": "false",
+    })
+    log = open(os.path.join(workdir, 'flask.log'), 'w')
+    if args.asgi:
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(args.app_port)]
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--host', '127.0.0.1',
+                   '--port', str(args.app_port), '--no-reload', '--no-debugger']
+    process = subprocess.Popen(command, cwd=FLASK_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{args.app_port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise SystemExit(f"Flask app exited during startup, see {log.name}")
+        try:
+            requests.get(base_url, timeout=1)
+            return process, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f"Flask app did not start, see {log.name}")
+
+
+def print_report(report):
+    print(f"\n{'operation':<12} {'count':>6} {'err%':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for op, row in report['operations'].items():
+        print(f"{op:<12} {row['count']:>6} {row['errorRate'] * 100:>6.1f} "
+              f"{row['p50'] * 1000:>8.0f} {row['p95'] * 1000:>8.0f} {row['p99'] * 1000:>8.0f} {row['max'] * 1000:>8.0f}")
+    print(f"\n{report['scansCompleted']} scans in {report['wallSeconds']}s = {report['scansPerSecond']} scans/s")
+    for kind, count in sorted(report['errors'].items()):
+        print(f"  error {kind}: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoScan offline load test")
+    parser.add_argument('--users', type=int, default=4, help="concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to generate load")
+    parser.add_argument('--think-ms', type=float, default=100, help="pause between a user's scans")
+    parser.add_argument('--poll-ms', type=float, default=250, help="task polling interval")
+    parser.add_argument('--scan-timeout', type=float, default=120)
+    parser.add_argument('--chats-per-scan', type=int, default=1)
+    parser.add_argument('--distinct-images', type=int, default=0,
+                        help="cycle through this many images (exercises the caches); 0 = a new image per scan")
+    parser.add_argument('--base-url', help="load an already running app instead of booting one")
+    parser.add_argument('--ocr-url', help="use this OCR service instead of the stub")
+    parser.add_argument('--app-port', type=int, default=5055)
+    parser.add_argument('--asgi', action='store_true', help="boot the app with uvicorn asgi:app")
+    parser.add_argument('--groq-port', type=int, default=8790)
+    parser.add_argument('--ocr-port', type=int, default=8791)
+    parser.add_argument('--llm-first-token-ms', type=float, default=400)
+    parser.add_argument('--llm-token-ms', type=float, default=5)
+    parser.add_argument('--llm-error-rate', type=float, default=0.0)
+    parser.add_argument('--ocr-latency-ms', type=float, default=300)
+    parser.add_argument('--known-ratio', type=float, default=0.0,
+                        help="fraction of stub OCR labels that hit the product catalog")
+    parser.add_argument('--barcode-ratio', type=float, default=0.0,
+                        help="fraction of stub images that show a barcode (all the same product)")
+    parser.add_argument('--basket', type=int, default=0,
+                        help="compare N single scans with one basket scan of N products instead of the load test")
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args()
+
+    process = None
+    workdir = tempfile.mkdtemp(prefix='ecoscan-bench-')
+    base_url = args.base_url
+    if base_url is None:
+        _, groq_url, ocr_url = start_stubs(args)
+        process, base_url = start_flask(args, groq_url, ocr_url, workdir)
+        print(f"App at {base_url} (logs and database in {workdir})")
+
+    if args.basket:
+        try:
+            report = basket_benchmark(base_url, args)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait(timeout=10)
+        for mode in ('single', 'basket'):
+            row = report[mode]
+            print(f"{mode:<7} {row['completed']}/{report['products']} products in {row['wallSeconds']}s "
+                  f"= {row['productsPerSecond']} products/s")
+        print(f"basket speedup: {report['speedup']}x")
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+        return
+
+    images = [make_image(seed) for seed in range(args.distinct_images)]
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    users = [threading.Thread(target=virtual_user, args=(base_url, args, recorder, deadline, images))
+             for _ in range(args.users)]
+    try:
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = recorder.report(time.perf_counter() - started)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+"""Local stand-in for the Groq chat completions API.
+
+Replays recorded responses from fixtures/ with configurable latency, so the
+scan pipeline can be load tested without network access or API spend. Point
+the Flask app at it with GROQ_BASE_URL (the Groq SDK reads it directly):
+
+    python stub_groq.py --port 8790 --first-token-ms 400 --token-ms 5
+    GROQ_BASE_URL=http://127.0.0.1:8790 python app.py
+
+Product extraction requests get fixtures/extraction.json and everything else
+gets fixtures/chat.txt, streamed in small chunks when the client asks for
+stream=true.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+CHUNK_CHARS = 16  # roughly four tokens per streamed chunk
+
+
+class StubConfig:
+    def __init__(self, fixtures_dir, first_token_ms, token_ms, jitter, error_rate):
+        with open(os.path.join(fixtures_dir, 'extraction.json'), encoding='utf-8') as f:
+            self.extraction = json.dumps(json.load(f))
+        with open(os.path.join(fixtures_dir, 'chat.txt'), encoding='utf-8') as f:
+            self.chat = f.read().strip()
+        self.first_token_ms = first_token_ms
+        self.token_ms = token_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def delay(self, ms):
+        if ms > 0:
+            time.sleep(ms * random.uniform(1 - self.jitter, 1 + self.jitter) / 1000)
+
+    def count(self):
+        with self._lock:
+            self.requests += 1
+
+
+def is_extraction(messages):
+    return any('label data extractor' in (m.get('content') or '') for m in messages if m.get('role') == 'system')
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.endswith('/chat/completions'):
+                self.send_error(404)
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            config.count()
+            if config.error_rate and random.random() < config.error_rate:
+                self._json(503, {"error": {"message": "stub: injected failure", "type": "service_unavailable"}})
+                return
+
+            messages = request.get('messages', [])
+            content = config.extraction if is_extraction(messages) else config.chat
+            prompt_tokens = sum(len(m.get('content') or '') for m in messages) // 4
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                     "total_tokens": prompt_tokens + len(content) // 4}
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            model = request.get('model', 'stub')
+
+            config.delay(config.first_token_ms)
+            if request.get('stream'):
+                self._stream(completion_id, model, content, usage)
+            else:
+                config.delay(config.token_ms * len(content) / CHUNK_CHARS)
+                self._json(200, {
+                    "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": usage,
+                })
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _stream(self, completion_id, model, content, usage):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+
+            def send(payload):
+                data = f"data: {payload}\n\n".encode('utf-8')
+                self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            def chunk(delta, finish_reason=None, **extra):
+                return json.dumps({
+                    "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                    **extra,
+                })
+
+            try:
+                send(chunk({"role": "assistant", "content": ""}))
+                for start in range(0, len(content), CHUNK_CHARS):
+                    if start:
+                        config.delay(config.token_ms)
+                    send(chunk({"content": content[start:start + CHUNK_CHARS]}))
+                # Groq reports usage on the final chunk
+                send(chunk({}, "stop", x_groq={"id": completion_id, "usage": usage}))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                config.cancelled += 1  # the client closed the stream early
+                self.close_connection = True
+
+    return Handler
+
+
+def serve(port, config):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Groq chat completions server")
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory with extraction.json and chat.txt")
+    parser.add_argument('--first-token-ms', type=float, default=400, help="latency before the first chunk")
+    parser.add_argument('--token-ms', type=float, default=5, help="delay between streamed chunks")
+    parser.add_argument('--jitter', type=float, default=0.2, help="+/- fraction applied to every delay")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    config = StubConfig(args.fixtures, args.first_token_ms, args.token_ms, args.jitter, args.error_rate)
+    server = serve(args.port, config)
+    print(f"Stub Groq listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
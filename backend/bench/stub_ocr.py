@@ -0,0 +1,146 @@
+"""Local stand-in for the FastAPI OCR service (POST /ocr, /ocr/batch and /barcode).
+
+Returns fixtures/label.txt after a configurable delay instead of running
+Tesseract. A batch id derived from the image bytes is appended, so distinct
+images produce distinct text and do not all collapse into one extraction
+cache entry. With --known-ratio, that fraction of images also carries the
+product's FSSAI number, which lets the Flask app's catalog lookup skip the LLM.
+With --barcode-ratio, that fraction of images shows the fixture product's
+barcode, which the app learns on the first scan and looks up from then on.
+
+    python stub_ocr.py --port 8791 --latency-ms 300
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+KNOWN_FSSAI = '10012022000123'  # matches fixtures/extraction.json
+KNOWN_BARCODE = '8901234567890'
+
+
+class StubConfig:
+    def __init__(self, fixtures_dir, latency_ms, jitter, known_ratio, barcode_ratio=0.0):
+        with open(os.path.join(fixtures_dir, 'label.txt'), encoding='utf-8') as f:
+            self.label = f.read().strip()
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.known_ratio = known_ratio
+        self.barcode_ratio = barcode_ratio
+
+    def delay(self):
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms * random.uniform(1 - self.jitter, 1 + self.jitter) / 1000)
+
+    def text_for(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        text = f"{self.label}\nBatch No. {digest[:10].upper()}"
+        # Decided by the image hash, so re-sending an image always gives the same answer
+        if int(digest[-4:], 16) / 0xFFFF < self.known_ratio:
+            text += f"\nFSSAI Lic. No. {KNOWN_FSSAI}"
+        return text
+
+    def barcodes_for(self, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        if int(digest[-8:-4], 16) / 0xFFFF < self.barcode_ratio:
+            return [{"code": KNOWN_BARCODE, "type": "EAN_13"}]
+        return []
+
+
+def multipart_files(body, content_type):
+    """Contents of the file parts of a multipart/form-data body, in order."""
+    match = re.search(r'boundary="?([^";]+)"?', content_type or '')
+    if not match:
+        return []
+    files = []
+    for part in body.split(b'--' + match.group(1).encode('latin-1')):
+        head, sep, content = part.partition(b'\r\n\r\n')
+        if sep and b'filename=' in head:
+            files.append(content[:-2] if content.endswith(b'\r\n') else content)
+    return files
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            path = self.path.split('?', 1)[0]
+            if path not in ('/ocr', '/ocr/batch', '/barcode'):
+                self.send_error(404)
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            images = multipart_files(body, self.headers.get('Content-Type'))
+            if not images:
+                self._json(422, {"detail": "no file parts"})
+                return
+
+            if path == '/barcode':
+                # Decoding is fast next to Tesseract, so no simulated delay
+                self._json(200, {"results": [{"filename": f"image{i}", "barcodes": config.barcodes_for(data),
+                                              "seconds": 0.0} for i, data in enumerate(images)]},
+                           trace_id=self.headers.get('X-Trace-Id'))
+                return
+
+            started = time.perf_counter()
+            config.delay()  # the real service OCRs a batch in parallel, so one delay per request
+            results = [{"filename": f"image{i}", "raw_text": config.text_for(data), "seconds": 0.0, "stages": {}}
+                       for i, data in enumerate(images)]
+            if path == '/ocr':
+                response = {**results[0], "seconds": round(time.perf_counter() - started, 3), "preset": "stub"}
+            else:
+                response = {"results": results, "preset": "stub",
+                            "raw_text": "\n\n".join(r["raw_text"] for r in results),
+                            "total_seconds": round(time.perf_counter() - started, 3)}
+            self._json(200, response, trace_id=self.headers.get('X-Trace-Id'))
+
+        def _json(self, status, body, trace_id=None):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if trace_id:
+                self.send_header('X-Trace-Id', trace_id)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def serve(port, config):
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(config))
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OCR service")
+    parser.add_argument('--port', type=int, default=8791)
+    parser.add_argument('--fixtures', default=FIXTURES_DIR, help="directory with label.txt")
+    parser.add_argument('--latency-ms', type=float, default=300, help="time per OCR request")
+    parser.add_argument('--jitter', type=float, default=0.2, help="+/- fraction applied to the latency")
+    parser.add_argument('--known-ratio', type=float, default=0.0,
+                        help="fraction of images whose text matches the catalogued fixture product")
+    parser.add_argument('--barcode-ratio', type=float, default=0.0,
+                        help="fraction of images that show the fixture product's barcode")
+    args = parser.parse_args()
+
+    server = serve(args.port, StubConfig(args.fixtures, args.latency_ms, args.jitter, args.known_ratio,
+                                         args.barcode_ratio))
+    print(f"Stub OCR listening on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Benchmark preprocessing presets over a local corpus of label images.
+
+The corpus is a directory of images, each with a ground-truth transcription
+next to it under the same name with a .txt extension (e.g. biscuits.jpg and
+biscuits.txt). Images without a .txt file are timed but not scored.
+
+    python benchmark.py path/to/corpus --presets none fast balanced accurate
+
+Prints per-stage time and character accuracy for each preset, then the
+fastest preset whose accuracy is within --tolerance of the best one.
+"""
+import argparse
+import io
+import os
+import re
+import time
+
+from PIL import Image
+import pytesseract
+
+import main  # noqa: F401  (configures the Tesseract path)
+import preprocess
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+
+
+def normalize(text):
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def char_accuracy(predicted, expected):
+    """1 - character error rate, floored at 0."""
+    predicted, expected = normalize(predicted), normalize(expected)
+    if not expected:
+        return 1.0 if not predicted else 0.0
+    return max(0.0, 1 - levenshtein(predicted, expected) / len(expected))
+
+
+def load_corpus(corpus_dir):
+    samples = []
+    for name in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        with open(os.path.join(corpus_dir, name), 'rb') as f:
+            image_bytes = f.read()
+        truth_path = os.path.join(corpus_dir, stem + '.txt')
+        truth = None
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding='utf-8') as f:
+                truth = f.read()
+        samples.append((name, image_bytes, truth))
+    return samples
+
+
+def benchmark_preset(samples, preset):
+    stage_totals = {}
+    accuracies = []
+    total_seconds = 0.0
+    for name, image_bytes, truth in samples:
+        started = time.perf_counter()
+        image = Image.open(io.BytesIO(image_bytes))
+        image, stages = preprocess.run(image, preset)
+        ocr_started = time.perf_counter()
+        text = pytesseract.image_to_string(image)
+        stages['tesseract'] = time.perf_counter() - ocr_started
+        total_seconds += time.perf_counter() - started
+        for stage, seconds in stages.items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+        if truth is not None:
+            accuracies.append(char_accuracy(text, truth))
+    count = len(samples)
+    return {
+        "preset": preset,
+        "avg_seconds": total_seconds / count,
+        "stages": {stage: seconds / count for stage, seconds in stage_totals.items()},
+        "accuracy": sum(accuracies) / len(accuracies) if accuracies else None,
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark OCR preprocessing presets")
+    parser.add_argument('corpus', help="directory of label images with .txt ground truth")
+    parser.add_argument('--presets', nargs='+', default=list(preprocess.PRESETS),
+                        choices=list(preprocess.PRESETS))
+    parser.add_argument('--tolerance', type=float, default=0.01,
+                        help="accuracy loss accepted for a faster preset (default 0.01)")
+    args = parser.parse_args()
+
+    samples = load_corpus(args.corpus)
+    if not samples:
+        parser.error(f"No images found in {args.corpus}")
+    print(f"{len(samples)} image(s), {sum(1 for s in samples if s[2] is not None)} with ground truth\n")
+
+    reports = []
+    for preset in args.presets:
+        report = benchmark_preset(samples, preset)
+        reports.append(report)
+        accuracy = f"{report['accuracy']:.3f}" if report['accuracy'] is not None else "n/a"
+        stages = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in report['stages'].items())
+        print(f"{preset:<10} avg {report['avg_seconds'] * 1000:7.0f}ms  accuracy {accuracy}  ({stages})")
+
+    scored = [r for r in reports if r['accuracy'] is not None]
+    if scored:
+        best = max(r['accuracy'] for r in scored)
+        eligible = [r for r in scored if r['accuracy'] >= best - args.tolerance]
+        pick = min(eligible, key=lambda r: r['avg_seconds'])
+        print(f"\nRecommended: OCR_PRESET={pick['preset']} "
+              f"({pick['avg_seconds'] * 1000:.0f}ms, accuracy {pick['accuracy']:.3f}, best {best:.3f})")
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -1,26 +1,186 @@
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, Query, Request, Response, UploadFile
+from contextlib import asynccontextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
 from PIL import Image
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
 import pytesseract
+import asyncio
 import io
+import logging
+import time
+import os
+import uuid
+import barcodes
+import preprocess
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Set Tesseract path from environment variable, falling back gracefully or needing check if distinct per OS
+tesseract_path = os.getenv("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+if tesseract_path:
+    pytesseract.pytesseract.tesseract_cmd = tesseract_path
+
+# Tesseract is CPU bound, so it runs in worker processes, one per core by default
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+OCR_MAX_BATCH = int(os.getenv("OCR_MAX_BATCH", "8"))
+OCR_PRESET = os.getenv("OCR_PRESET", preprocess.DEFAULT_PRESET)
+
+pool = None
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger("ocr")
+
+TRACE_HEADER = "X-Trace-Id"
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+REQUEST_SECONDS = Histogram("ocr_request_seconds", "Request latency", ["endpoint", "status"], buckets=BUCKETS)
+STAGE_SECONDS = Histogram("ocr_stage_seconds", "Per-image preprocessing and Tesseract time", ["stage"],
+                          buckets=BUCKETS)
+POOL_WAIT_SECONDS = Histogram("ocr_pool_wait_seconds", "Time an image waited for a free pool process",
+                              buckets=BUCKETS)
+IMAGE_ERRORS = Counter("ocr_image_errors_total", "Images that failed OCR by error class", ["error"])
+BARCODE_RESULTS = Counter("ocr_barcode_images_total", "Images searched for barcodes by outcome", ["result"])
+POOL_WORKERS = Gauge("ocr_pool_workers", "Tesseract worker processes")
+POOL_INFLIGHT = Gauge("ocr_pool_inflight", "Images submitted to the pool and not yet finished")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global pool
+    pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+    POOL_WORKERS.set(OCR_WORKERS)
+    yield
+    pool.shutdown(wait=True)
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.middleware("http")
+async def trace_and_time(request: Request, call_next):
+    """Time each request and carry the caller's trace id (the Flask scan task's) into logs and the response."""
+    trace_id = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+    request.state.trace_id = trace_id
+    started = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(route.path if route else "unmatched", response.status_code).observe(elapsed)
+    response.headers[TRACE_HEADER] = trace_id
+    if request.url.path != "/metrics":
+        logger.info(f"{request.method} {request.url.path} {response.status_code} {elapsed:.3f}s trace={trace_id}")
+    return response
+
+
+def run_tesseract(image_bytes, preset, submitted_at=None):
+    """Runs in a pool process. Returns (text, seconds, per-stage seconds)."""
+    started = time.perf_counter()
+    pool_wait = time.time() - submitted_at if submitted_at is not None else None
+    image = Image.open(io.BytesIO(image_bytes))
+    image, stages = preprocess.run(image, preset)
+    ocr_started = time.perf_counter()
+    text = pytesseract.image_to_string(image)
+    stages["tesseract"] = time.perf_counter() - ocr_started
+    if pool_wait is not None:
+        stages["pool_wait"] = max(pool_wait, 0.0)
+    return text, time.perf_counter() - started, stages
+
+
+def resolve_preset(preset):
+    preset = preset or OCR_PRESET
+    if preset not in preprocess.PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown preset, expected one of {sorted(preprocess.PRESETS)}")
+    return preset
+
+
+async def ocr_bytes(image_bytes, preset):
+    loop = asyncio.get_running_loop()
+    POOL_INFLIGHT.inc()
+    try:
+        # Wall clock, since the pool process has its own perf_counter origin
+        text, seconds, stages = await loop.run_in_executor(pool, run_tesseract, image_bytes, preset, time.time())
+    except Exception as e:
+        IMAGE_ERRORS.labels(type(e).__name__).inc()
+        raise
+    finally:
+        POOL_INFLIGHT.dec()
+    POOL_WAIT_SECONDS.observe(stages.pop("pool_wait", 0.0))
+    for stage, stage_seconds in stages.items():
+        STAGE_SECONDS.labels(stage).observe(stage_seconds)
+    return text, seconds, stages
+
+
+def rounded(stages):
+    return {name: round(seconds, 3) for name, seconds in stages.items()}
 
-app = FastAPI()
 
 @app.post("/ocr")
-async def extract_text(file: UploadFile = File(...)):
+async def extract_text(file: UploadFile = File(...), preset: Optional[str] = Query(None)):
+    preset = resolve_preset(preset)
     image_bytes = await file.read()
-    image = Image.open(io.BytesIO(image_bytes))
+    text, seconds, stages = await ocr_bytes(image_bytes, preset)
 
-    text = pytesseract.image_to_string(image)
+    return {
+        "raw_text": text,
+        "seconds": round(seconds, 3),
+        "preset": preset,
+        "stages": rounded(stages)
+    }
+
+
+@app.post("/ocr/batch")
+async def extract_text_batch(files: List[UploadFile] = File(...), preset: Optional[str] = Query(None)):
+    """OCR several images (e.g. front and back of one product) in parallel."""
+    preset = resolve_preset(preset)
+    if len(files) > OCR_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {OCR_MAX_BATCH} images per batch")
+
+    started = time.perf_counter()
+    payloads = [await file.read() for file in files]
+    outcomes = await asyncio.gather(*(ocr_bytes(data, preset) for data in payloads), return_exceptions=True)
+
+    results = []
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, Exception):
+            results.append({"filename": file.filename, "raw_text": "", "error": str(outcome)})
+        else:
+            text, seconds, stages = outcome
+            results.append({"filename": file.filename, "raw_text": text, "seconds": round(seconds, 3),
+                            "stages": rounded(stages)})
 
     return {
-        "raw_text": text
+        "results": results,
+        "preset": preset,
+        "raw_text": "\n\n".join(r["raw_text"].strip() for r in results if r["raw_text"].strip()),
+        "total_seconds": round(time.perf_counter() - started, 3)
     }
-import os
-from dotenv import load_dotenv
 
-load_dotenv()
 
-# Set Tesseract path from environment variable, falling back gracefully or needing check if distinct per OS
-tesseract_path = os.getenv("TESSERACT_CMD", r"C:\Program Files\Tesseract-OCR\tesseract.exe")
-if tesseract_path:
-    pytesseract.pytesseract.tesseract_cmd = tesseract_path
+@app.post("/barcode")
+async def detect_barcodes(files: List[UploadFile] = File(...)):
+    """Decode EAN/UPC barcodes in one or more images, without running Tesseract."""
+    if len(files) > OCR_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {OCR_MAX_BATCH} images per batch")
+
+    loop = asyncio.get_running_loop()
+    payloads = [await file.read() for file in files]
+    outcomes = await asyncio.gather(*(loop.run_in_executor(pool, barcodes.decode, data) for data in payloads),
+                                    return_exceptions=True)
+
+    results = []
+    for file, outcome in zip(files, outcomes):
+        if isinstance(outcome, Exception):
+            IMAGE_ERRORS.labels(type(outcome).__name__).inc()
+            BARCODE_RESULTS.labels("error").inc()
+            results.append({"filename": file.filename, "barcodes": [], "error": str(outcome)})
+        else:
+            found, seconds = outcome
+            STAGE_SECONDS.labels("barcode").observe(seconds)
+            BARCODE_RESULTS.labels("found" if found else "none").inc()
+            results.append({"filename": file.filename, "barcodes": found, "seconds": round(seconds, 3)})
+    return {"results": results}
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,121 @@
+"""Image preprocessing applied before Tesseract.
+
+Phone photos of labels are large, rotated and unevenly lit. Each preset is an
+ordered list of steps (downscale comes first so JPEGs can be decoded at reduced
+size); run() applies them and reports how long each took so
+the benchmark harness can weigh speed against accuracy.
+"""
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps
+
+PRESETS = {
+    # Raw image, as before preprocessing existed
+    "none": [],
+    # Cheapest steps that still cut Tesseract time on big photos
+    "fast": [("downscale", {"max_side": 1600}), ("orient", {}), ("grayscale", {})],
+    "balanced": [
+        ("downscale", {"max_side": 2000}),
+        ("orient", {}),
+        ("grayscale", {}),
+        ("binarize", {"block_size": 31, "c": 15}),
+    ],
+    "accurate": [
+        ("downscale", {"max_side": 2400}),
+        ("orient", {}),
+        ("grayscale", {}),
+        ("deskew", {}),
+        ("crop_text", {"margin": 20}),
+        ("binarize", {"block_size": 31, "c": 15}),
+    ],
+}
+
+DEFAULT_PRESET = "balanced"
+
+
+def orient(image):
+    """Apply the EXIF orientation tag so text is upright."""
+    return ImageOps.exif_transpose(image)
+
+
+def downscale(image, max_side):
+    """Shrink so the longest side is at most max_side (roughly 300 DPI for a label)."""
+    width, height = image.size
+    scale = max_side / max(width, height)
+    if scale >= 1:
+        return image
+    target = (int(width * scale), int(height * scale))
+    if image.format == "JPEG":
+        # Let the JPEG decoder skip detail we are about to throw away
+        image.draft(image.mode, target)
+    return image.resize(target, Image.LANCZOS)
+
+
+def grayscale(image):
+    return image.convert("L")
+
+
+def binarize(image, block_size, c):
+    """Adaptive threshold; copes with glare and shadows better than a global one."""
+    pixels = np.array(image.convert("L"))
+    binary = cv2.adaptiveThreshold(pixels, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY, block_size, c)
+    return Image.fromarray(binary)
+
+
+def deskew(image, max_angle=15):
+    """Rotate so text lines are horizontal, estimated from the dark-pixel bounding box."""
+    pixels = np.array(image.convert("L"))
+    _, ink = cv2.threshold(pixels, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ys, xs = np.where(ink > 0)
+    coords = np.column_stack((xs, ys)).astype(np.float32)
+    if len(coords) < 50:
+        return image
+    angle = cv2.minAreaRect(coords)[-1]
+    if angle > 45:
+        angle -= 90
+    if abs(angle) < 0.5 or abs(angle) > max_angle:
+        return image
+    return image.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+
+
+def crop_text(image, margin):
+    """Crop to the bounding box of text-like regions (dense edges)."""
+    pixels = np.array(image.convert("L"))
+    gradient = cv2.morphologyEx(pixels, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    joined = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 5)))
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(c) for c in contours]
+    boxes = [b for b in boxes if b[2] > 30 and b[3] > 8]  # ignore specks
+    if not boxes:
+        return image
+    left = max(min(x for x, _, _, _ in boxes) - margin, 0)
+    top = max(min(y for _, y, _, _ in boxes) - margin, 0)
+    right = min(max(x + w for x, _, w, _ in boxes) + margin, image.width)
+    bottom = min(max(y + h for _, y, _, h in boxes) + margin, image.height)
+    return image.crop((left, top, right, bottom))
+
+
+STEPS = {
+    "orient": orient,
+    "downscale": downscale,
+    "grayscale": grayscale,
+    "binarize": binarize,
+    "deskew": deskew,
+    "crop_text": crop_text,
+}
+
+
+def run(image, preset=DEFAULT_PRESET):
+    """Apply a preset to a PIL image. Returns (image, {step: seconds})."""
+    if preset not in PRESETS:
+        raise ValueError(f"Unknown preset '{preset}', expected one of {sorted(PRESETS)}")
+    timings = {}
+    for name, params in PRESETS[preset]:
+        started = time.perf_counter()
+        image = STEPS[name](image, **params)
+        timings[name] = time.perf_counter() - started
+    return image, timings
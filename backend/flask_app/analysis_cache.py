@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Fields of an analysis that describe the product itself and do not depend on
+# who scanned it. Everything else (health_score, verdict, allergens, notes) is
+# recomputed per user from these.
+PRODUCT_FIELDS = (
+    'product_name',
+    'product_description',
+    'ingredients',
+    'nutritional_facts',
+    'base_health_score',
+    'eco_score',
+    'eco_score_reasoning',
+    'packaging',
+    'palm_oil',
+    'carbon_footprint',
+    'nutritional_benefits',
+    'other_info',
+    'additives',
+    'extraction_source',  # 'local' (label parser) or 'llm'; absent on older extractions, which are all LLM
+)
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a per-entry TTL and hit/miss counters."""
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "maxEntries": self.max_entries,
+                "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": round(self.hits / lookups, 3) if lookups else 0.0,
+            }
+
+
+MAX_ENTRIES = int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '1024'))
+TTL_SECONDS = int(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', str(24 * 3600)))
+
+# image fingerprint -> OCR text
+ocr_cache = LRUCache(MAX_ENTRIES, TTL_SECONDS)
+# normalized OCR text hash -> preference-independent extraction
+extraction_cache = LRUCache(MAX_ENTRIES, TTL_SECONDS)
+
+
+def image_fingerprint(image_bytes):
+    """Return the content hash of an uploaded image.
+
+    Only byte-identical uploads share OCR text. A perceptual hash would also
+    match the same photo re-encoded by the client, but flavour variants with
+    the same pack layout hash alike too and would be served each other's text.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def normalize_ocr_text(text):
+    """Lowercase and strip OCR noise so trivially different reads share a key."""
+    text = text.lower()
+    text = re.sub(r'[^a-z0-9%.,]+', ' ', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def _text_key(ocr_text):
+    return hashlib.sha256(normalize_ocr_text(ocr_text).encode('utf-8')).hexdigest()
+
+
+def get_ocr_text(fingerprint):
+    return ocr_cache.get(f"sha:{fingerprint}")
+
+
+def store_ocr_text(fingerprint, ocr_text):
+    ocr_cache.set(f"sha:{fingerprint}", ocr_text)
+
+
+def get_extraction(ocr_text):
+    extraction = extraction_cache.get(_text_key(ocr_text))
+    return dict(extraction) if extraction is not None else None
+
+
+def store_extraction(ocr_text, analysis):
+    """Cache only the product-level part of an analysis."""
+    extraction = {field: analysis[field] for field in PRODUCT_FIELDS if field in analysis}
+    extraction_cache.set(_text_key(ocr_text), extraction)
+
+
+def cache_stats():
+    return {
+        "ocr": ocr_cache.stats(),
+        "extraction": extraction_cache.stats(),
+    }
@@ -1,23 +1,42 @@
-from flask import Flask, request, jsonify, session, send_from_directory
-from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, request, jsonify, session, Response, stream_with_context
+from flask_login import LoginManager, login_user, login_required, logout_user, current_user
 from flask_cors import CORS
 from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
+import click
 import os
 import random
 import json
-import requests
 import urllib.parse
-from groq_ai import analyze_product_risk, chat_with_groq
+from groq_ai import extract_product_data, chat_with_groq, ExtractionError
+import analysis_cache
+import barcode_store
+import basket
+import catalog
+import chat
+import database
+import ocr_client
+import preferences
+import retention
+import storage
+import task_results
+import user_cache
+from scoring import personalize
 from datetime import datetime
 from schemas import SignupSchema, ProfileUpdateSchema
 from marshmallow import ValidationError
 from marshmallow import ValidationError
+from sqlalchemy.exc import IntegrityError
 import logging
 import uuid
-from concurrent.futures import ThreadPoolExecutor
 import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import job_queue
+import llm_router
+import local_extractor
+import metrics
+import task_events
+from models import db, User, Product, ScanHistory, Task
 
 # Configure Logging
 logging.basicConfig(
@@ -26,16 +45,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Thread Pool
-executor = ThreadPoolExecutor(max_workers=2)
-
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app, origins=["http://localhost:5173"], supports_credentials=True)
+CORS_ORIGINS = ["http://localhost:5173"]  # asgi.py applies the same to its native routes
+CORS(app, origins=CORS_ORIGINS, supports_credentials=True)
 
 # Calculate paths relative to project root
 # current: backend/flask_app/app.py
@@ -46,14 +63,14 @@ os.makedirs(instance_path, exist_ok=True)
 DB_PATH = os.path.join(instance_path, 'users.db')
 
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev_fallback_secret_key')
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DB_PATH}'
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
-app.config['SESSION_COOKIE_SECURE'] = True  # Set to True in production with HTTPS
+app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads'))
+app.config['SESSION_COOKIE_SECURE'] = os.getenv('SESSION_COOKIE_SECURE', 'true').lower() == 'true'  # Set to True in production with HTTPS
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # Allow cross-origin with credentials
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour session lifetime
 app.config['SESSION_TYPE'] = 'filesystem'  # Better session storage
-db = SQLAlchemy(app)
+database.init_app(app, DB_PATH)  # DATABASE_URL, or SQLite at DB_PATH
+metrics.init_app(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'api_login'
@@ -63,130 +80,367 @@ def unauthorized():
     return jsonify({"success": False, "message": "Authentication required"}), 401
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+storage.init_app(app)  # STORAGE_BACKEND: UPLOAD_FOLDER or an S3-compatible bucket
 
-# User model
-class User(UserMixin, db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(150), unique=True, nullable=False)
-    email = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
-    health_conditions = db.Column(db.String(500), default='')
-    allergies = db.Column(db.String(500), default='')
-    diet_type = db.Column(db.String(100), default='general')
-    ingredients_to_avoid = db.Column(db.String(500), default='')
-
-# Scan History model
-class ScanHistory(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    product_name = db.Column(db.String(200), nullable=False)
-    health_score = db.Column(db.Integer)
-    eco_score = db.Column(db.Integer)
-    image_filename = db.Column(db.String(200))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-    full_analysis = db.Column(db.Text)  # Store full JSON analysis if needed
-
-class Task(db.Model):
-    id = db.Column(db.String(36), primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    status = db.Column(db.String(20), default='PENDING') # PENDING, PROCESSING, COMPLETED, FAILED
-    result = db.Column(db.Text, nullable=True) # JSON string
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-def process_scan_task(app_instance, task_id, filename, filepath, user_prefs, user_id):
-    """Background worker to process the scan."""
-    with app_instance.app_context():
-        logger.info(f"Starting background task {task_id}")
-        task = Task.query.get(task_id)
-        if not task:
-            logger.error(f"Task {task_id} not found in background worker")
-            return
-        
-        task.status = 'PROCESSING'
-        db.session.commit()
-        
+SCAN_INLINE_UPLOADS = os.getenv('SCAN_INLINE_UPLOADS', 'true').lower() == 'true'
+# task_id -> uploaded image bytes, so a local worker can skip re-reading them from storage
+upload_buffer = analysis_cache.LRUCache(max_entries=64, ttl_seconds=600)
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '20'))
+HISTORY_MAX_PAGE_SIZE = 100
+MAX_IMAGES_PER_SCAN = int(os.getenv('MAX_IMAGES_PER_SCAN', '4'))
+TASK_EVENTS_KEEPALIVE_SECONDS = float(os.getenv('TASK_EVENTS_KEEPALIVE_SECONDS', '5'))
+
+def set_task_stage(task, stage):
+    # Commits only while this worker still holds the task (raises job_queue.LeaseLost otherwise)
+    job_queue.set_stage(task, stage)
+    task_events.publish(task.id, task.status, stage)
+
+def process_scan_task(app_instance, task):
+    """Run one claimed scan task. Raising hands the task back to the queue for retry."""
+    task_id = task.id
+    payload = json.loads(task.payload)
+    filename = payload['filename']
+    user_prefs = payload['user_prefs']
+    user_id = task.user_id
+    trace_id = payload.get('trace_id') or task_id
+    timings = {}
+
+    # Called by job_queue workers inside an app context
+    logger.info(f"Starting background task {task_id} (attempt {task.attempts}, trace {trace_id})")
+    try:
+        stage_start = time.perf_counter()
+        images = payload.get('images') or [{"filename": filename}]
+        # Uploads accepted by this process are still in memory; other workers read them from storage
+        image_bytes = upload_buffer.get(task_id)
+        if image_bytes is None:
+            image_bytes = []
+            for image in images:
+                data = storage.read_original(image['filename'])
+                if data is None:
+                    raise FileNotFoundError(f"Upload {image['filename']} is missing from storage")
+                image_bytes.append(data)
+        fingerprints = [analysis_cache.image_fingerprint(data) for data in image_bytes]
+        timings['read'] = time.perf_counter() - stage_start
+
+        # Thumbnail and web copy of the front image for the history list and results page
+        stage_start = time.perf_counter()
         try:
-            # 1. OCR
-            ocr_text = "OCR failed"
-            try:
-                with open(filepath, 'rb') as f:
-                    files = {'file': (filename, f, 'image/jpeg')}
-                    logger.info(f"Task {task_id}: Sending to OCR...")
-                    response = requests.post('http://localhost:8000/ocr', files=files, timeout=30)
-                    if response.status_code == 200:
-                        ocr_data = response.json()
-                        ocr_text = ocr_data.get('raw_text', '').strip()
-                        logger.info(f"Task {task_id}: OCR Success")
-                    else:
-                        raise Exception(f"OCR API error: {response.status_code}")
-            except Exception as e:
-                logger.error(f"Task {task_id}: OCR Error: {e}")
-                # We continue even if OCR fails, AI might handle empty text or we catch it there
-            
-            # 2. AI Analysis
-            from groq_ai import analyze_product_risk
-            logger.info(f"Task {task_id}: Starting AI analysis...")
-            ai_analysis = analyze_product_risk(ocr_text, user_prefs)
-            
-            if "error" in ai_analysis:
-                raise Exception(f"AI Analysis failed: {ai_analysis['error']}")
+            storage.ensure_derivatives(filename, image_bytes[0])
+        except Exception as e:
+            logger.warning(f"Task {task_id}: could not build image derivatives: {e}")
+        timings['derivatives'] = time.perf_counter() - stage_start
 
-            # 3. Save to History
-            health_score = ai_analysis.get('health_score', 50)
-            eco_score = ai_analysis.get('eco_score', 50)
-            
-            # Additional context for Chatbot
-            nutritional_benefits = ai_analysis.get('nutritional_benefits', [])
-            personalized_notes = ai_analysis.get('personalized_notes', [])
-            context = (
-                f"Product: {ai_analysis.get('product_name', 'Unknown')}. "
-                f"Health Score: {health_score}/100. "
-                f"Eco Score: {eco_score}/100. "
-                f"Verdict: {ai_analysis.get('verdict', 'unknown')}. "
-                f"Benefits: {', '.join(nutritional_benefits)}. "
-                f"Warnings: {', '.join(personalized_notes)}. "
-                f"User Preferences Applied: {user_prefs['health_conditions']}, {user_prefs['allergies']}."
-            )
+        # 1. Barcode: a product the catalog knows by its EAN/UPC code needs neither OCR nor the LLM
+        barcodes = []
+        barcode_product = None
+        if barcode_store.BARCODE_LOOKUP_ENABLED:
+            stage_start = time.perf_counter()
+            barcodes = ocr_client.detect_barcodes(
+                [(image['filename'], data) for image, data in zip(images, image_bytes)],
+                headers={metrics.TRACE_HEADER: trace_id})
+            barcode_product = catalog.find_by_barcode(barcodes)
+            timings['barcode'] = time.perf_counter() - stage_start
+            barcode_store.stats.record(barcodes, barcode_product is not None, timings['barcode'])
+
+        # 2. OCR (skipped for images that were read before or OCR'd with the rest of their basket;
+        # all label faces go in one request)
+        stage_start = time.perf_counter()
+        if barcode_product is not None:
+            logger.info(f"Task {task_id}: Barcode is catalogued, skipping OCR")
+            ocr_text = ""
+        else:
+            texts = payload.get('ocr_texts') or [analysis_cache.get_ocr_text(fp) for fp in fingerprints]
+            missing = [i for i, text in enumerate(texts) if text is None]
+            if not missing:
+                logger.info(f"Task {task_id}: OCR text already available")
+            else:
+                try:
+                    logger.info(f"Task {task_id}: Sending {len(missing)} image(s) to OCR...")
+                    results = ocr_client.extract_texts([(images[i]['filename'], image_bytes[i]) for i in missing],
+                                                       headers={metrics.TRACE_HEADER: trace_id})
+                    for i, text in zip(missing, results):
+                        texts[i] = text
+                        if text:
+                            analysis_cache.store_ocr_text(fingerprints[i], text)
+                    logger.info(f"Task {task_id}: OCR Success")
+                except ocr_client.OCRUnavailable as e:
+                    logger.error(f"Task {task_id}: OCR Error: {e}")
+                    # We continue even if OCR fails, AI might handle empty text or we catch it there
+            ocr_text = "\n\n".join(text for text in texts if text) or "OCR failed"
+
+        timings['ocr'] = time.perf_counter() - stage_start
+        set_task_stage(task, 'OCR_DONE')
 
-            new_scan = ScanHistory(
-                user_id=user_id,
-                product_name=ai_analysis.get('product_name', 'Unknown Product'),
-                health_score=health_score,
-                eco_score=eco_score,
-                image_filename=filename,
-                full_analysis=json.dumps(ai_analysis)
+        # 3. AI Analysis: shared product extraction, then local per-user scoring
+        stage_start = time.perf_counter()
+        ocr_ok = barcode_product is None and ocr_text != "OCR failed"
+        extraction = analysis_cache.get_extraction(ocr_text) if ocr_ok else None
+        known_product = catalog.find_in_ocr_text(ocr_text) if ocr_ok and extraction is None else None
+        local = None
+        if ocr_ok and extraction is None and known_product is None:
+            local = local_extractor.fast_path(ocr_text, timings)
+            # The parsed name and brand may identify a product the LLM already described in full
+            known = catalog.find_by_extraction(local) if local is not None else None
+            if known is not None and catalog.product_extraction(known).get('extraction_source') != 'local':
+                known_product, local = known, None
+        if barcode_product is not None:
+            logger.info(f"Task {task_id}: Barcode hit, product {barcode_product.id}")
+            known_product = barcode_product
+            extraction = catalog.product_extraction(known_product)
+            metrics.SCAN_SOURCES.labels('barcode').inc()
+        elif extraction is not None:
+            logger.info(f"Task {task_id}: Extraction cache hit")
+            metrics.SCAN_SOURCES.labels('cache').inc()
+        elif known_product is not None:
+            logger.info(f"Task {task_id}: Catalog hit, product {known_product.id}")
+            extraction = catalog.product_extraction(known_product)
+            analysis_cache.store_extraction(ocr_text, extraction)
+            metrics.SCAN_SOURCES.labels('catalog').inc()
+        elif local is not None:
+            # The label parser read everything it needed; the LLM can follow up in the background
+            logger.info(f"Task {task_id}: Answered by the local label parser")
+            extraction = local
+            metrics.SCAN_SOURCES.labels('local').inc()
+        else:
+            logger.info(f"Task {task_id}: Starting AI extraction...")
+            llm_started = time.perf_counter()
+            extraction = extract_product_data(
+                ocr_text,
+                on_field=lambda key, value: task_events.publish(
+                    task_id, 'PROCESSING', 'PARTIAL', field=key, value=value),
+                timings=timings,
+                user_id=user_id
             )
-            db.session.add(new_scan)
-            
-            # 4. Update Task
-            final_result = {
-                "structureData": ai_analysis,
-                "healthScore": health_score,
-                "ecoScore": eco_score,
-                "ecoScoreReasoning": ai_analysis.get('eco_score_reasoning', ''),
-                "benefits": nutritional_benefits,
-                "notes": personalized_notes,
-                "context": context,
-                "userPreferences": user_prefs,
-                "detectedAllergens": ai_analysis.get('detected_allergens', []),
-                "productImage": f"/uploads/{filename}"
-            }
-            
-            task.result = json.dumps(final_result)
-            task.status = 'COMPLETED'
-            db.session.commit()
-            logger.info(f"Task {task_id} completed successfully")
-            
+
+            if "error" in extraction:
+                raise ExtractionError(f"AI Analysis failed: {extraction['error']}")
+            metrics.SCAN_SOURCES.labels('llm').inc()
+            local_extractor.stats.record_llm(time.perf_counter() - llm_started)
+            if ocr_ok:
+                analysis_cache.store_extraction(ocr_text, extraction)
+
+        timings['llm'] = time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        ai_analysis = personalize(extraction, user_prefs)
+        ai_analysis['raw_text'] = ocr_text.lower()
+        timings['personalize'] = time.perf_counter() - stage_start
+        set_task_stage(task, 'AI_DONE')
+
+        # 4. Save to History
+        health_score = ai_analysis.get('health_score', 50)
+        eco_score = ai_analysis.get('eco_score', 50)
+
+        # Product data lives once in the catalog; the scan keeps only what is specific to it
+        if known_product is not None:
+            # Keyed by whatever identified it first, which need not match this extraction's name
+            product = catalog.count_scan(known_product)
+        else:
+            product = catalog.upsert_product(extraction)
+        new_scan = ScanHistory(
+            user_id=user_id,
+            product_name=ai_analysis.get('product_name', 'Unknown Product'),
+            health_score=health_score,
+            eco_score=eco_score,
+            verdict=ai_analysis.get('verdict'),
+            image_filename=filename,
+            product_id=product.id if product else None,
+            full_analysis=json.dumps(catalog.scan_overlay(ai_analysis) if product else ai_analysis)
+        )
+        db.session.add(new_scan)
+        db.session.flush()  # assigns new_scan.id, which the chat uses to find this scan
+        if local is not None and product is not None and local_extractor.FAST_PATH_ENRICH:
+            enqueue_enrichment(product, ocr_text)
+        if barcodes and product is not None:
+            # Next time this code is photographed, the scan is answered from the catalog
+            catalog.add_barcodes(product, barcodes)
+        
+        # 5. Update Task: it keeps a reference to the scan; the full result goes out with the COMPLETED event
+        final_result = task_results.build(new_scan, ai_analysis, user_prefs)
+        stage_start = time.perf_counter()
+        # Commits the scan only if this worker still holds the task (raises job_queue.LeaseLost otherwise)
+        job_queue.complete(task, result=task_results.reference(new_scan),
+                           timings=json.dumps({k: round(v, 4) for k, v in timings.items()}))
+        timings['db_commit'] = time.perf_counter() - stage_start
+        task_events.publish(task_id, 'COMPLETED', result=final_result)
+        logger.info(f"Task {task_id} completed successfully")
+
+    except Exception as e:
+        logger.error(f"Task {task_id} failed: {e}", exc_info=True)
+        raise
+
+    finally:
+        for stage, seconds in timings.items():
+            job_queue.stats.record_stage(stage, seconds)
+            metrics.SCAN_STAGE_SECONDS.labels(stage).observe(seconds)
+        logger.info(f"Task {task_id} stage timings: " + ", ".join(f"{k}={v:.3f}s" for k, v in timings.items()))
+
+def enqueue_enrichment(product, ocr_text):
+    """Queue a background LLM extraction for a product the label parser catalogued. Caller commits."""
+    if catalog.product_extraction(product).get('extraction_source') != 'local':
+        return
+    # One follow-up per product, however many scans of it the parser answered in the meantime
+    task = Task(id=f"enrich-{product.id}", kind='enrich', status='PENDING',
+                payload=json.dumps({"product_id": product.id, "ocr_text": ocr_text}))
+    try:
+        with db.session.begin_nested():
+            db.session.add(task)
+            db.session.flush()
+    except IntegrityError:
+        pass
+
+def process_enrich_task(app_instance, task):
+    """Replace a parser-built catalog entry with the LLM's extraction and re-score the scans that use it."""
+    payload = json.loads(task.payload)
+    product = db.session.get(Product, payload['product_id'])
+    if product is None or catalog.product_extraction(product).get('extraction_source') != 'local':
+        logger.info(f"Task {task.id}: nothing to enrich")
+    else:
+        started = time.perf_counter()
+        extraction = extract_product_data(payload['ocr_text'])
+        if "error" in extraction:
+            raise ExtractionError(f"AI Analysis failed: {extraction['error']}")
+        local_extractor.stats.record_llm(time.perf_counter() - started)
+        extraction['extraction_source'] = 'llm'
+        analysis_cache.store_extraction(payload['ocr_text'], extraction)
+        catalog.replace_extraction(product, extraction)
+        rescored = rescore_product_scans(product)
+        logger.info(f"Task {task.id}: product {product.id} enriched, {rescored} scan(s) re-scored")
+    job_queue.complete(task)
+
+def ocr_basket(children, trace_id):
+    """OCR a basket's images in shared batch requests, BATCH_PARALLELISM requests at a time, and attach each
+    text to its child scan's payload. Children whose OCR fails are left to OCR their image themselves."""
+    jobs = []  # (child, payload, filename, bytes, fingerprint)
+    for child in children:
+        payload = json.loads(child.payload)
+        filename = payload['filename']
+        data = (upload_buffer.get(child.id) or [None])[0] or storage.read_original(filename)
+        if data is None:
+            continue
+        fingerprint = analysis_cache.image_fingerprint(data)
+        text = analysis_cache.get_ocr_text(fingerprint)
+        if text is not None:
+            payload['ocr_texts'] = [text]
+            child.payload = json.dumps(payload)
+        else:
+            jobs.append((child, payload, filename, data, fingerprint))
+    if not jobs:
+        return
+    chunks = [jobs[i:i + basket.BATCH_OCR_CHUNK] for i in range(0, len(jobs), basket.BATCH_OCR_CHUNK)]
+    with ThreadPoolExecutor(max_workers=min(basket.BATCH_PARALLELISM, len(chunks))) as pool:
+        futures = {
+            pool.submit(ocr_client.extract_texts, [(filename, data) for _, _, filename, data, _ in chunk],
+                        headers={metrics.TRACE_HEADER: trace_id}): chunk
+            for chunk in chunks
+        }
+        for future in as_completed(futures):
+            try:
+                texts = future.result()
+            except ocr_client.OCRUnavailable as e:
+                logger.error(f"Basket OCR request failed, its scans will retry OCR on their own: {e}")
+                continue
+            for (child, payload, _, _, fingerprint), text in zip(futures[future], texts):
+                if text:
+                    analysis_cache.store_ocr_text(fingerprint, text)
+                    payload['ocr_texts'] = [text]
+                    child.payload = json.dumps(payload)
+
+def process_batch_task(app_instance, task):
+    """Run a basket scan: OCR all of its images together, then its child scans BATCH_PARALLELISM at a
+    time. Completes with the basket's per-product results and comparison."""
+    batch_id = task.id
+    payload = json.loads(task.payload)
+    trace_id = payload.get('trace_id') or batch_id
+    waiting = Task.query.filter_by(batch_id=batch_id, status='WAITING').all()
+    if waiting:
+        stage_start = time.perf_counter()
+        try:
+            ocr_basket(waiting, trace_id)
         except Exception as e:
-            logger.error(f"Task {task_id} failed: {e}", exc_info=True)
-            task.status = 'FAILED'
-            task.result = str(e)
-            db.session.commit()
+            logger.error(f"Batch {batch_id}: basket OCR failed: {e}", exc_info=True)
+        metrics.SCAN_STAGE_SECONDS.labels('batch_ocr').observe(time.perf_counter() - stage_start)
+        # Released whatever happened above, so a basket never strands its scans
+        now = datetime.utcnow()
+        for child in waiting:
+            child.status = 'PENDING'
+            child.stage = 'PENDING'
+            child.available_at = now
+    set_task_stage(task, 'OCR_DONE')
+
+    total = Task.query.filter_by(batch_id=batch_id).count()
+
+    def on_progress(_):
+        finished = total - job_queue.unfinished_in_batch(batch_id)
+        task_events.publish(batch_id, 'PROCESSING', 'PROGRESS', finished=finished, total=total)
+
+    logger.info(f"Batch {batch_id}: running {total} scan(s), {basket.BATCH_PARALLELISM} at a time")
+    job_queue.run_batch(app_instance, run_task, batch_id, basket.BATCH_PARALLELISM, on_progress=on_progress)
+
+    db.session.expire_all()
+    result = basket.batch_view(task, Task.query.filter_by(batch_id=batch_id).all())
+    job_queue.complete(task, result=json.dumps(result))
+    task_events.publish(batch_id, 'COMPLETED', result=result)
+    logger.info(f"Batch {batch_id} completed: {result['counts']}")
+
+TASK_HANDLERS = {
+    'scan': process_scan_task,
+    'batch': process_batch_task,
+    'enrich': process_enrich_task,
+}
+
+def run_task(app_instance, task):
+    """job_queue handler: dispatch a claimed task by its kind."""
+    TASK_HANDLERS[task.kind or 'scan'](app_instance, task)
+
+def get_user_prefs(user):
+    """Normalized preference snapshot of a User row or of the cached current_user."""
+    if isinstance(user, user_cache.CachedUser):
+        return user.prefs
+    return preferences.snapshot(user)
+
+def rescore_history(user):
+    """Re-run local personalization over all of a user's scans. No LLM calls; caller commits."""
+    user_prefs = get_user_prefs(user)
+    rescored = 0
+    for scan in ScanHistory.query.filter_by(user_id=user.id).all():
+        if not scan.full_analysis:
+            continue
+        try:
+            analysis = personalize(catalog.load_scan_analysis(scan), user_prefs)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Skipping re-score of scan {scan.id}: {e}")
+            continue
+        scan.health_score = analysis['health_score']
+        scan.verdict = analysis['verdict']
+        scan.full_analysis = json.dumps(catalog.scan_overlay(analysis) if scan.product_id else analysis)
+        rescored += 1
+    return rescored
+
+def rescore_product_scans(product):
+    """Re-run local personalization over every scan of a product after its catalog data changed. Caller commits."""
+    extraction = catalog.product_extraction(product)
+    prefs_by_user = {}
+    rescored = 0
+    for scan in ScanHistory.query.filter_by(product_id=product.id).all():
+        if scan.user_id not in prefs_by_user:
+            prefs_by_user[scan.user_id] = get_user_prefs(db.session.get(User, scan.user_id))
+        try:
+            analysis = personalize(catalog.merge_scan_analysis(scan, product), prefs_by_user[scan.user_id])
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Skipping re-score of scan {scan.id}: {e}")
+            continue
+        scan.product_name = (extraction.get('product_name') or scan.product_name)[:200]
+        scan.health_score = analysis['health_score']
+        scan.eco_score = analysis.get('eco_score', scan.eco_score)
+        scan.verdict = analysis['verdict']
+        scan.full_analysis = json.dumps(catalog.scan_overlay(analysis))
+        rescored += 1
+    return rescored
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.load(user_id)
 
 @app.route('/')
 def home():
@@ -226,6 +480,7 @@ def api_signup():
 
     hashed_password = generate_password_hash(password, method='pbkdf2:sha256')
     new_user = User(username=username, email=email, password=hashed_password)
+    preferences.refresh(new_user)
     db.session.add(new_user)
     db.session.commit()
     login_user(new_user, remember=True)
@@ -236,6 +491,7 @@ def api_signup():
 @app.route('/api/logout', methods=['POST'])
 @login_required
 def api_logout():
+    user_cache.invalidate(current_user.id)
     logout_user()
     return jsonify({"success": True, "message": "Logged out"})
 
@@ -258,13 +514,18 @@ def api_profile():
         except ValidationError as err:
             return jsonify({"success": False, "message": "Validation error", "errors": err.messages}), 400
             
-        current_user.health_conditions = validated_data.get('healthConditions', '')
-        current_user.allergies = validated_data.get('allergies', '')
-        current_user.diet_type = validated_data.get('dietType', 'general')
-        current_user.ingredients_to_avoid = validated_data.get('ingredientsToAvoid', '')
+        # current_user is a cached copy; the row is loaded to change it
+        user = db.session.get(User, current_user.id)
+        user.health_conditions = validated_data.get('healthConditions', '')
+        user.allergies = validated_data.get('allergies', '')
+        user.diet_type = validated_data.get('dietType', 'general')
+        user.ingredients_to_avoid = validated_data.get('ingredientsToAvoid', '')
+        preferences.refresh(user)
+        rescored = rescore_history(user)
         db.session.commit()
-        logger.info(f"Profile updated for user: {current_user.username}")
-        return jsonify({"success": True, "message": "Profile updated"})
+        user_cache.invalidate(user.id)
+        logger.info(f"Profile updated for user: {user.username}, {rescored} scans re-scored")
+        return jsonify({"success": True, "message": "Profile updated", "rescored": rescored})
 
 @app.route('/api/scan', methods=['POST'])
 @login_required
@@ -275,42 +536,60 @@ def api_scan():
         logger.warning("Scan failed: No image provided in request")
         return jsonify({"success": False, "message": "No image provided"}), 400
     
-    file = request.files['product_image']
-    if file.filename == '':
+    # Several product_image parts may be sent for the faces of one product (front, back, side)
+    uploads = [f for f in request.files.getlist('product_image') if f.filename != '']
+    if not uploads:
         logger.warning("Scan failed: No image selected")
         return jsonify({"success": False, "message": "No image selected"}), 400
+    if len(uploads) > MAX_IMAGES_PER_SCAN:
+        return jsonify({"success": False, "message": f"At most {MAX_IMAGES_PER_SCAN} images per scan"}), 400
     
+    if job_queue.is_full():
+        logger.warning("Scan rejected: queue is full")
+        return jsonify({"success": False, "message": "Scanner is busy, please try again shortly"}), 503
+
     try:
-        # Save the uploaded file to uploads folder
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"{timestamp}_{secure_filename(file.filename)}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        logger.info(f"Image saved: {filename}")
+        upload_started = time.perf_counter()
+        # Store the uploads under content-hash names (a repeated photo is stored once)
+        images = []
+        image_bytes = []
+        for file in uploads:
+            data = file.read()
+            filename = storage.save_original(data, file.filename)
+            image_bytes.append(data)
+            images.append({"filename": filename})
+            logger.info(f"Image saved: {filename}")
+        filename = images[0]['filename']
         
-        # Create Task
+        # Get user preferences
+        user_prefs = get_user_prefs(current_user)
+
+        # Enqueue Task; any worker (embedded threads or worker.py processes) can claim it
         task_id = str(uuid.uuid4())
-        new_task = Task(id=task_id, user_id=current_user.id, status='PENDING')
+        trace_id = metrics.current_trace_id()
+        new_task = Task(
+            id=task_id,
+            user_id=current_user.id,
+            status='PENDING',
+            payload=json.dumps({
+                "filename": filename,
+                "images": images,
+                "user_prefs": user_prefs,
+                "trace_id": trace_id
+            })
+        )
+        if SCAN_INLINE_UPLOADS:
+            upload_buffer.set(task_id, image_bytes)
         db.session.add(new_task)
         db.session.commit()
-        
-        # Get user preferences
-        user_prefs = {
-            'health_conditions': current_user.health_conditions.lower(),
-            'allergies': current_user.allergies.lower(),
-            'diet_type': current_user.diet_type.lower(),
-            'ingredients_to_avoid': current_user.ingredients_to_avoid.lower()
-        }
-        
-        # Submit to background executor
-        # Pass app (for context), IDs, and raw data needed
-        # app is the concrete Flask instance here, so we pass it directly
-        executor.submit(process_scan_task, app, task_id, filename, filepath, user_prefs, current_user.id)
+        metrics.SCAN_STAGE_SECONDS.labels('upload').observe(time.perf_counter() - upload_started)
+        logger.info(f"Task {task_id} queued (trace {trace_id})")
         
         return jsonify({
             "success": True, 
             "message": "Scan processing started",
-            "task_id": task_id
+            "task_id": task_id,
+            "trace_id": trace_id
         }), 202
 
     except Exception as e:
@@ -324,13 +603,97 @@ def api_scan():
             
         return jsonify({"success": False, "message": f"Server Error: {str(e)}"}), 500
 
-@app.route('/api/tasks/<task_id>', methods=['GET'])
+@app.route('/api/scan/batch', methods=['POST'])
 @login_required
-def api_get_task(task_id):
-    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first()
-    if not task:
-        return jsonify({"success": False, "message": "Task not found"}), 404
-    
+def api_scan_batch():
+    """Scan a shopping basket: each product_image part is a different product (one photo each)."""
+    uploads = [f for f in request.files.getlist('product_image') if f.filename != '']
+    if not uploads:
+        return jsonify({"success": False, "message": "No image provided"}), 400
+    if len(uploads) > basket.BATCH_MAX_ITEMS:
+        return jsonify({"success": False, "message": f"At most {basket.BATCH_MAX_ITEMS} products per basket"}), 400
+    if job_queue.is_full():
+        logger.warning("Basket scan rejected: queue is full")
+        return jsonify({"success": False, "message": "Scanner is busy, please try again shortly"}), 503
+
+    try:
+        upload_started = time.perf_counter()
+        user_prefs = get_user_prefs(current_user)
+        batch_id = str(uuid.uuid4())
+        trace_id = metrics.current_trace_id()
+        # Children wait for the basket's shared OCR pass; the batch task releases them to the queue
+        children = []
+        for index, file in enumerate(uploads):
+            data = file.read()
+            filename = storage.save_original(data, file.filename)
+            child = Task(
+                id=str(uuid.uuid4()),
+                user_id=current_user.id,
+                batch_id=batch_id,
+                status='WAITING',
+                stage='WAITING',
+                payload=json.dumps({
+                    "filename": filename,
+                    "images": [{"filename": filename}],
+                    "user_prefs": user_prefs,
+                    "trace_id": trace_id,
+                    "batch_index": index
+                })
+            )
+            if SCAN_INLINE_UPLOADS:
+                upload_buffer.set(child.id, [data])
+            children.append(child)
+        parent = Task(
+            id=batch_id,
+            kind='batch',
+            user_id=current_user.id,
+            status='PENDING',
+            payload=json.dumps({"items": len(children), "trace_id": trace_id})
+        )
+        db.session.add(parent)
+        db.session.add_all(children)
+        db.session.commit()
+        metrics.SCAN_STAGE_SECONDS.labels('upload').observe(time.perf_counter() - upload_started)
+        logger.info(f"Basket {batch_id} queued with {len(children)} product(s) (trace {trace_id})")
+
+        return jsonify({
+            "success": True,
+            "message": "Basket scan started",
+            "batch_id": batch_id,
+            "task_ids": [child.id for child in children],
+            "trace_id": trace_id
+        }), 202
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error initiating basket scan: {e}", exc_info=True)
+        return jsonify({"success": False, "message": f"Server Error: {str(e)}"}), 500
+
+@app.route('/api/scan/batch/<batch_id>', methods=['GET'])
+@login_required
+def api_get_batch(batch_id):
+    """Progress of a basket scan, each product's result and the products ranked by health and eco score."""
+    parent = Task.query.filter_by(id=batch_id, kind='batch', user_id=current_user.id).first()
+    if not parent:
+        return jsonify({"success": False, "message": "Basket not found"}), 404
+    children = Task.query.filter_by(batch_id=batch_id).all()
+    return jsonify({"success": True, "data": basket.batch_view(parent, children)})
+
+def task_result(task, user_prefs):
+    """Result of a completed task, built from its scan when it stores a reference (see task_results).
+    None if the task has not completed, or its scan was deleted since."""
+    if task.status != 'COMPLETED':
+        return None
+    scan_id = task_results.referenced_scan(task)
+    if scan_id is None:
+        return json.loads(task.result)
+    scan = db.session.get(ScanHistory, scan_id)
+    if scan is None:
+        return None
+    return task_results.build(scan, catalog.load_scan_analysis(scan), user_prefs)
+
+def serialize_task(task, result=None):
+    """A task for the polling endpoint; `result` is task_result() of a completed task."""
     response = {
         "id": task.id,
         "status": task.status,
@@ -338,30 +701,137 @@ def api_get_task(task_id):
     }
     
     if task.status == 'COMPLETED':
-        response["result"] = json.loads(task.result)
+        response["result"] = result
     elif task.status == 'FAILED':
         response["error"] = task.result
+    return response
+
+def task_event(task, result=None):
+    """Current state of a task as a task event (what the SSE stream sends)."""
+    event = {"status": task.status, "stage": task.stage or task.status}
+    if task.status == 'COMPLETED':
+        event["result"] = result
+    elif task.status == 'FAILED':
+        event["error"] = task.result
+    return event
+
+def format_task_event(event):
+    return f"event: {event['stage'].lower()}\ndata: {json.dumps(event)}\n\n"
+
+@app.route('/api/tasks/<task_id>', methods=['GET'])
+@login_required
+def api_get_task(task_id):
+    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first()
+    if not task:
+        return jsonify({"success": False, "message": "Task not found"}), 404
         
-    return jsonify({"success": True, "data": response})
+    return jsonify({"success": True, "data": serialize_task(task, task_result(task, get_user_prefs(current_user)))})
+
+@app.route('/api/tasks/<task_id>/events', methods=['GET'])
+@login_required
+def api_task_events(task_id):
+    """Server-Sent Events stream of a task's state transitions, ending at COMPLETED or FAILED."""
+    task = Task.query.filter_by(id=task_id, user_id=current_user.id).first()
+    if not task:
+        return jsonify({"success": False, "message": "Task not found"}), 404
+
+    user_prefs = get_user_prefs(current_user)
+
+    def task_snapshot():
+        task = db.session.get(Task, task_id)
+        event = task_event(task, task_result(task, user_prefs))
+        db.session.rollback()  # end the read transaction; this connection may stay open for a while
+        return event
+
+    def stream():
+        subscription = task_events.bus.subscribe(task_id)
+        try:
+            event = task_snapshot()
+            yield format_task_event(event)
+            last_stage = event["stage"]
+            while event["status"] not in task_events.TERMINAL_STATUSES:
+                try:
+                    event = subscription.get(timeout=TASK_EVENTS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    # Another process may be running the task; check the row directly
+                    event = task_snapshot()
+                    if event["stage"] == last_stage:
+                        yield ": keepalive\n\n"
+                        continue
+                if event["stage"] != 'PARTIAL':
+                    last_stage = event["stage"]
+                yield format_task_event(event)
+        finally:
+            task_events.bus.unsubscribe(task_id, subscription)
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/history', methods=['GET'])
 @login_required
 def api_history():
-    history_items = ScanHistory.query.filter_by(user_id=current_user.id).order_by(ScanHistory.timestamp.desc()).all()
+    """
+    Newest-first page of the user's scans. Query params: limit, cursor (from the previous
+    page's nextCursor), minHealth/maxHealth, minEco/maxEco, verdict, q (product name search).
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        filters = {name: int(request.args[name]) for name in ('minHealth', 'maxHealth', 'minEco', 'maxEco')
+                   if request.args.get(name, '') != ''}
+        cursor = request.args.get('cursor')
+        if cursor:
+            cursor_time, cursor_id = cursor.rsplit('_', 1)
+            cursor_time, cursor_id = datetime.fromisoformat(cursor_time), int(cursor_id)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid pagination or filter parameters"}), 400
+
+    # Never load full_analysis here; the list view only needs these columns
+    query = db.session.query(
+        ScanHistory.id,
+        ScanHistory.product_name,
+        ScanHistory.health_score,
+        ScanHistory.eco_score,
+        ScanHistory.verdict,
+        ScanHistory.image_filename,
+        ScanHistory.timestamp,
+    ).filter(ScanHistory.user_id == current_user.id)
+
+    if 'minHealth' in filters:
+        query = query.filter(ScanHistory.health_score >= filters['minHealth'])
+    if 'maxHealth' in filters:
+        query = query.filter(ScanHistory.health_score <= filters['maxHealth'])
+    if 'minEco' in filters:
+        query = query.filter(ScanHistory.eco_score >= filters['minEco'])
+    if 'maxEco' in filters:
+        query = query.filter(ScanHistory.eco_score <= filters['maxEco'])
+    if request.args.get('verdict'):
+        query = query.filter(ScanHistory.verdict == request.args['verdict'].lower())
+    if request.args.get('q'):
+        query = query.filter(ScanHistory.product_name.ilike(database.contains_pattern(request.args['q']), escape='\\'))
+    if cursor:
+        query = query.filter(db.or_(
+            ScanHistory.timestamp < cursor_time,
+            db.and_(ScanHistory.timestamp == cursor_time, ScanHistory.id < cursor_id)
+        ))
+
+    rows = query.order_by(ScanHistory.timestamp.desc(), ScanHistory.id.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
     history_data = []
-    
-    for item in history_items:
+    for item in rows:
         history_data.append({
             "id": item.id,
             "productName": item.product_name,
             "healthScore": item.health_score,
             "ecoScore": item.eco_score,
-            "image": f"/uploads/{item.image_filename}",
+            "verdict": item.verdict,
+            "image": storage.image_url(item.image_filename, 'thumb'),
             "timestamp": item.timestamp.isoformat(),
-            # Parse the full analysis back to JSON if needed, or send specific fields
         })
-    
-    return jsonify({"success": True, "data": history_data})
+
+    next_cursor = f"{rows[-1].timestamp.isoformat()}_{rows[-1].id}" if has_more else None
+    return jsonify({"success": True, "data": history_data, "nextCursor": next_cursor})
 
 @app.route('/api/history/clear', methods=['POST'])
 @login_required
@@ -376,26 +846,200 @@ def api_history_clear():
         db.session.rollback()
         return jsonify({"success": False, "message": "Failed to clear history"}), 500
 
+@app.route('/api/history/rescore', methods=['POST'])
+@login_required
+def api_history_rescore():
+    rescored = rescore_history(current_user)
+    db.session.commit()
+    logger.info(f"Re-scored {rescored} scans for user: {current_user.username}")
+    return jsonify({"success": True, "rescored": rescored})
+
+@app.route('/api/products/search', methods=['GET'])
+@login_required
+def api_products_search():
+    """Search the product catalog by name, brand or ingredient (e.g. ?q=palm oil)."""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid limit"}), 400
+    if not query:
+        return jsonify({"success": False, "message": "Query parameter q is required"}), 400
+    products = catalog.search(query, limit=limit)
+    return jsonify({"success": True, "data": [catalog.serialize_product(p) for p in products]})
+
+def image_response(data, mimetype, etag):
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = storage.CACHE_CONTROL
+    return response.make_conditional(request)
+
+@app.route('/images/<variant>/<filename>')
+def image_variant(variant, filename):
+    """WebP thumbnail or web copy of an upload, e.g. /images/thumb/<hash>.webp"""
+    stem, extension = os.path.splitext(filename)
+    if variant not in storage.VARIANTS or extension != '.webp' or not storage.valid_stem(stem):
+        return jsonify({"success": False, "message": "Image not found"}), 404
+    etag = storage.etag(stem, variant)
+    if request.if_none_match.contains(etag):
+        return image_response(b'', 'image/webp', etag)
+    data = storage.load_derivative(stem, variant)
+    if data is None:
+        return jsonify({"success": False, "message": "Image not found"}), 404
+    return image_response(data, 'image/webp', etag)
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    # secure_filename prevents directory traversal info, so filename is safe to use directly from the URL
-    # as long as we serve from the UPLOAD_FOLDER
-    from flask import send_from_directory
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    # Full-size originals; once purged by the retention policy, the web copy is served instead
+    if not storage.valid_original(filename):
+        return jsonify({"success": False, "message": "Image not found"}), 404
+    data, mimetype = storage.load_original(filename)
+    if data is None:
+        return jsonify({"success": False, "message": "Image not found"}), 404
+    return image_response(data, mimetype, storage.etag(filename, 'original'))
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+def api_cache_stats():
+    return jsonify({"success": True, "data": {**analysis_cache.cache_stats(), "chat": chat.cache_stats(),
+                                              "fastPath": local_extractor.stats.snapshot(),
+                                              "barcode": barcode_store.stats.snapshot(),
+                                              "users": user_cache.cache_stats(),
+                                              "storage": retention.stats.snapshot(),
+                                              "dbQueries": database.query_stats.snapshot()}})
+
+@app.route('/api/queue/stats', methods=['GET'])
+@login_required
+def api_queue_stats():
+    return jsonify({"success": True, "data": job_queue.queue_stats()})
+
+@app.route('/api/llm/stats', methods=['GET'])
+@login_required
+def api_llm_stats():
+    return jsonify({"success": True, "data": llm_router.route_stats()})
+
+@app.route('/api/ocr/stats', methods=['GET'])
+@login_required
+def api_ocr_stats():
+    return jsonify({"success": True, "data": ocr_client.ocr_stats()})
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (unauthenticated; restrict it at the proxy if exposed publicly)."""
+    metrics.QUEUE_DEPTH.set(job_queue.queue_depth())
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+def chat_context(data):
+    """Context for a chat message: built from the user's scan (by scanId or taskId), else the legacy string."""
+    scan_id = data.get('scanId')
+    task_id = data.get('taskId')
+    if scan_id is None and task_id:
+        task = Task.query.filter_by(id=task_id, user_id=current_user.id).first()
+        if task is None or task.status != 'COMPLETED':
+            return None
+        scan_id = json.loads(task.result).get('scanId')
+    if scan_id is None:
+        return str(data.get('context', ''))[:chat.CHAT_CONTEXT_MAX_CHARS]
+    scan = ScanHistory.query.filter_by(id=scan_id, user_id=current_user.id).first()
+    if scan is None:
+        return None
+    return chat.build_context(catalog.load_scan_analysis(scan), get_user_prefs(current_user))
 
 @app.route('/api/chat', methods=['POST'])
 @login_required
 def api_chat():
-    data = request.get_json()
+    """Answer a question about a scan. Body: {query, scanId} or {query, taskId}."""
+    data = request.get_json() or {}
     user_text = data.get('query', '')
-    context = data.get('context', '')
+    context = chat_context(data)
+    if context is None:
+        return jsonify({"success": False, "message": "Scan not found"}), 404
+
+    reply, source = chat.answer(user_text, context, current_user.id)
+    return jsonify({"response": reply, "source": source}), 429 if source == 'limited' else 200
 
-    reply = chat_with_groq(user_text, context)
-    return jsonify({"response": reply})
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required
+def api_chat_stream():
+    """Server-Sent Events version of /api/chat: `token` events as they arrive, then `done` or `error`."""
+    data = request.get_json() or {}
+    user_text = data.get('query', '')
+    context = chat_context(data)
+    if context is None:
+        return jsonify({"success": False, "message": "Scan not found"}), 404
 
-# Create DB tables if they don't exist
+    user_id = current_user.id
+
+    def stream():
+        # Werkzeug closes this generator when the client disconnects, which cancels the Groq stream
+        answer = chat.stream_answer(user_text, context, user_id)
+        try:
+            for event, payload in answer:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            answer.close()
+
+    return Response(stream_with_context(stream()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.before_request
+def start_scan_workers():
+    job_queue.ensure_embedded_workers(app, run_task)
+
+# Bring the schema up to date (set DB_AUTO_MIGRATE=false to run `flask db upgrade` as a deploy step instead)
 with app.app_context():
-    db.create_all()
+    if database.DB_AUTO_MIGRATE:
+        database.migrate_schema()
+    catalog.ensure_search_index()
+
+@app.cli.command('purge-originals')
+@click.option('--days', type=int, default=storage.STORAGE_ORIGINALS_RETENTION_DAYS, show_default=True,
+              help="Delete originals older than this many days (0 keeps them)")
+def purge_originals_command(days):
+    """Delete old full-size uploads, keeping their thumbnails and web copies."""
+    # Scans still waiting in the queue need their originals for OCR
+    keep = set()
+    for (payload,) in db.session.query(Task.payload).filter(Task.status.in_(('WAITING', 'PENDING', 'PROCESSING'))):
+        for image in json.loads(payload or '{}').get('images', []):
+            keep.add(image['filename'])
+    deleted, freed = storage.purge_originals(days, keep=keep)
+    click.echo(f"Deleted {deleted} originals, freed {freed / 1e6:.1f} MB")
+
+@app.cli.command('compact-storage')
+@click.option('--dry-run', is_flag=True, help="Only report what would be reclaimed")
+def compact_storage_command(dry_run):
+    """Compact stored results and analyses, delete expired tasks and orphaned images, and report the space."""
+    before = retention.report()
+    summary = retention.compact(dry_run=dry_run)
+    after = before if dry_run else retention.report()
+    verb = "Would rewrite" if dry_run else "Rewrote"
+    click.echo(f"{verb} {summary['taskResults']} task results as scan references and compressed "
+               f"{summary['analyses']} analyses")
+    click.echo(f"{'Would delete' if dry_run else 'Deleted'} {summary['tasksExpired']} expired tasks and "
+               f"{summary['imagesDeleted']} orphaned images ({summary['imageBytesFreed'] / 1e6:.1f} MB)")
+    for name, entry in after['tables'].items():
+        sizes = ", ".join(f"{column} {before['tables'][name]['bytes'][column] / 1e6:.2f} -> {stored / 1e6:.2f} MB"
+                          for column, stored in entry['bytes'].items())
+        click.echo(f"  {name}: {before['tables'][name]['rows']} -> {entry['rows']} rows; {sizes}")
+    for folder, usage in after['uploads'].items():
+        click.echo(f"  uploads/{folder}: {before['uploads'][folder]['files']} -> {usage['files']} files, "
+                   f"{before['uploads'][folder]['bytes'] / 1e6:.2f} -> {usage['bytes'] / 1e6:.2f} MB")
+    if before['databaseBytes'] is None:
+        return
+    if dry_run:
+        click.echo(f"Database: {before['databaseBytes'] / 1e6:.2f} MB")
+    else:
+        click.echo(f"Database: {before['databaseBytes'] / 1e6:.2f} MB -> {after['databaseBytes'] / 1e6:.2f} MB, "
+                   f"reclaimed {(before['databaseBytes'] - after['databaseBytes']) / 1e6:.2f} MB")
+
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+def import_products_command(path):
+    """Load an offline product dataset (JSON Lines or CSV) into the catalog for barcode lookups."""
+    counts = barcode_store.import_products(path)
+    click.echo(f"Imported {counts['imported']} products, linked {counts['linked']} existing, "
+               f"{counts['known']} barcodes already known, {counts['skipped']} records skipped")
 
 if __name__ == '__main__':
     app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
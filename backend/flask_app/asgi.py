@@ -0,0 +1,259 @@
+"""ASGI entry point: the Flask app plus async versions of its long-lived endpoints.
+
+    uvicorn asgi:app --port 5000
+
+Task event streams, task polling and chat (streamed or not) run on the event
+loop with an async database engine and the async Groq client, so a waiting
+browser costs a coroutine instead of a server thread. Every other /api/*
+route is served by the Flask app unchanged, with the same session cookie
+(users log in through Flask; these endpoints read its signed session or
+remember cookie). Scans still run on the job queue workers.
+"""
+import asyncio
+import json
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from flask_login.utils import decode_cookie
+from itsdangerous import BadSignature
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import app as flask_module
+import catalog
+import chat
+import database
+import job_queue
+import metrics
+import task_events
+import task_results
+import user_cache
+from models import Product, ScanHistory, Task, User
+
+logger = logging.getLogger(__name__)
+
+flask_app = flask_module.app
+DATABASE_URL = database.async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(DATABASE_URL, **database.async_engine_options(DATABASE_URL))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+@asynccontextmanager
+async def lifespan(api):
+    job_queue.ensure_embedded_workers(flask_app, flask_module.run_task)
+    yield
+    await engine.dispose()
+
+
+app = FastAPI(title="EcoScan API", lifespan=lifespan)
+# flask-cors only covers the mounted Flask app; this is the same policy for every route, native ones included
+app.add_middleware(CORSMiddleware, allow_origins=flask_module.CORS_ORIGINS, allow_credentials=True,
+                   allow_methods=['*'], allow_headers=['*'])
+
+
+@app.middleware('http')
+async def trace_and_time(request: Request, call_next):
+    """Trace id and latency for the async routes; the mounted Flask app does its own."""
+    started = time.perf_counter()
+    trace_id = request.headers.get(metrics.TRACE_HEADER) or uuid.uuid4().hex
+    response = await call_next(request)
+    route = request.scope.get('route')
+    if getattr(route, 'path', None) and metrics.TRACE_HEADER not in response.headers:
+        response.headers[metrics.TRACE_HEADER] = trace_id
+        metrics.HTTP_REQUEST_SECONDS.labels(request.method, route.path, response.status_code).observe(
+            time.perf_counter() - started)
+    return response
+
+
+def session_user_id(request):
+    """The logged-in user's id from Flask's session cookie (or Flask-Login's remember cookie)."""
+    session = {}
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if cookie:
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        try:
+            session = serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            session = {}
+    if '_user_id' in session:
+        return session['_user_id']
+    remember = request.cookies.get(flask_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token'))
+    if remember and session.get('_remember') != 'clear':
+        with flask_app.app_context():
+            return decode_cookie(remember)
+    return None
+
+
+async def current_user(request, session):
+    """The cached logged-in user (see user_cache), read from the database only on a miss."""
+    user_id = session_user_id(request)
+    if user_id is None:
+        return None
+    cached = user_cache.cache.get(int(user_id))
+    if cached is not None:
+        return cached
+    user = await session.get(User, int(user_id))
+    return user_cache.remember(user) if user is not None else None
+
+
+def unauthorized():
+    return JSONResponse({"success": False, "message": "Authentication required"}, status_code=401)
+
+
+def not_found(message):
+    return JSONResponse({"success": False, "message": message}, status_code=404)
+
+
+async def user_task(session, task_id, user):
+    result = await session.execute(select(Task).filter_by(id=task_id, user_id=user.id))
+    return result.scalar_one_or_none()
+
+
+async def task_result(session, task, user):
+    """Async version of app.task_result."""
+    if task.status != 'COMPLETED':
+        return None
+    scan_id = task_results.referenced_scan(task)
+    if scan_id is None:
+        return json.loads(task.result)
+    scan = await session.get(ScanHistory, scan_id)
+    if scan is None:
+        return None
+    product = await session.get(Product, scan.product_id) if scan.product_id is not None else None
+    return task_results.build(scan, catalog.merge_scan_analysis(scan, product), flask_module.get_user_prefs(user))
+
+
+@app.get('/api/tasks/{task_id}')
+async def api_get_task(task_id: str, request: Request):
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return unauthorized()
+        task = await user_task(session, task_id, user)
+        if task is None:
+            return not_found("Task not found")
+        return {"success": True, "data": flask_module.serialize_task(task, await task_result(session, task, user))}
+
+
+@app.get('/api/tasks/{task_id}/events')
+async def api_task_events(task_id: str, request: Request):
+    """Server-Sent Events stream of a task's state transitions, ending at COMPLETED or FAILED."""
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return unauthorized()
+        if await user_task(session, task_id, user) is None:
+            return not_found("Task not found")
+
+    async def task_snapshot():
+        async with Session() as session:
+            task = await session.get(Task, task_id)
+            return flask_module.task_event(task, await task_result(session, task, user))
+
+    async def stream():
+        subscription = task_events.bus.subscribe(task_id, task_events.AsyncSubscription())
+        try:
+            event = await task_snapshot()
+            yield flask_module.format_task_event(event)
+            last_stage = event["stage"]
+            while event["status"] not in task_events.TERMINAL_STATUSES:
+                try:
+                    event = await subscription.get(flask_module.TASK_EVENTS_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    # Another process may be running the task; check the row directly
+                    event = await task_snapshot()
+                    if event["stage"] == last_stage:
+                        yield ": keepalive\n\n"
+                        continue
+                if event["stage"] != 'PARTIAL':
+                    last_stage = event["stage"]
+                yield flask_module.format_task_event(event)
+        finally:
+            task_events.bus.unsubscribe(task_id, subscription)
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+async def chat_context(session, user, data):
+    """Async version of app.chat_context."""
+    scan_id = data.get('scanId')
+    task_id = data.get('taskId')
+    if scan_id is None and task_id:
+        task = await user_task(session, task_id, user)
+        if task is None or task.status != 'COMPLETED':
+            return None
+        scan_id = json.loads(task.result).get('scanId')
+    if scan_id is None:
+        return str(data.get('context', ''))[:chat.CHAT_CONTEXT_MAX_CHARS]
+    result = await session.execute(select(ScanHistory).filter_by(id=scan_id, user_id=user.id))
+    scan = result.scalar_one_or_none()
+    if scan is None:
+        return None
+    product = await session.get(Product, scan.product_id) if scan.product_id is not None else None
+    return chat.build_context(catalog.merge_scan_analysis(scan, product), flask_module.get_user_prefs(user))
+
+
+async def chat_request(request):
+    """(query, context, user id, error response) for a chat request."""
+    try:
+        data = await request.json() or {}
+    except ValueError:
+        data = {}
+    async with Session() as session:
+        user = await current_user(request, session)
+        if user is None:
+            return None, None, None, unauthorized()
+        context = await chat_context(session, user, data)
+    if context is None:
+        return None, None, None, not_found("Scan not found")
+    return data.get('query', ''), context, user.id, None
+
+
+@app.post('/api/chat')
+async def api_chat(request: Request):
+    """Answer a question about a scan. Body: {query, scanId} or {query, taskId}."""
+    query, context, user_id, error = await chat_request(request)
+    if error:
+        return error
+    parts, source = [], 'error'
+    async for event, payload in chat.astream_answer(query, context, user_id):
+        if event == 'token':
+            parts.append(payload['text'])
+        elif event == 'done':
+            source = payload['source']
+        else:
+            parts = [payload['message']]
+            source = 'limited' if payload.get('limited') else 'error'
+    return JSONResponse({"response": "".join(parts), "source": source},
+                        status_code=429 if source == 'limited' else 200)
+
+
+@app.post('/api/chat/stream')
+async def api_chat_stream(request: Request):
+    """Server-Sent Events version of /api/chat: `token` events as they arrive, then `done` or `error`."""
+    query, context, user_id, error = await chat_request(request)
+    if error:
+        return error
+
+    async def stream():
+        # The server cancels this when the client disconnects, which closes the Groq stream
+        answer = chat.astream_answer(query, context, user_id)
+        try:
+            async for event, payload in answer:
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        finally:
+            await answer.aclose()
+
+    return StreamingResponse(stream(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+
+# Everything else (auth, scans, history, profile, images, metrics) is the Flask app
+app.mount('/', WSGIMiddleware(flask_app))
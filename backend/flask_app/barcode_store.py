@@ -0,0 +1,166 @@
+"""Barcode lookups: answer a scan from the catalog when its photo shows a known EAN/UPC code.
+
+The OCR service decodes barcodes (POST /barcode) before any OCR is run. A code
+that the catalog already links to a product returns that product's analysis
+without OCR or an LLM call. Codes are learned from completed scans, and can be
+bulk-imported from an offline dataset:
+
+    flask --app app import-products products.jsonl
+
+The dataset is JSON Lines or CSV/TSV, one product per record with a `code` (or
+`barcode`). A record is either an EcoScan extraction (the fields of
+analysis_cache.PRODUCT_FIELDS) or an Open Food Facts product (product_name,
+brands, ingredients_text, packaging, nutriments or flat *_100g columns), which
+is scored with the local label parser.
+"""
+import csv
+import json
+import logging
+import os
+import threading
+
+from analysis_cache import PRODUCT_FIELDS
+import catalog
+import local_extractor
+from models import db
+
+logger = logging.getLogger(__name__)
+
+BARCODE_LOOKUP_ENABLED = os.getenv('BARCODE_LOOKUP_ENABLED', 'true').lower() == 'true'
+IMPORT_BATCH_SIZE = 500
+
+# Open Food Facts nutriment (per 100 g) -> label line the parser reads, and the unit it is printed in
+OFF_NUTRIENTS = (
+    ('energy-kcal_100g', 'Energy', 'kcal'),
+    ('proteins_100g', 'Protein', 'g'),
+    ('carbohydrates_100g', 'Total Carbohydrate', 'g'),
+    ('sugars_100g', 'Total Sugars', 'g'),
+    ('fat_100g', 'Total Fat', 'g'),
+    ('fiber_100g', 'Dietary Fibre', 'g'),
+    ('salt_100g', 'Salt', 'g'),
+)
+
+
+class BarcodeStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.scans = 0
+        self.with_barcode = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def record(self, codes, hit, seconds):
+        with self._lock:
+            self.scans += 1
+            self.with_barcode += 1 if codes else 0
+            self.hits += 1 if hit else 0
+            self.seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": BARCODE_LOOKUP_ENABLED,
+                "scans": self.scans,
+                "withBarcode": self.with_barcode,
+                "hits": self.hits,
+                "hitRatio": round(self.hits / self.scans, 4) if self.scans else 0.0,
+                "avgLookupSeconds": round(self.seconds / self.scans, 4) if self.scans else 0.0,
+            }
+
+
+stats = BarcodeStats()
+
+
+# --- Dataset import ----------------------------------------------------------
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def from_open_food_facts(record):
+    """Extraction for an Open Food Facts product, built by running the label parser over its fields."""
+    nutriments = record.get('nutriments') if isinstance(record.get('nutriments'), dict) else record
+    lines = [f"Ingredients: {record.get('ingredients_text') or ''}", "Nutrition Information per 100g"]
+    for key, label, unit in OFF_NUTRIENTS:
+        value = _number(nutriments.get(key))
+        if value is not None:
+            lines.append(f"{label} {value:g} {unit}")
+    if record.get('packaging'):
+        lines.append(f"Packaging: {record['packaging']}")
+    extraction, _ = local_extractor.parse_label("\n".join(lines))
+    extraction['product_name'] = (record.get('product_name') or '').strip() or extraction['product_name']
+    extraction['other_info']['brand'] = (record.get('brands') or '').split(',')[0].strip()
+    if record.get('quantity'):
+        extraction['other_info']['net_quantity'] = record['quantity']
+    return extraction
+
+
+def extraction_from_record(record):
+    if isinstance(record.get('ingredients'), list) and 'base_health_score' in record:
+        extraction = {field: record.get(field) for field in PRODUCT_FIELDS}
+    else:
+        extraction = from_open_food_facts(record)
+    extraction['extraction_source'] = 'import'
+    return extraction
+
+
+def read_records(path):
+    """Records of a JSON Lines or CSV/TSV dataset file."""
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.endswith(('.jsonl', '.json', '.ndjson')):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            sample = f.read(4096)
+            f.seek(0)
+            dialect = csv.Sniffer().sniff(sample, delimiters=',\t;')
+            yield from csv.DictReader(f, dialect=dialect)
+
+
+def normalize_code(value):
+    """A dataset's barcode as a GTIN the OCR service would report (UPC-A widened to EAN-13), or None."""
+    code = str(value or '').strip()
+    if not code.isdigit() or len(code) not in (8, 12, 13, 14):
+        return None
+    digits = [int(d) for d in code]
+    total = sum(d * (3 if i % 2 == 0 else 1) for i, d in enumerate(reversed(digits[:-1])))
+    if (10 - total % 10) % 10 != digits[-1]:
+        return None
+    return code.zfill(13) if len(code) == 12 else code
+
+
+def import_products(path):
+    """Add a dataset's products to the catalog and link their barcodes. Returns counts by outcome.
+    Products the LLM already described keep their data; only the barcode is added."""
+    counts = {"imported": 0, "linked": 0, "known": 0, "skipped": 0}
+    for number, record in enumerate(read_records(path), start=1):
+        code = normalize_code(record.get('code') or record.get('barcode'))
+        if code is None:
+            counts['skipped'] += 1
+            continue
+        if catalog.find_by_barcode([code]) is not None:
+            counts['known'] += 1
+            continue
+        extraction = extraction_from_record(record)
+        existing = catalog.find_by_extraction(extraction)
+        if existing is not None:
+            if catalog.product_extraction(existing).get('extraction_source') == 'local':
+                catalog.replace_extraction(existing, extraction)
+            product = existing
+            counts['linked'] += 1
+        else:
+            product = catalog.upsert_product(extraction, scanned=False, barcode=code)
+            if product is None:
+                counts['skipped'] += 1
+                continue
+            counts['imported'] += 1
+        catalog.add_barcodes(product, [code], source='import')
+        if number % IMPORT_BATCH_SIZE == 0:
+            db.session.commit()
+    db.session.commit()
+    logger.info(f"Imported {path}: {counts}")
+    return counts
@@ -0,0 +1,118 @@
+"""Basket scans: many products uploaded in one request and compared side by side.
+
+A basket is a parent Task of kind 'batch' with one child scan Task per
+product (Task.batch_id). Children start WAITING; the worker that claims the
+parent OCRs every image in shared /ocr/batch requests, releases the children
+to the queue with their text attached, and then runs them BATCH_PARALLELISM
+at a time (idle workers elsewhere help). The basket's status and comparison
+are always computed from its children. If the basket task itself fails,
+the children still WAITING fail with it (job_queue.fail_waiting_children).
+"""
+import json
+import os
+
+import storage
+import task_results
+from models import db, ScanHistory
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '20'))
+BATCH_PARALLELISM = int(os.getenv('BATCH_PARALLELISM', '4'))
+BATCH_OCR_CHUNK = int(os.getenv('BATCH_OCR_CHUNK', '8'))  # images per OCR request; at most the service's OCR_MAX_BATCH
+
+UNFINISHED_STATUSES = ('WAITING', 'PENDING', 'PROCESSING')
+
+
+def _index(child):
+    return json.loads(child.payload or '{}').get('batch_index', 0)
+
+
+def referenced_scans(children):
+    """Scan columns the items show, by scan id, for the children whose result refers to their scan."""
+    ids = [scan_id for scan_id in map(task_results.referenced_scan, children) if scan_id is not None]
+    if not ids:
+        return {}
+    rows = db.session.query(ScanHistory.id, ScanHistory.product_name, ScanHistory.health_score,
+                            ScanHistory.eco_score, ScanHistory.verdict).filter(ScanHistory.id.in_(ids))
+    return {row.id: row for row in rows}
+
+
+def item_view(child, scans):
+    payload = json.loads(child.payload or '{}')
+    item = {
+        "taskId": child.id,
+        "index": payload.get('batch_index', 0),
+        "status": child.status,
+        "stage": child.stage or child.status,
+        "image": storage.image_url(payload.get('filename'), 'thumb'),
+        "scanId": None,
+        "productName": None,
+        "healthScore": None,
+        "ecoScore": None,
+        "verdict": None,
+    }
+    scan_id = task_results.referenced_scan(child)
+    if scan_id is not None:
+        scan = scans.get(scan_id)  # missing once the user cleared their history
+        if scan is not None:
+            item.update(scanId=scan.id, productName=scan.product_name, healthScore=scan.health_score,
+                        ecoScore=scan.eco_score, verdict=scan.verdict)
+    elif child.status == 'COMPLETED':
+        # Completed before results were stored as references
+        result = json.loads(child.result)
+        analysis = result.get('structureData') or {}
+        item.update(scanId=result.get('scanId'), productName=analysis.get('product_name'),
+                    healthScore=result.get('healthScore'), ecoScore=result.get('ecoScore'),
+                    verdict=analysis.get('verdict'))
+    elif child.status == 'FAILED':
+        item["error"] = child.result
+    return item
+
+
+def comparison(items):
+    """Completed products ranked by health score, eco score and their average (ties keep upload order)."""
+    scored = [item for item in items
+              if item['status'] == 'COMPLETED' and item['healthScore'] is not None and item['ecoScore'] is not None]
+    rows = []
+    for item in sorted(scored, key=lambda i: -(i['healthScore'] + i['ecoScore'])):
+        rows.append({
+            "rank": len(rows) + 1,
+            "taskId": item['taskId'],
+            "scanId": item['scanId'],
+            "productName": item['productName'],
+            "healthScore": item['healthScore'],
+            "ecoScore": item['ecoScore'],
+            "overallScore": round((item['healthScore'] + item['ecoScore']) / 2),
+            "verdict": item['verdict'],
+        })
+    return {
+        "overall": rows,
+        "byHealth": [item['taskId'] for item in sorted(scored, key=lambda i: -i['healthScore'])],
+        "byEco": [item['taskId'] for item in sorted(scored, key=lambda i: -i['ecoScore'])],
+        "best": rows[0] if rows else None,
+    }
+
+
+def batch_view(parent, children):
+    """Aggregated status of a basket: per-status counts, one entry per product and the comparison."""
+    scans = referenced_scans(children)
+    items = [item_view(child, scans) for child in sorted(children, key=_index)]
+    counts = {}
+    for item in items:
+        counts[item['status']] = counts.get(item['status'], 0) + 1
+    unfinished = sum(counts.get(status, 0) for status in UNFINISHED_STATUSES)
+    if unfinished == 0:
+        status = 'FAILED' if parent.status == 'FAILED' else 'COMPLETED'
+    elif parent.status == 'PENDING':
+        status = 'PENDING'
+    else:
+        status = 'PROCESSING'
+    return {
+        "id": parent.id,
+        "status": status,
+        "created_at": parent.created_at.isoformat(),
+        "total": len(items),
+        "finished": len(items) - unfinished,
+        "counts": counts,
+        "items": items,
+        "comparison": comparison(items),
+    }
@@ -0,0 +1,281 @@
+"""Deduplicated product catalog shared by all scans.
+
+A product is identified by its normalized name, brand and FSSAI licence number.
+A name alone ("chocolate cookies") would merge different products, so labels
+without a brand or FSSAI number are not catalogued and their scans keep their
+full analysis (imported products may be identified by their barcode instead).
+The preference-independent extraction is stored once on the Product row; each
+ScanHistory row linked to it keeps only the per-user overlay (score, verdict,
+allergens, notes, OCR text). On SQLite an FTS5 table indexes product names,
+brands and ingredients for search.
+"""
+import hashlib
+import json
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from analysis_cache import PRODUCT_FIELDS
+from database import contains_pattern
+from models import db, Product, ProductBarcode
+
+logger = logging.getLogger(__name__)
+
+FSSAI_PATTERN = re.compile(r'(?<!\d)\d{14}(?!\d)')
+FTS_TABLE = 'product_fts'
+
+_fts_available = None
+
+
+def _normalize(value):
+    return re.sub(r'[^a-z0-9]+', ' ', str(value or '').lower()).strip()
+
+
+def fssai_numbers(value):
+    """14-digit FSSAI licence numbers in a string (spaces and dashes inside the number are tolerated)."""
+    return FSSAI_PATTERN.findall(re.sub(r'(?<=\d)[\s-](?=\d)', '', value or ''))
+
+
+def _identity(extraction):
+    other = extraction.get('other_info') or {}
+    name = _normalize(extraction.get('product_name'))
+    brand = _normalize(other.get('brand'))
+    licences = other.get('fssai_or_license_numbers') or []
+    if isinstance(licences, str):
+        licences = [licences]
+    numbers = sorted({n for licence in licences for n in fssai_numbers(str(licence))})
+    fssai = numbers[0] if numbers else ''
+    return name, brand, fssai
+
+
+def product_key(extraction, barcode=None):
+    """Catalog key, or None when the extraction does not identify a product: it needs a usable name and a
+    brand, an FSSAI number or (for imports) a barcode."""
+    name, brand, fssai = _identity(extraction)
+    if not name or name == 'unknown product':
+        return None
+    if brand or fssai:
+        identity = f"{name}|{brand}|{fssai}"
+    elif barcode:
+        identity = f"{name}|gtin:{barcode}"
+    else:
+        return None
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+def _ingredient_names(extraction):
+    names = []
+    for item in extraction.get('ingredients') or []:
+        names.append(item.get('name', '') if isinstance(item, dict) else str(item))
+    return ' '.join(name for name in names if name)
+
+
+# --- Full-text index ---------------------------------------------------------
+
+def ensure_search_index():
+    """Create the FTS5 table if the database supports it. Safe to call on every start."""
+    global _fts_available
+    if db.engine.dialect.name != 'sqlite':
+        _fts_available = False
+        return False
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+                f"USING fts5(name, brand, ingredients, tokenize='unicode61 remove_diacritics 2')"
+            ))
+        _fts_available = True
+    except Exception as e:
+        logger.warning(f"FTS5 unavailable, product search falls back to LIKE: {e}")
+        _fts_available = False
+    return _fts_available
+
+
+def _index_product(product, extraction):
+    if not _fts_available:
+        return
+    db.session.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid = :id"), {"id": product.id})
+    db.session.execute(
+        text(f"INSERT INTO {FTS_TABLE} (rowid, name, brand, ingredients) VALUES (:id, :name, :brand, :ingredients)"),
+        {"id": product.id, "name": product.name, "brand": product.brand or '',
+         "ingredients": _ingredient_names(extraction)}
+    )
+
+
+def _fts_query(query):
+    """Turn free text into an FTS5 prefix query; every term must match."""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search(query, limit=20):
+    """Products whose name, brand or ingredients match `query`, best match first."""
+    match = _fts_query(query)
+    if not match:
+        return []
+    if _fts_available:
+        ids = [row[0] for row in db.session.execute(
+            text(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match ORDER BY rank LIMIT :limit"),
+            {"match": match, "limit": limit}
+        )]
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()} if ids else {}
+        return [products[i] for i in ids if i in products]
+    pattern = contains_pattern(query)
+    return (Product.query
+            .filter(db.or_(Product.name.ilike(pattern, escape='\\'), Product.brand.ilike(pattern, escape='\\'),
+                           Product.extraction.ilike(pattern, escape='\\')))
+            .order_by(Product.scan_count.desc())
+            .limit(limit).all())
+
+
+# --- Catalog -----------------------------------------------------------------
+
+def product_extraction(product):
+    return json.loads(product.extraction)
+
+
+def find_in_ocr_text(ocr_text):
+    """
+    Catalog product whose FSSAI number and name both appear in the OCR text, or None.
+    A licence covers a manufacturer's whole range, so the number alone is not enough.
+    """
+    numbers = set(fssai_numbers(ocr_text))
+    if not numbers:
+        return None
+    normalized_text = f" {_normalize(ocr_text)} "
+    candidates = Product.query.filter(Product.fssai_number.in_(numbers)).all()
+    matches = [p for p in candidates if f" {_normalize(p.name)} " in normalized_text]
+    if not matches:
+        return None
+    # Prefer the most specific name ("oats cookies" over "cookies")
+    return max(matches, key=lambda p: len(_normalize(p.name)))
+
+
+def find_by_extraction(extraction):
+    """Catalog product with the same identity (name, brand, FSSAI) as an extraction, or None."""
+    key = product_key(extraction)
+    return Product.query.filter_by(product_key=key).first() if key else None
+
+
+def identified(product):
+    """Whether a product is identified by more than its name: a brand or an FSSAI number."""
+    return bool(product.brand or product.fssai_number)
+
+
+def find_by_barcode(codes):
+    """Catalog product of the first of `codes` (GTINs) that is linked to one, or None. Links a scan made to
+    a product known only by its name (catalogued before names alone stopped identifying products) are
+    ignored, since that product may not be the one photographed."""
+    if not codes:
+        return None
+    linked = {row.code: row for row in ProductBarcode.query.filter(ProductBarcode.code.in_(codes)).all()}
+    for code in codes:
+        if code in linked:
+            product = db.session.get(Product, linked[code].product_id)
+            if product is not None and (linked[code].source == 'import' or identified(product)):
+                return product
+    return None
+
+
+def add_barcodes(product, codes, source='scan'):
+    """Link barcodes to a product. A code already linked keeps its product, so only products identified by
+    a brand or FSSAI number learn codes from scans; a code a scan linked to a product known only by its
+    name moves to the identified one. Caller commits."""
+    if not codes or (source == 'scan' and not identified(product)):
+        return
+    known = {row.code: row for row in ProductBarcode.query.filter(ProductBarcode.code.in_(codes)).all()}
+    for code in codes:
+        row = known.get(code)
+        if row is not None:
+            if row.source == 'scan' and row.product_id != product.id:
+                linked = db.session.get(Product, row.product_id)
+                if linked is None or not identified(linked):
+                    row.product_id = product.id
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.add(ProductBarcode(code=code, product_id=product.id, source=source))
+                db.session.flush()
+        except IntegrityError:
+            pass  # another worker linked it first
+
+
+def upsert_product(extraction, scanned=True, barcode=None):
+    """Return the catalog Product for an extraction, creating it if new, and count the scan unless
+    scanned=False (a bulk import). None if the extraction does not identify a product. Caller commits."""
+    key = product_key(extraction, barcode)
+    if key is None:
+        return None
+    product = Product.query.filter_by(product_key=key).first()
+    if product is None:
+        name, brand, fssai = _identity(extraction)
+        other = extraction.get('other_info') or {}
+        product = Product(
+            product_key=key,
+            name=(extraction.get('product_name') or name)[:200],
+            brand=(other.get('brand') or '')[:200],
+            fssai_number=fssai or None,
+            extraction=json.dumps({field: extraction.get(field) for field in PRODUCT_FIELDS}),
+            scan_count=0,
+        )
+        try:
+            with db.session.begin_nested():
+                db.session.add(product)
+                db.session.flush()
+                _index_product(product, extraction)
+        except IntegrityError:
+            # Another worker catalogued the same product first
+            product = Product.query.filter_by(product_key=key).one()
+    return count_scan(product) if scanned else product
+
+
+def count_scan(product):
+    product.scan_count = (product.scan_count or 0) + 1
+    return product
+
+
+def replace_extraction(product, extraction):
+    """Swap in better product data (the LLM's, for a product the label parser catalogued). The product key
+    is kept, so later scans of the same label still land on this product. Caller commits."""
+    other = extraction.get('other_info') or {}
+    if extraction.get('product_name'):
+        product.name = extraction['product_name'][:200]
+    if other.get('brand'):
+        product.brand = other['brand'][:200]
+    product.extraction = json.dumps({field: extraction.get(field) for field in PRODUCT_FIELDS})
+    _index_product(product, extraction)
+
+
+def scan_overlay(analysis):
+    """The per-scan part of an analysis, stored on ScanHistory when it links to a Product."""
+    return {key: value for key, value in analysis.items() if key not in PRODUCT_FIELDS}
+
+
+def load_scan_analysis(scan):
+    """Full analysis of a scan: catalog product data merged with the scan's own overlay."""
+    product = db.session.get(Product, scan.product_id) if scan.product_id is not None else None
+    return merge_scan_analysis(scan, product)
+
+
+def merge_scan_analysis(scan, product):
+    analysis = json.loads(scan.full_analysis) if scan.full_analysis else {}
+    if product is not None:
+        analysis = {**product_extraction(product), **analysis}
+    return analysis
+
+
+def serialize_product(product):
+    extraction = product_extraction(product)
+    return {
+        "id": product.id,
+        "name": product.name,
+        "brand": product.brand,
+        "fssaiNumber": product.fssai_number,
+        "ecoScore": extraction.get('eco_score'),
+        "baseHealthScore": extraction.get('base_health_score'),
+        "ingredients": [item.get('name') if isinstance(item, dict) else item
+                        for item in extraction.get('ingredients') or []],
+        "scanCount": product.scan_count,
+    }
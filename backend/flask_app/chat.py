@@ -0,0 +1,252 @@
+"""Product chat: compact server-side context, local replies and a response cache.
+
+The client sends only its question and the scan (or task) it is looking at.
+The context is rebuilt here from the stored analysis as a short fact sheet,
+greetings and other trivial messages are answered without the LLM, and
+answers are cached per (context, normalized question) so the same question
+about the same product with the same preferences costs one LLM call.
+"""
+import hashlib
+import logging
+import os
+import re
+import time
+
+import analysis_cache
+import metrics
+import preferences
+from groq_ai import astream_chat_with_groq, chat_with_groq, stream_chat_with_groq
+from llm_router import BudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv('CHAT_CACHE_MAX_ENTRIES', '2048'))
+CHAT_CACHE_TTL_SECONDS = int(os.getenv('CHAT_CACHE_TTL_SECONDS', str(24 * 3600)))
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv('CHAT_CONTEXT_MAX_CHARS', '1200'))
+CHAT_MAX_INGREDIENTS = 15
+
+# sha256(context) + normalized question -> reply
+response_cache = analysis_cache.LRUCache(CHAT_CACHE_MAX_ENTRIES, CHAT_CACHE_TTL_SECONDS)
+
+FALLBACK_REPLY = "Sorry, I couldn't answer that right now. Please try again."
+EMPTY_REPLY = "Ask me something about the product, eco-score or ingredients!"
+LIMIT_REPLY = "You've asked a lot of questions in a short time. Please try again in a little while."
+
+# Filler that does not change what is being asked
+_FILLER = {
+    'please', 'pls', 'plz', 'hey', 'hi', 'hello', 'can', 'could', 'would', 'you', 'tell', 'me',
+    'i', 'want', 'to', 'know', 'kindly', 'just', 'the', 'a', 'an', 'product', 'item', 'this', 'it',
+}
+
+# Whole-message patterns answered locally
+LOCAL_INTENTS = [
+    (re.compile(r"^(hi+|hello+|hey+|hiya|yo|namaste|good (morning|afternoon|evening))( there)?$"),
+     "Hi! Ask me about this product's ingredients, health score or eco-score."),
+    (re.compile(r"^(thanks?|thank you( so much)?|thx|ty|ok thanks?|great thanks?|cool thanks?)$"),
+     "You're welcome! Anything else about this product?"),
+    (re.compile(r"^(bye|goodbye|see you|see ya|cya)$"),
+     "Bye! Happy and healthy shopping."),
+    (re.compile(r"^(help|what can you do|what can i ask( you)?|how does this work)$"),
+     "I can explain the health and eco scores, flag ingredients that conflict with your profile, "
+     "and answer questions like \"Is this vegan?\" or \"Why is the score low?\""),
+    (re.compile(r"^(ok|okay|k|cool|nice|great|got it|alright)$"),
+     "Glad that helps. Ask me anything else about this product."),
+]
+
+
+def _clean(text):
+    return re.sub(r'\s+', ' ', re.sub(r"[^a-z0-9%' ]+", ' ', text.lower())).strip()
+
+
+def normalize_query(query):
+    """Reduce a question to its content words so rephrasings share a cache entry."""
+    words = [w for w in _clean(query).replace("'", '').split() if w not in _FILLER]
+    return ' '.join(words)
+
+
+def local_reply(query):
+    cleaned = _clean(query).replace("'", '')
+    for pattern, reply in LOCAL_INTENTS:
+        if pattern.match(cleaned):
+            return reply
+    return None
+
+
+def build_context(analysis, user_prefs=None):
+    """A short fact sheet about a scanned product, used as the chat system context."""
+    ingredients = []
+    for item in analysis.get('ingredients') or []:
+        name = item.get('name') if isinstance(item, dict) else str(item)
+        if name:
+            ingredients.append(name)
+    nutrition = analysis.get('nutritional_facts') or {}
+
+    lines = [
+        f"Product: {analysis.get('product_name', 'Unknown')}",
+        f"Health score: {analysis.get('health_score', analysis.get('base_health_score', 'unknown'))}/100, "
+        f"verdict: {analysis.get('verdict', 'unknown')}",
+        f"Eco score: {analysis.get('eco_score', 'unknown')}/100",
+    ]
+    if analysis.get('eco_score_reasoning'):
+        lines[-1] += f" ({analysis['eco_score_reasoning']})"
+    if ingredients:
+        extra = len(ingredients) - CHAT_MAX_INGREDIENTS
+        lines.append("Ingredients: " + ", ".join(ingredients[:CHAT_MAX_INGREDIENTS])
+                     + (f" (+{extra} more)" if extra > 0 else ""))
+    if nutrition:
+        lines.append("Per 100g: " + ", ".join(f"{k} {v}" for k, v in nutrition.items() if v))
+    lines.append(f"Palm oil: {analysis.get('palm_oil', 'unknown')}, packaging: {analysis.get('packaging', 'unknown')}")
+    if analysis.get('detected_allergens'):
+        lines.append("Allergens for this user: " + ", ".join(analysis['detected_allergens']))
+    if analysis.get('personalized_notes'):
+        lines.append("Warnings: " + " ".join(analysis['personalized_notes']))
+    if analysis.get('nutritional_benefits'):
+        lines.append("Benefits: " + "; ".join(analysis['nutritional_benefits']))
+    if user_prefs:
+        prefs = ", ".join(f"{key.replace('_', ' ')}: {value}"
+                          for key, value in preferences.display(user_prefs).items() if value)
+        if prefs:
+            lines.append(f"User profile: {prefs}")
+    return "\n".join(lines)[:CHAT_CONTEXT_MAX_CHARS]
+
+
+def cache_key(context, query):
+    return hashlib.sha256(context.encode('utf-8')).hexdigest() + ':' + normalize_query(query)
+
+
+def prepare(query, context):
+    """
+    Answer without the LLM when possible. Returns (reply, source, cache_key); reply is None
+    when the LLM has to be asked, and its answer should then be stored under cache_key.
+    """
+    if not query.strip():
+        return EMPTY_REPLY, 'local', None
+    reply = local_reply(query)
+    if reply is not None:
+        return reply, 'local', None
+    key = cache_key(context, query)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached, 'cache', key
+    return None, 'llm', key
+
+
+def answer(query, context, user_id=None):
+    """Answer one chat message. Returns (reply, source) with source in local, cache, llm, error, limited."""
+    reply, source, key = prepare(query, context)
+    if reply is None:
+        try:
+            reply = chat_with_groq(query, context, user_id)
+        except BudgetExceeded as e:
+            logger.info(f"Chat refused: {e}")
+            reply, source = LIMIT_REPLY, 'limited'
+        else:
+            if reply:
+                response_cache.set(key, reply)
+            else:
+                reply, source = FALLBACK_REPLY, 'error'
+    metrics.CHAT_REPLIES.labels(source).inc()
+    return reply, source
+
+
+def _immediate_events(reply, source, started):
+    metrics.CHAT_REPLIES.labels(source).inc()
+    return [('token', {"text": reply}),
+            ('done', {"source": source, "firstTokenMs": round((time.perf_counter() - started) * 1000)})]
+
+
+def _final_event(key, parts, failed, first_token, started, limited=False):
+    if limited:
+        metrics.CHAT_REPLIES.labels('limited').inc()
+        return 'error', {"message": LIMIT_REPLY, "limited": True}
+    reply = "".join(parts).strip()
+    if failed or not reply:
+        metrics.CHAT_REPLIES.labels('error').inc()
+        return 'error', {"message": FALLBACK_REPLY}
+    response_cache.set(key, reply)
+    metrics.CHAT_REPLIES.labels('llm').inc()
+    return 'done', {"source": 'llm', "firstTokenMs": round(first_token * 1000),
+                    "totalMs": round((time.perf_counter() - started) * 1000)}
+
+
+def _stream_ended(finished, parts):
+    if not finished:
+        metrics.CHAT_CANCELLED.inc()
+        logger.info(f"Chat stream cancelled after {len(parts)} piece(s)")
+
+
+def stream_answer(query, context, user_id=None):
+    """
+    Yield ('token', {"text"}) events as the answer is produced, then ('done', {...}) or
+    ('error', {...}). Local and cached answers arrive as one token. If the consumer stops
+    early (client disconnected), the Groq stream is closed and nothing is cached.
+    """
+    started = time.perf_counter()
+    reply, source, key = prepare(query, context)
+    if reply is not None:
+        yield from _immediate_events(reply, source, started)
+        return
+
+    parts = []
+    first_token = None
+    finished = failed = limited = False
+    tokens = stream_chat_with_groq(query, context, user_id)
+    try:
+        for piece in tokens:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                metrics.CHAT_FIRST_TOKEN_SECONDS.observe(first_token)
+            parts.append(piece)
+            yield 'token', {"text": piece}
+        finished = True
+    except BudgetExceeded as e:
+        finished = limited = True
+        logger.info(f"Chat refused: {e}")
+    except Exception as e:
+        finished = failed = True
+        logger.error(f"Groq chat stream failed: {e}")
+        metrics.LLM_ERRORS.labels('chat', type(e).__name__).inc()
+    finally:
+        tokens.close()
+        _stream_ended(finished, parts)
+
+    yield _final_event(key, parts, failed, first_token, started, limited)
+
+
+async def astream_answer(query, context, user_id=None):
+    """Async version of stream_answer for the ASGI endpoints; cancelling it closes the Groq stream."""
+    started = time.perf_counter()
+    reply, source, key = prepare(query, context)
+    if reply is not None:
+        for event in _immediate_events(reply, source, started):
+            yield event
+        return
+
+    parts = []
+    first_token = None
+    finished = failed = limited = False
+    tokens = astream_chat_with_groq(query, context, user_id)
+    try:
+        async for piece in tokens:
+            if first_token is None:
+                first_token = time.perf_counter() - started
+                metrics.CHAT_FIRST_TOKEN_SECONDS.observe(first_token)
+            parts.append(piece)
+            yield 'token', {"text": piece}
+        finished = True
+    except BudgetExceeded as e:
+        finished = limited = True
+        logger.info(f"Chat refused: {e}")
+    except Exception as e:
+        finished = failed = True
+        logger.error(f"Groq chat stream failed: {e}")
+        metrics.LLM_ERRORS.labels('chat', type(e).__name__).inc()
+    finally:
+        await tokens.aclose()
+        _stream_ended(finished, parts)
+
+    yield _final_event(key, parts, failed, first_token, started, limited)
+
+
+def cache_stats():
+    return response_cache.stats()
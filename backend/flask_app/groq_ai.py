@@ -1,8 +1,18 @@
 import os
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq, Groq
 import json
-import traceback
+import logging
+import time
+import llm_router
+import metrics
+from json_stream import TopLevelFieldParser
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    """The LLM did not return usable product data."""
 
 # Load environment variables from .env
 load_dotenv()
@@ -14,113 +24,165 @@ if not GROQ_API_KEY:
 groq_client = Groq(
     api_key=GROQ_API_KEY
 )
+# Used by the async endpoints in asgi.py
+async_groq_client = AsyncGroq(
+    api_key=GROQ_API_KEY
+)
+
 
+def _chunk_usage(chunk):
+    """Token usage, which Groq only attaches to the last chunk of a stream (under x_groq)."""
+    usage = getattr(chunk, 'usage', None)
+    if usage is None:
+        usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None)
+    return usage
 
-def analyze_product_risk(ocr_text, user_prefs):
+
+EXTRACTION_SYSTEM_PROMPT = (
+    "You are a precise food label data extractor. Always return valid JSON.\n"
+    "Extract structured data from the food label OCR text as valid JSON. No markdown.\n\n"
+    "RULES:\n"
+    "- ingredients: every listed ingredient, percentage if printed, allergen=true for common allergens (milk, egg, nuts, peanut, soy, wheat/gluten, fish, shellfish, sesame, mustard).\n"
+    "- nutritional_facts: values per 100g (or per serving if that is all that is printed).\n"
+    "- base_health_score (0-100): general nutritional quality for an average adult, ignoring any individual's needs.\n"
+    "- eco_score (0-100) and one-sentence eco_score_reasoning from ingredients and packaging hints.\n"
+    "- packaging: e.g. 'Plastic Pouch', 'Cardboard Box', 'Metal Can', else 'Unknown'.\n"
+    "- palm_oil: 'Detected' if palm oil or palmolein is listed, else 'Not Detected'.\n"
+    "- carbon_footprint: 'High' (meat/dairy heavy), 'Medium' or 'Low' (plant-based).\n"
+    "- nutritional_benefits: 3-4 short, specific points.\n"
+    "- other_info: manufacturer details and contact (phone, email, website), FSSAI/license numbers, dates, MRP, net quantity, brand, origin, certifications.\n\n"
+    "JSON SCHEMA:\n"
+    '{"product_name": "string", "product_description": "string", '
+    '"ingredients": [{"name": "string", "percentage": "string", "allergen": boolean}], '
+    '"nutritional_facts": {"calories": "val", "protein": "val", "carbs": "val", "sugar": "val", "fat": "val", "fiber": "val", "salt": "val"}, '
+    '"base_health_score": integer, "eco_score": integer, "eco_score_reasoning": "string", "packaging": "string", '
+    '"palm_oil": "string", "carbon_footprint": "string", "nutritional_benefits": ["string"], '
+    '"other_info": {"manufacturer_details": "string", "manufacturer_contact": {"phone": "string", "email": "string", "website": "string"}, '
+    '"fssai_or_license_numbers": ["string"], "expiry_or_best_before": "string", "manufacturing_date": "string", '
+    '"mrp_price": "string", "net_quantity": "string", "brand": "string", "origin": "string", "certifications": ["string"]}}'
+)
+
+
+def extract_product_data(ocr_text, on_field=None, timings=None, user_id=None):
     """
-    Analyze product risk, extract data, and compute scores using Groq (llama-3.3-70b-versatile).
-    Combines structuring, risk analysis, and scoring in one efficient prompt.
+    Extract preference-independent product data from OCR text using Groq.
+    The result is identical for every user, so it can be cached and re-scored locally.
+
+    The OCR text is cleaned and routed by llm_router: short labels go to the small model,
+    and an answer that does not parse or looks incomplete is redone on the large one.
+    Raises llm_router.BudgetExceeded when user_id's (or the global) token budget is used up.
+
+    The completion is streamed: on_field(key, value) is called as soon as each top-level
+    field of the JSON is complete, and timings (if given) receives llm_first_field and
+    llm_total in seconds. A small-model answer's fields are passed on only once the answer
+    is accepted, since an escalated one is discarded.
     """
     if not ocr_text or ocr_text == "OCR failed: Unable to extract text. Please try again.":
         return {"raw_text": ocr_text.lower(), "error": "OCR failed"}
 
-    # Comprehensive Prompt
-    prompt = (
-        f"You are an expert AI Food Risk Analyst. "
-        f"Analyze the following OCR text from a food product label and the user's health preferences. "
-        f"Provide a COMPLETE risk analysis and structured data extraction in valid JSON format. "
-        f"Use the model 'llama-3.3-70b-versatile'. "
-        f"\n\nUSER PREFERENCES:\n{json.dumps(user_prefs, indent=2)}\n\n"
-        f"OCR TEXT:\n{ocr_text}\n\n"
-        f"INSTRUCTIONS:\n"
-        f"1. Extract Product Details: Name, description, ingredients (with percentage if available), nutritional facts per 100g/serving, manufacturer details, FSSAI/license numbers, expiry dates, manufacturing dates, MRP, and net quantity.\n"
-        f"2. Extract Manufacturer Contact Info: Look for phone numbers (customer care), email addresses, and website URLs associated with the manufacturer or brand.\n"
-        f"3. Analyze Ingredients: Identify allergens, additives, and compatibility with the user's diet (e.g., Vegan, Keto).\n"
-        f"4. Personalize Risk: Compare ingredients against User Preferences (Health Conditions, Allergies, Ingredients to Avoid).\n"
-        f"5. Compute Scores (0-100):\n"
-        f"   - health_score: STRICTLY based on the personalized risk assessment. If the product contains User's allergens or conflicts with health conditions, the score MUST be low (0-40). If it fits the diet perfectly, it can be high.\n"
-        f"   - eco_score: Estimate environmental impact based on ingredients/packaging hints (0-100).\n"
-        f"6. Extract Eco Details:\n"
-        f"   - packaging: Identify packaging type (e.g., 'Plastic Pouch', 'Cardboard Box', 'Metal Can'). Default to 'Unknown' if not clear.\n"
-        f"   - palm_oil: Check ingredients for 'Palm Oil' or 'Palmolein'. Return 'Detected' or 'Not Detected'.\n"
-        f"   - carbon_footprint: Estimate as 'High', 'Medium', or 'Low' based on ingredients (e.g., meat/dairy = High, plant-based = Low).\n"
-        f"7. Generate Verdicts: 'safe', 'warning', or 'avoid'.\n"
-        f"8. Provide 3-4 short, specific 'nutritional_benefits' and 'personalized_notes' (warnings/benefits).\n"
-        f"9. Explain the Eco Score: Provide a specific sentence on WHY this eco score was given (e.g., 'High footprint due to palm oil' or 'Sustainable packaging detected').\n"
-        f"10. Output strictly valid JSON matching the schema below. No markdown formatting.\n\n"
-        f"JSON SCHEMA:\n"
-        f"{{\n"
-        f"  \"product_name\": \"string\",\n"
-        f"  \"product_description\": \"string\",\n"
-        f"  \"ingredients\": [{{ \"name\": \"string\", \"percentage\": \"string\", \"allergen\": boolean }}],\n"
-        f"  \"nutritional_facts\": {{ \"calories\": \"val\", \"protein\": \"val\", \"carbs\": \"val\", \"sugar\": \"val\", \"fat\": \"val\", \"fiber\": \"val\", \"salt\": \"val\" }},\n"
-        f"  \"health_score\": integer,\n"
-        f"  \"eco_score\": integer,\n"
-        f"  \"eco_score_reasoning\": \"string\",\n"
-        f"  \"packaging\": \"string\",\n"
-        f"  \"palm_oil\": \"string\",\n"
-        f"  \"carbon_footprint\": \"string\",\n"
-        f"  \"verdict\": \"safe | warning | avoid\",\n"
-        f"  \"nutritional_benefits\": [\"string\"],\n"
-        f"  \"personalized_notes\": [\"string\"],\n"
-        f"  \"detected_allergens\": [\"string\"],\n"
-        f"  \"other_info\": {{ \"manufacturer_details\": \"string\", \"manufacturer_contact\": {{ \"phone\": \"string\", \"email\": \"string\", \"website\": \"string\" }}, \"fssai_or_license_numbers\": [\"string\"], \"expiry_or_best_before\": \"string\", \"manufacturing_date\": \"string\", \"mrp_price\": \"string\", \"net_quantity\": \"string\", \"brand\": \"string\", \"origin\": \"string\", \"certifications\": [\"string\"] }},\n"
-        f"  \"reasoning\": \"string (brief summary of why this score/verdict)\"\n"
-        f"}}"
-    )
+    label_text = llm_router.clean_ocr_text(ocr_text)
+    model = llm_router.extraction_model(label_text)
+    while model is not None:
+        held = []
+        # An answer that may still be escalated keeps its fields back, so the client never sees a discarded one
+        if on_field is None or model == llm_router.LLM_MODEL_LARGE:
+            attempt_on_field = on_field
+        else:
+            attempt_on_field = lambda key, value: held.append((key, value))
+        data = _extract_with_model(model, label_text, attempt_on_field, timings, user_id)
+        reason = llm_router.escalation_reason(data)
+        model = llm_router.escalate('extract', model, reason) if reason else None
+        if model is None:
+            for key, value in held:
+                on_field(key, value)
+    data['raw_text'] = ocr_text.lower() # Include raw text for fallback
+    return data
+
 
+def _extract_with_model(model, label_text, on_field, timings, user_id):
     messages = [
-        {"role": "system", "content": "You are a precise and helpful food safety AI assistant. Always return valid JSON."},
-        {"role": "user", "content": prompt}
+        {"role": "system", "content": EXTRACTION_SYSTEM_PROMPT},
+        {"role": "user", "content": f"OCR TEXT:\n{label_text}"}
     ]
+    llm_router.check_budget(user_id, EXTRACTION_SYSTEM_PROMPT + label_text)
 
+    started = time.perf_counter()
+    parts = []
+    usage = None
+    failed = True
     try:
+        first_field_at = None
+        parser = TopLevelFieldParser()
         completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
+            model=model,
             messages=messages,
-            temperature=0.3, # Lower temperature for consistent JSON
-            max_completion_tokens=2000,
+            temperature=0.2, # Lower temperature for consistent JSON
+            max_completion_tokens=1500,
             top_p=1,
-            stream=False
+            stream=True
         )
-        
-        json_str = completion.choices[0].message.content.strip()
+
+        for chunk in completion:
+            usage = _chunk_usage(chunk) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            parts.append(delta)
+            for key, value in parser.feed(delta):
+                if first_field_at is None:
+                    first_field_at = time.perf_counter() - started
+                if on_field:
+                    on_field(key, value)
+        total = time.perf_counter() - started
+        if timings is not None:
+            timings['llm_first_field'] = first_field_at if first_field_at is not None else total
+            timings['llm_total'] = total
+        if first_field_at is not None:
+            metrics.LLM_FIRST_FIELD_SECONDS.observe(first_field_at)
+            logger.info(f"Groq extraction ({model}): first field after {first_field_at:.2f}s, total {total:.2f}s")
+
+        json_str = "".join(parts).strip()
         # Clean up if model adds markdown backticks
         if json_str.startswith("```json"):
             json_str = json_str[7:]
         if json_str.endswith("```"):
             json_str = json_str[:-3]
             
-        print(f"Raw JSON from Groq: {json_str[:500]}...")
+        logger.debug(f"Raw JSON from Groq: {json_str[:500]}...")
         
         if json_str:
+            parse_started = time.perf_counter()
             data = json.loads(json_str)
-            data['raw_text'] = ocr_text.lower() # Include raw text for fallback
+            if timings is not None:
+                timings['llm_parse'] = time.perf_counter() - parse_started
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            failed = False
             return data
         else:
-            print("No JSON content received.")
-            return {"raw_text": ocr_text.lower(), "error": "Empty response"}
+            logger.warning("No JSON content received.")
+            metrics.LLM_ERRORS.labels('extract', 'EmptyResponse').inc()
+            return {"error": "Empty response"}
             
     except Exception as e:
-        print(f"Error calling Groq API: {e}")
-        print(f"Full traceback: {traceback.format_exc()}")
-        return {"raw_text": ocr_text.lower(), "error": str(e)}
+        logger.error(f"Error calling Groq API ({model}): {e}", exc_info=True)
+        metrics.LLM_ERRORS.labels('extract', type(e).__name__).inc()
+        return {"error": str(e)}
 
-def chat_with_groq(user_text, context):
-    """Handle chatbot interaction using Groq."""
-    if not user_text.strip():
-        return "Ask me something about the product, eco-score or ingredients!"
+    finally:
+        llm_router.record_call('extract', model, user_id, usage, time.perf_counter() - started,
+                               prompt_text=EXTRACTION_SYSTEM_PROMPT + label_text, completion_text="".join(parts),
+                               failed=failed)
 
-    messages = [
+
+def _chat_messages(user_text, context):
+    return [
         {
             "role": "system",
             "content": (
-                f"You are EcoScan Assistant, a helpful food safety expert. "
-                f"Context: {context}. "
-                f"Instructions: "
-                f"1. If the user says 'hi', 'hello', or greets you, reply naturally and briefly offering help (e.g., 'Hi! Ask me about this product.'). "
-                f"2. If the user asks about the product, ingredients, or health/eco scores, use the provided context to answer. "
-                f"3. Keep responses short (1-2 sentences). No markdown."
+                "You are EcoScan Assistant, a food safety expert. Answer from the product facts below "
+                "in 1-2 short sentences, no markdown. Say so if the facts do not cover the question.\n"
+                f"{context}"
             )
         },
         {
@@ -129,29 +191,110 @@ def chat_with_groq(user_text, context):
         }
     ]
 
+
+CHAT_COMPLETION_ARGS = dict(
+    temperature=0.3, # answers are cached and shared, so keep them consistent
+    max_completion_tokens=200,
+    top_p=1,
+    stream=True
+)
+
+
+def _chat_prompt_text(messages):
+    return "".join(message["content"] for message in messages)
+
+
+def stream_chat_with_groq(user_text, context, user_id=None):
+    """
+    Yield reply text pieces as Groq streams them. Closing the generator early (the client
+    went away) closes the upstream stream too, so Groq stops generating tokens for us.
+    Simple questions go to the small model (llm_router.chat_model); the large one takes over
+    if the small one cannot be reached. Raises llm_router.BudgetExceeded before calling Groq.
+    """
+    messages = _chat_messages(user_text, context)
+    prompt_text = _chat_prompt_text(messages)
+    model = llm_router.chat_model(user_text)
+    llm_router.check_budget(user_id, prompt_text)
+    started = time.perf_counter()
     try:
-        completion = groq_client.chat.completions.create(
-            model="llama-3.3-70b-versatile",
-            messages=messages,
-            temperature=0.7,
-            max_completion_tokens=300,
-            top_p=1,
-            stream=True
-        )
+        completion = groq_client.chat.completions.create(messages=messages, model=model, **CHAT_COMPLETION_ARGS)
+    except Exception:
+        larger = llm_router.escalate('chat', model, 'call_failure')
+        if larger is None:
+            raise
+        llm_router.record_call('chat', model, user_id, None, time.perf_counter() - started, failed=True)
+        model, started = larger, time.perf_counter()
+        completion = groq_client.chat.completions.create(messages=messages, model=model, **CHAT_COMPLETION_ARGS)
 
-        reply_parts = []
+    parts = []
+    usage = None
+    failed = False
+    try:
         for chunk in completion:
-            delta = chunk.choices[0].delta.content
+            usage = _chunk_usage(chunk) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception:
+        failed = True
+        raise
+    finally:
+        completion.close()
+        llm_router.record_call('chat', model, user_id, usage, time.perf_counter() - started,
+                               prompt_text=prompt_text, completion_text="".join(parts), failed=failed)
+
+
+async def astream_chat_with_groq(user_text, context, user_id=None):
+    """Async version of stream_chat_with_groq; closing it (or cancelling its task) closes the upstream stream."""
+    messages = _chat_messages(user_text, context)
+    prompt_text = _chat_prompt_text(messages)
+    model = llm_router.chat_model(user_text)
+    llm_router.check_budget(user_id, prompt_text)
+    started = time.perf_counter()
+    try:
+        completion = await async_groq_client.chat.completions.create(
+            messages=messages, model=model, **CHAT_COMPLETION_ARGS)
+    except Exception:
+        larger = llm_router.escalate('chat', model, 'call_failure')
+        if larger is None:
+            raise
+        llm_router.record_call('chat', model, user_id, None, time.perf_counter() - started, failed=True)
+        model, started = larger, time.perf_counter()
+        completion = await async_groq_client.chat.completions.create(
+            messages=messages, model=model, **CHAT_COMPLETION_ARGS)
+
+    parts = []
+    usage = None
+    failed = False
+    try:
+        async for chunk in completion:
+            usage = _chunk_usage(chunk) or usage
+            delta = chunk.choices[0].delta.content if chunk.choices else None
             if delta:
-                reply_parts.append(delta)
+                parts.append(delta)
+                yield delta
+    except Exception:
+        failed = True
+        raise
+    finally:
+        await completion.close()
+        llm_router.record_call('chat', model, user_id, usage, time.perf_counter() - started,
+                               prompt_text=prompt_text, completion_text="".join(parts), failed=failed)
 
-        reply = "".join(reply_parts).strip()
 
+def chat_with_groq(user_text, context, user_id=None):
+    """Answer a question about a product from its fact sheet. Returns None if Groq fails;
+    raises llm_router.BudgetExceeded when the token budget is used up."""
+    try:
+        reply = "".join(stream_chat_with_groq(user_text, context, user_id)).strip()
         if not reply:
-            reply = "I couldn't generate a response. Try rephrasing your question."
+            metrics.LLM_ERRORS.labels('chat', 'EmptyResponse').inc()
+        return reply or None
 
+    except llm_router.BudgetExceeded:
+        raise
     except Exception as e:
-        print(f"Groq API Exception: {e}")
-        reply = "Something broke, but I'm pretending everything is fine."
-
-    return reply
\ No newline at end of file
+        logger.error(f"Groq API Exception: {e}")
+        metrics.LLM_ERRORS.labels('chat', type(e).__name__).inc()
+        return None
@@ -0,0 +1,442 @@
+"""Durable scan job queue backed by the Task table.
+
+Any process that can reach the database can run workers: a task is claimed by
+an atomic PENDING -> PROCESSING transition, held with a renewable lease, and
+returned to PENDING (with backoff) when it fails or its worker disappears.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+import metrics
+import retention
+import task_events
+from models import db, Task
+
+logger = logging.getLogger(__name__)
+
+WORKER_THREADS = int(os.getenv('SCAN_WORKER_THREADS', '2'))
+MAX_ATTEMPTS = int(os.getenv('SCAN_MAX_ATTEMPTS', '3'))
+LEASE_SECONDS = int(os.getenv('SCAN_LEASE_SECONDS', '60'))
+RETRY_BACKOFF_SECONDS = float(os.getenv('SCAN_RETRY_BACKOFF_SECONDS', '5'))
+POLL_INTERVAL_SECONDS = float(os.getenv('SCAN_POLL_INTERVAL_SECONDS', '1'))
+MAX_QUEUE_DEPTH = int(os.getenv('SCAN_MAX_QUEUE_DEPTH', '0'))  # 0 = unbounded
+LEASE_EXPIRED_ERROR = "Lease expired: the worker stopped responding on the last attempt"
+
+
+class LeaseLost(Exception):
+    """The task was handed to another worker (its lease expired) before this one could complete it."""
+
+
+_claim = threading.local()  # worker id under which the current thread runs its claimed task
+
+
+class QueueStats:
+    """In-process counters and recent stage timings for this node's workers."""
+
+    def __init__(self, window=200):
+        self._lock = threading.Lock()
+        self._timings = defaultdict(lambda: deque(maxlen=window))
+        self.counters = defaultdict(int)
+        self.busy_workers = 0
+        self.total_workers = 0
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def record_stage(self, stage, seconds):
+        with self._lock:
+            self._timings[stage].append(seconds)
+
+    def set_busy(self, delta):
+        with self._lock:
+            self.busy_workers += delta
+        metrics.WORKERS_BUSY.inc(delta)
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, samples in self._timings.items():
+                ordered = sorted(samples)
+                stages[stage] = {
+                    "count": len(ordered),
+                    "avg": round(sum(ordered) / len(ordered), 3),
+                    "p95": round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+                }
+            return {
+                "workers": self.total_workers,
+                "busyWorkers": self.busy_workers,
+                "counters": dict(self.counters),
+                "stageTimings": stages,
+            }
+
+
+stats = QueueStats()
+
+
+def queue_depth():
+    # Background enrichment runs after the scans it follows up on and does not count against the limit
+    return Task.query.filter(Task.status == 'PENDING', Task.kind != 'enrich').count()
+
+
+def is_full():
+    return MAX_QUEUE_DEPTH > 0 and queue_depth() >= MAX_QUEUE_DEPTH
+
+
+def claim_next(worker_id, batch_id=None):
+    """Claim the oldest available PENDING task (background tasks last), or return None.
+    With batch_id, only that batch's child scans are considered."""
+    now = datetime.utcnow()
+    # available_at is NULL on tasks left from before it existed: they are due
+    query = db.session.query(Task.id).filter(Task.status == 'PENDING',
+                                             or_(Task.available_at.is_(None), Task.available_at <= now))
+    if batch_id is not None:
+        query = query.filter(Task.batch_id == batch_id)
+    candidates = (
+        query
+        .order_by(Task.kind == 'enrich', Task.created_at)
+        .limit(5)
+        .all()
+    )
+    for (task_id,) in candidates:
+        claimed = (
+            Task.query
+            .filter(Task.id == task_id, Task.status == 'PENDING')
+            .update({
+                Task.status: 'PROCESSING',
+                Task.stage: 'PROCESSING',
+                Task.worker_id: worker_id,
+                Task.lease_expires_at: now + timedelta(seconds=LEASE_SECONDS),
+                Task.attempts: Task.attempts + 1,
+            }, synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed == 1:
+            task_events.publish(task_id, 'PROCESSING')
+            return db.session.get(Task, task_id)
+    return None
+
+
+def heartbeat(task_id, worker_id):
+    """Extend the lease; returns False if the task was taken away from this worker."""
+    renewed = (
+        Task.query
+        .filter(Task.id == task_id, Task.worker_id == worker_id, Task.status == 'PROCESSING')
+        .update({Task.lease_expires_at: datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)},
+                synchronize_session=False)
+    )
+    db.session.commit()
+    return renewed == 1
+
+
+def recover_stale():
+    """Return PROCESSING tasks whose lease expired (crashed or hung worker) to the queue. A task that has
+    used up MAX_ATTEMPTS fails instead, so one that keeps killing its worker is not claimed forever."""
+    now = datetime.utcnow()
+    expired = Task.query.filter(Task.status == 'PROCESSING', Task.lease_expires_at < now)
+    exhausted = [task_id for (task_id,) in
+                 expired.filter(Task.attempts >= MAX_ATTEMPTS).with_entities(Task.id).all()]
+    failed = []
+    stranded = []
+    for task_id in exhausted:
+        # Re-checks the lease, in case the worker renewed it in the meantime
+        if expired.filter(Task.id == task_id).update(
+                {Task.status: 'FAILED', Task.stage: 'FAILED', Task.result: LEASE_EXPIRED_ERROR,
+                 Task.worker_id: None, Task.lease_expires_at: None}, synchronize_session=False):
+            failed.append(task_id)
+            stranded += fail_waiting_children(task_id, LEASE_EXPIRED_ERROR)
+    recovered = (
+        expired
+        .filter(Task.attempts < MAX_ATTEMPTS)
+        .update({Task.status: 'PENDING', Task.stage: 'PENDING', Task.worker_id: None,
+                 Task.lease_expires_at: None},
+                synchronize_session=False)
+    )
+    db.session.commit()
+    if recovered:
+        logger.warning(f"Recovered {recovered} stale task(s)")
+        stats.incr('recovered', recovered)
+    if failed:
+        logger.error(f"Failed {len(failed)} task(s) whose lease expired on their last attempt: {failed}")
+        stats.incr('failed', len(failed))
+        for task_id in failed:
+            task_events.publish(task_id, 'FAILED', error=LEASE_EXPIRED_ERROR)
+        publish_failed_children(stranded)
+    return recovered
+
+
+def fail_waiting_children(batch_id, error):
+    """Fail the child scans a basket left WAITING for its OCR when the basket itself failed; nothing else
+    would ever release them. Returns [(child id, error)] for publish_failed_children. Caller commits."""
+    children = [task_id for (task_id,) in
+                db.session.query(Task.id).filter(Task.batch_id == batch_id, Task.status == 'WAITING')]
+    if not children:
+        return []
+    message = f"Basket failed before this scan ran: {error}"
+    Task.query.filter(Task.id.in_(children), Task.status == 'WAITING').update(
+        {Task.status: 'FAILED', Task.stage: 'FAILED', Task.result: message}, synchronize_session=False)
+    return [(task_id, message) for task_id in children]
+
+
+def publish_failed_children(children):
+    for task_id, message in children:
+        task_events.publish(task_id, 'FAILED', error=message)
+
+
+def _update_claimed(task, updates):
+    """Apply `updates` to the task this thread is running, only while this worker still holds it. Returns
+    whether it did; the caller commits, or rolls back when it did not."""
+    return (
+        Task.query
+        .filter(Task.id == task.id, Task.worker_id == _claim.worker_id, Task.status == 'PROCESSING')
+        .update(updates, synchronize_session=False)
+    ) == 1
+
+
+def set_stage(task, stage):
+    """Record the stage the running task reached and commit it with the handler's work so far. Raises
+    LeaseLost (after rolling back) if the task was given to another worker meanwhile."""
+    if not _update_claimed(task, {Task.stage: stage}):
+        db.session.rollback()
+        raise LeaseLost(f"Task {task.id} is no longer held by worker {_claim.worker_id}")
+    task.stage = stage
+    db.session.commit()
+
+
+def complete(task, **values):
+    """Mark the task this thread is running COMPLETED (setting `values` too, e.g. result=...) and commit it
+    with everything the handler added to the session, but only if this worker still holds the task. If
+    recover_stale gave it to another worker meanwhile, roll back and raise LeaseLost, so the task is not
+    finished twice (duplicate history rows, double-counted catalog scans)."""
+    updates = {Task.status: 'COMPLETED', Task.stage: 'COMPLETED', Task.worker_id: None, Task.lease_expires_at: None}
+    updates.update({getattr(Task, name): value for name, value in values.items()})
+    if not _update_claimed(task, updates):
+        db.session.rollback()
+        raise LeaseLost(f"Task {task.id} is no longer held by worker {_claim.worker_id}")
+    db.session.commit()
+
+
+def release_for_retry(task, error):
+    """Fail the task permanently or put it back with exponential backoff, unless another worker holds it
+    by now (its lease expired and recover_stale re-queued it): that worker's attempt is left alone."""
+    stranded = []
+    if task.attempts >= MAX_ATTEMPTS:
+        status, result = 'FAILED', str(error)
+        updates = {Task.result: result}
+    else:
+        delay = RETRY_BACKOFF_SECONDS * (2 ** (task.attempts - 1))
+        status = 'PENDING'
+        updates = {Task.available_at: datetime.utcnow() + timedelta(seconds=delay)}
+    updates.update({Task.status: status, Task.stage: status, Task.worker_id: None, Task.lease_expires_at: None})
+    if not _update_claimed(task, updates):
+        db.session.rollback()
+        stats.incr('lost')
+        logger.warning(f"Task {task.id} attempt {task.attempts} failed after its lease was lost, "
+                       f"leaving it to its current worker: {error}")
+        return
+    if status == 'FAILED':
+        stats.incr('failed')
+        if task.kind == 'batch':
+            stranded = fail_waiting_children(task.id, result)
+    else:
+        stats.incr('retried')
+        logger.warning(f"Task {task.id} attempt {task.attempts} failed, retrying in {delay:.0f}s: {error}")
+    db.session.commit()
+    if status == 'FAILED':
+        task_events.publish(task.id, 'FAILED', error=result)
+        publish_failed_children(stranded)
+    else:
+        task_events.publish(task.id, 'PENDING', 'RETRYING', attempt=task.attempts)
+
+
+def counts_by_status():
+    rows = db.session.query(Task.status, func.count(Task.id)).group_by(Task.status).all()
+    return {status: count for status, count in rows}
+
+
+def queue_stats():
+    oldest = (
+        db.session.query(func.min(Task.created_at))
+        .filter(Task.status == 'PENDING', Task.kind != 'enrich')
+        .scalar()
+    )
+    by_status = counts_by_status()
+    return {
+        "depth": queue_depth(),
+        "byStatus": by_status,
+        "oldestPendingSeconds": round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else 0,
+        "config": {
+            "workerThreads": WORKER_THREADS,
+            "maxAttempts": MAX_ATTEMPTS,
+            "leaseSeconds": LEASE_SECONDS,
+            "retryBackoffSeconds": RETRY_BACKOFF_SECONDS,
+            "maxQueueDepth": MAX_QUEUE_DEPTH,
+        },
+        "node": stats.snapshot(),
+    }
+
+
+class _Heartbeat(threading.Thread):
+    def __init__(self, app, task_id, worker_id):
+        super().__init__(daemon=True)
+        self.app = app
+        self.task_id = task_id
+        self.worker_id = worker_id
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(LEASE_SECONDS / 3):
+            with self.app.app_context():
+                try:
+                    if not heartbeat(self.task_id, self.worker_id):
+                        logger.warning(f"Lost lease on task {self.task_id}")
+                        return
+                except Exception as e:
+                    logger.error(f"Heartbeat for task {self.task_id} failed: {e}")
+
+
+def run_claimed(app, task, handler, worker_id):
+    """Run a task this worker claimed: lease heartbeat, metrics, and retry or failure on error.
+    Call inside an app context."""
+    queue_wait = (datetime.utcnow() - task.created_at).total_seconds()
+    stats.record_stage('queue_wait', queue_wait)
+    metrics.SCAN_QUEUE_WAIT_SECONDS.observe(queue_wait)
+    stats.set_busy(1)
+    beat = _Heartbeat(app, task.id, worker_id)
+    beat.start()
+    started = time.perf_counter()
+    outcome = 'completed'
+    _claim.worker_id = worker_id
+    try:
+        handler(app, task)
+        stats.incr('completed')
+    except LeaseLost as e:
+        # The worker that holds the task now finishes it; nothing of this attempt was committed
+        outcome = 'lost'
+        db.session.rollback()
+        stats.incr('lost')
+        logger.warning(f"{e}; discarded this attempt")
+    except Exception as e:
+        outcome = 'error'
+        db.session.rollback()
+        failed = db.session.get(Task, task.id)
+        # The stage the task last reached tells OCR, LLM and DB failures apart
+        metrics.SCAN_ERRORS.labels(failed.stage or 'PROCESSING', type(e).__name__).inc()
+        release_for_retry(failed, e)
+    finally:
+        _claim.worker_id = None
+        beat.stopped.set()
+        stats.set_busy(-1)
+        elapsed = time.perf_counter() - started
+        stats.record_stage('total', elapsed)
+        metrics.SCAN_TOTAL_SECONDS.labels(outcome).observe(elapsed)
+        db.session.remove()
+
+
+def run_worker(app, handler, stop_event, name=None):
+    """Claim and run tasks until stop_event is set. handler(app, task) does the work."""
+    worker_id = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    logger.info(f"Scan worker {worker_id} started")
+    last_recovery = 0.0
+    while not stop_event.is_set():
+        try:
+            with app.app_context():
+                if time.monotonic() - last_recovery > LEASE_SECONDS / 2:
+                    recover_stale()
+                    last_recovery = time.monotonic()
+                retention.maybe_sweep()
+                task = claim_next(worker_id)
+                if task is None:
+                    db.session.remove()
+                    stop_event.wait(POLL_INTERVAL_SECONDS)
+                    continue
+                run_claimed(app, task, handler, worker_id)
+        except Exception as e:
+            logger.error(f"Scan worker {worker_id} loop error: {e}", exc_info=True)
+            stop_event.wait(POLL_INTERVAL_SECONDS)
+    logger.info(f"Scan worker {worker_id} stopped")
+
+
+def unfinished_in_batch(batch_id):
+    return Task.query.filter(Task.batch_id == batch_id,
+                             Task.status.in_(('WAITING', 'PENDING', 'PROCESSING'))).count()
+
+
+def run_batch(app, handler, batch_id, parallelism, on_progress=None):
+    """
+    Work through a batch's child tasks on `parallelism` extra threads until every child has finished.
+    Regular workers may claim children too; children waiting out a retry backoff are picked up when due.
+    on_progress(finished) is called (in an app context) after each child this call ran.
+    """
+    worker_prefix = f"{socket.gethostname()}:{os.getpid()}:batch-{batch_id[:8]}"
+    finished = []
+    lock = threading.Lock()
+
+    def drain(index):
+        worker_id = f"{worker_prefix}:{index}"
+        while True:
+            with app.app_context():
+                try:
+                    task = claim_next(worker_id, batch_id=batch_id)
+                    if task is None:
+                        remaining = unfinished_in_batch(batch_id)
+                        db.session.remove()
+                        if remaining == 0:
+                            return
+                        time.sleep(POLL_INTERVAL_SECONDS)
+                        continue
+                    task_id = task.id
+                    run_claimed(app, task, handler, worker_id)
+                    with lock:
+                        finished.append(task_id)
+                        count = len(finished)
+                    if on_progress:
+                        on_progress(count)
+                except Exception as e:
+                    logger.error(f"Batch {batch_id} worker {worker_id} error: {e}", exc_info=True)
+                    db.session.remove()
+                    time.sleep(POLL_INTERVAL_SECONDS)
+
+    threads = [threading.Thread(target=drain, args=(i,), daemon=True, name=f"batch-{batch_id[:8]}-{i}")
+               for i in range(max(parallelism, 1))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+_embedded_lock = threading.Lock()
+_embedded_started = False
+
+
+def start_workers(app, handler, count, daemon=True):
+    """Start count worker threads in this process and return (threads, stop_event)."""
+    stop_event = threading.Event()
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=run_worker, args=(app, handler, stop_event), daemon=daemon,
+                                  name=f"scan-worker-{i}")
+        thread.start()
+        threads.append(thread)
+    stats.total_workers += count
+    metrics.WORKERS.inc(count)
+    return threads, stop_event
+
+
+def ensure_embedded_workers(app, handler):
+    """Start the in-process worker pool once (disabled with SCAN_WORKER_THREADS=0)."""
+    global _embedded_started
+    if _embedded_started or WORKER_THREADS <= 0:
+        return
+    with _embedded_lock:
+        if not _embedded_started:
+            start_workers(app, handler, WORKER_THREADS)
+            _embedded_started = True
@@ -0,0 +1,67 @@
+import json
+
+
+class TopLevelFieldParser:
+    """
+    Incrementally parse a streamed JSON object and report each top-level
+    field as soon as its value is complete.
+
+    Feed raw text chunks (markdown fences and leading chatter before the
+    first '{' are ignored); feed() returns the (key, value) pairs completed
+    by that chunk.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.member_start = None
+        self.fields = {}
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        completed = []
+        while self.pos < len(self.buffer) and not self.finished:
+            char = self.buffer[self.pos]
+            if not self.started:
+                if char == '{':
+                    self.started = True
+                    self.depth = 1
+                    self.member_start = self.pos + 1
+            elif self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == '\\':
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif char == '"':
+                self.in_string = True
+            elif char in '{[':
+                self.depth += 1
+            elif char in '}]':
+                self.depth -= 1
+                if self.depth == 0:
+                    self._close_member(self.pos, completed)
+                    self.finished = True
+            elif char == ',' and self.depth == 1:
+                self._close_member(self.pos, completed)
+                self.member_start = self.pos + 1
+            self.pos += 1
+        return completed
+
+    def _close_member(self, end, completed):
+        member = self.buffer[self.member_start:end].strip()
+        if not member:
+            return
+        try:
+            parsed = json.loads('{' + member + '}')
+        except ValueError:
+            return  # malformed member; the full-document parse will surface the error
+        for key, value in parsed.items():
+            self.fields[key] = value
+            completed.append((key, value))
@@ -0,0 +1,271 @@
+"""Model routing, prompt trimming and token budgets for the Groq calls in groq_ai.
+
+- Short labels and simple chat questions go to a small, fast model
+  (LLM_MODEL_SMALL); long labels and open-ended questions to the large one
+  (LLM_MODEL_LARGE). An extraction from the small model that does not parse
+  or looks incomplete is retried once on the large model.
+- OCR text is cleaned before prompting: repeated lines (the same panel read
+  from two photos), symbol noise and runs of whitespace are dropped, and the
+  text is capped at LLM_OCR_MAX_CHARS.
+- Token budgets: LLM_USER_TOKENS_PER_HOUR per user and
+  LLM_GLOBAL_TOKENS_PER_MINUTE for the whole process (0 disables either).
+  A call that would start over budget raises BudgetExceeded.
+- Requests, tokens, cost and latency are tracked per (call, model) route,
+  at GET /api/llm/stats and in the ecoscan_llm_route_*, ecoscan_llm_escalations
+  and ecoscan_llm_budget_rejections metrics.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+LLM_MODEL_LARGE = os.getenv('LLM_MODEL_LARGE', 'llama-3.3-70b-versatile')
+LLM_MODEL_SMALL = os.getenv('LLM_MODEL_SMALL', 'llama-3.1-8b-instant')
+LLM_ROUTING_ENABLED = os.getenv('LLM_ROUTING_ENABLED', 'true').lower() == 'true'
+LLM_SMALL_LABEL_MAX_CHARS = int(os.getenv('LLM_SMALL_LABEL_MAX_CHARS', '1500'))
+LLM_OCR_MAX_CHARS = int(os.getenv('LLM_OCR_MAX_CHARS', '6000'))
+CHAT_SIMPLE_MAX_WORDS = int(os.getenv('CHAT_SIMPLE_MAX_WORDS', '12'))
+LLM_USER_TOKENS_PER_HOUR = int(os.getenv('LLM_USER_TOKENS_PER_HOUR', '100000'))
+LLM_GLOBAL_TOKENS_PER_MINUTE = int(os.getenv('LLM_GLOBAL_TOKENS_PER_MINUTE', '0'))
+
+# model -> (USD per million prompt tokens, USD per million completion tokens)
+MODEL_PRICES = {
+    'llama-3.3-70b-versatile': (0.59, 0.79),
+    'llama-3.1-8b-instant': (0.05, 0.08),
+}
+
+# Questions a small model answers as well as a large one: yes/no and single-fact lookups
+SIMPLE_QUESTION = re.compile(
+    r"^(is|are|does|do|has|have|can|contains?|any)\b|"
+    r"^what('?s| is| are) (the |its )?(health|eco|nutri\w*|calorie|protein|sugar|fat|salt|verdict|score|packaging)")
+COMPLEX_QUESTION = re.compile(r"\b(why|explain|compare|comparison|should|recommend|alternatives?|better|instead|how)\b")
+
+
+class BudgetExceeded(Exception):
+    """A token budget is used up; retry_after is the number of seconds until it has room again."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f"LLM token budget exceeded ({scope}), retry in {retry_after:.0f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBudget:
+    """Tokens used per key over a sliding window."""
+
+    def __init__(self, limit, window_seconds):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._usage = defaultdict(deque)  # key -> deque of (monotonic time, tokens)
+        self.rejections = 0
+
+    def _expire(self, entries, now):
+        while entries and entries[0][0] <= now - self.window_seconds:
+            entries.popleft()
+
+    def used(self, key):
+        with self._lock:
+            entries = self._usage.get(key)
+            if not entries:
+                return 0
+            self._expire(entries, time.monotonic())
+            return sum(tokens for _, tokens in entries)
+
+    def check(self, key, scope, estimate):
+        """Raise BudgetExceeded if `estimate` more tokens would not fit."""
+        if self.limit <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            entries = self._usage[key]
+            self._expire(entries, now)
+            used = sum(tokens for _, tokens in entries)
+            if used + estimate <= self.limit or not entries:
+                return
+            self.rejections += 1
+            retry_after = entries[0][0] + self.window_seconds - now
+        metrics.LLM_BUDGET_REJECTIONS.labels(scope).inc()
+        raise BudgetExceeded(scope, retry_after)
+
+    def add(self, key, tokens):
+        if self.limit <= 0 or tokens <= 0:
+            return
+        with self._lock:
+            self._usage[key].append((time.monotonic(), tokens))
+
+
+user_budget = TokenBudget(LLM_USER_TOKENS_PER_HOUR, 3600)
+global_budget = TokenBudget(LLM_GLOBAL_TOKENS_PER_MINUTE, 60)
+
+
+class RouteStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = defaultdict(lambda: defaultdict(float))
+        self.escalations = defaultdict(int)
+        self.ocr_chars_in = 0
+        self.ocr_chars_out = 0
+
+    def record(self, call, model, prompt_tokens, completion_tokens, cost, seconds, failed):
+        with self._lock:
+            route = self._routes[(call, model)]
+            route['requests'] += 1
+            route['errors'] += 1 if failed else 0
+            route['promptTokens'] += prompt_tokens
+            route['completionTokens'] += completion_tokens
+            route['costUsd'] += cost
+            route['seconds'] += seconds
+
+    def record_escalation(self, call, reason):
+        with self._lock:
+            self.escalations[f"{call}:{reason}"] += 1
+
+    def record_trim(self, chars_in, chars_out):
+        with self._lock:
+            self.ocr_chars_in += chars_in
+            self.ocr_chars_out += chars_out
+
+    def snapshot(self):
+        with self._lock:
+            routes = []
+            for (call, model), route in sorted(self._routes.items()):
+                requests = int(route['requests'])
+                routes.append({
+                    "call": call,
+                    "model": model,
+                    "requests": requests,
+                    "errors": int(route['errors']),
+                    "promptTokens": int(route['promptTokens']),
+                    "completionTokens": int(route['completionTokens']),
+                    "costUsd": round(route['costUsd'], 6),
+                    "avgSeconds": round(route['seconds'] / requests, 3) if requests else 0.0,
+                })
+            return {
+                "routes": routes,
+                "escalations": dict(self.escalations),
+                "ocrCharsIn": self.ocr_chars_in,
+                "ocrCharsOut": self.ocr_chars_out,
+            }
+
+
+stats = RouteStats()
+
+
+def route_stats():
+    return {
+        **stats.snapshot(),
+        "budgets": {
+            "userTokensPerHour": LLM_USER_TOKENS_PER_HOUR,
+            "globalTokensPerMinute": LLM_GLOBAL_TOKENS_PER_MINUTE,
+            "globalTokensUsed": global_budget.used('all'),
+            "userRejections": user_budget.rejections,
+            "globalRejections": global_budget.rejections,
+        },
+        "models": {"small": LLM_MODEL_SMALL, "large": LLM_MODEL_LARGE, "routing": LLM_ROUTING_ENABLED},
+    }
+
+
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+# --- Prompt trimming ---------------------------------------------------------
+
+def clean_ocr_text(ocr_text):
+    """OCR text with duplicate lines, symbol noise and extra whitespace removed, capped at LLM_OCR_MAX_CHARS."""
+    seen = set()
+    lines = []
+    for line in (ocr_text or '').splitlines():
+        line = re.sub(r'[ \t]+', ' ', line).strip()
+        alnum = sum(c.isalnum() for c in line)
+        if alnum < 2 or alnum < 0.4 * len(line):
+            continue
+        key = re.sub(r'[^a-z0-9]+', '', line.lower())
+        if key in seen:
+            continue
+        seen.add(key)
+        lines.append(line)
+    cleaned = "\n".join(lines)
+    if len(cleaned) > LLM_OCR_MAX_CHARS:
+        cleaned = cleaned[:LLM_OCR_MAX_CHARS].rsplit('\n', 1)[0]
+    stats.record_trim(len(ocr_text or ''), len(cleaned))
+    return cleaned
+
+
+# --- Routing -----------------------------------------------------------------
+
+def extraction_model(ocr_text):
+    if LLM_ROUTING_ENABLED and len(ocr_text) <= LLM_SMALL_LABEL_MAX_CHARS:
+        return LLM_MODEL_SMALL
+    return LLM_MODEL_LARGE
+
+
+def chat_model(query):
+    words = query.lower().split()
+    text = " ".join(words)
+    if (LLM_ROUTING_ENABLED and len(words) <= CHAT_SIMPLE_MAX_WORDS and SIMPLE_QUESTION.search(text)
+            and not COMPLEX_QUESTION.search(text)):
+        return LLM_MODEL_SMALL
+    return LLM_MODEL_LARGE
+
+
+def escalation_reason(data):
+    """Why an extraction should be redone on the large model, or None if it looks usable."""
+    if "error" in data:
+        return 'parse_failure'
+    name = str(data.get('product_name') or '').strip().lower()
+    if (not name or name == 'unknown product') and not data.get('ingredients'):
+        return 'incomplete'
+    for field in ('base_health_score', 'eco_score'):
+        value = data.get(field)
+        if not isinstance(value, (int, float)) or not 0 <= value <= 100:
+            return 'invalid_score'
+    return None
+
+
+def escalate(call, model, reason):
+    """The model to retry with after `reason`, or None when already on the large one."""
+    if model == LLM_MODEL_LARGE:
+        return None
+    logger.info(f"Escalating {call} from {model} to {LLM_MODEL_LARGE}: {reason}")
+    stats.record_escalation(call, reason)
+    metrics.LLM_ESCALATIONS.labels(call, reason).inc()
+    return LLM_MODEL_LARGE
+
+
+# --- Budgets and accounting --------------------------------------------------
+
+def check_budget(user_id, prompt_text):
+    """Raise BudgetExceeded before a call whose prompt would not fit the user's or the global budget."""
+    estimate = estimate_tokens(prompt_text)
+    global_budget.check('all', 'global', estimate)
+    if user_id is not None:
+        user_budget.check(user_id, 'user', estimate)
+
+
+def record_call(call, model, user_id, usage, seconds, prompt_text='', completion_text='', failed=False):
+    """Account one finished (or abandoned) call: tokens, cost, latency and budget use.
+    Streams cut short carry no usage, so it is estimated from the text."""
+    if usage is not None:
+        metrics.record_llm_usage(call, usage)
+        prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+        completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    else:
+        prompt_tokens = estimate_tokens(prompt_text) if prompt_text else 0
+        completion_tokens = estimate_tokens(completion_text) if completion_text else 0
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    cost = (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+    stats.record(call, model, prompt_tokens, completion_tokens, cost, seconds, failed)
+    metrics.LLM_ROUTE_SECONDS.labels(call, model).observe(seconds)
+    metrics.LLM_COST_USD.labels(call, model).inc(cost)
+    tokens = prompt_tokens + completion_tokens
+    global_budget.add('all', tokens)
+    if user_id is not None:
+        user_budget.add(user_id, tokens)
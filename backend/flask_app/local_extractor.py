@@ -0,0 +1,398 @@
+"""Deterministic label parser: the fast path in front of the LLM.
+
+Reads the product name, ingredient list, nutrition table, allergens,
+additives (INS/E numbers), palm oil, packaging and the usual label details
+straight out of the OCR text, and scores how complete and clean the result
+is. When the confidence reaches FAST_PATH_MIN_CONFIDENCE the scan is
+answered from this result in milliseconds; the LLM can still run later in
+the background (FAST_PATH_ENRICH) and replace it in the catalog.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import metrics
+from catalog import fssai_numbers
+from scoring import base_health_score, ingredient_groups
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv('FAST_PATH_ENABLED', 'true').lower() == 'true'
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv('FAST_PATH_MIN_CONFIDENCE', '0.85'))
+FAST_PATH_ENRICH = os.getenv('FAST_PATH_ENRICH', 'true').lower() == 'true'
+
+# INS / E number -> (name, of concern). Codes are matched inside the ingredient list only.
+ADDITIVES = {
+    '100': ('Curcumin', False), '102': ('Tartrazine', True), '110': ('Sunset Yellow FCF', True),
+    '122': ('Carmoisine', True), '124': ('Ponceau 4R', True), '129': ('Allura Red', True),
+    '133': ('Brilliant Blue FCF', True), '150a': ('Plain caramel', False), '150c': ('Ammonia caramel', True),
+    '150d': ('Sulphite ammonia caramel', True), '160a': ('Beta-carotene', False), '160c': ('Paprika extract', False),
+    '202': ('Potassium sorbate', False), '211': ('Sodium benzoate', True), '220': ('Sulphur dioxide', True),
+    '223': ('Sodium metabisulphite', True), '250': ('Sodium nitrite', True), '260': ('Acetic acid', False),
+    '270': ('Lactic acid', False), '296': ('Malic acid', False), '300': ('Ascorbic acid', False),
+    '319': ('TBHQ', True), '320': ('BHA', True), '321': ('BHT', True), '322': ('Lecithin', False),
+    '330': ('Citric acid', False), '331': ('Sodium citrates', False), '338': ('Phosphoric acid', True),
+    '407': ('Carrageenan', True), '410': ('Locust bean gum', False), '412': ('Guar gum', False),
+    '414': ('Gum arabic', False), '415': ('Xanthan gum', False), '440': ('Pectin', False),
+    '450': ('Diphosphates', False), '451': ('Triphosphates', True), '466': ('Carboxymethyl cellulose', True),
+    '471': ('Mono- and diglycerides of fatty acids', False), '481': ('Sodium stearoyl lactylate', False),
+    '500': ('Sodium carbonates', False), '501': ('Potassium carbonates', False), '503': ('Ammonium carbonates', False),
+    '508': ('Potassium chloride', False), '551': ('Silicon dioxide', False), '621': ('Monosodium glutamate', True),
+    '627': ('Disodium guanylate', False), '631': ('Disodium inosinate', False), '635': ('Disodium ribonucleotides', True),
+    '950': ('Acesulfame potassium', True), '951': ('Aspartame', True), '955': ('Sucralose', True),
+    '960': ('Steviol glycosides', False), '1422': ('Acetylated distarch adipate', False),
+}
+
+PALM_OIL = re.compile(r'palm\s*(?:oil|olein|kernel|fat)|palmolein', re.I)
+MEAT = re.compile(r'\b(?:chicken|mutton|beef|pork|lamb|meat|fish|prawn|shrimp|tuna|egg)s?\b', re.I)
+DAIRY = re.compile(r'\b(?:milk|whey|butter|cream|cheese|ghee|casein|paneer|curd|khoa)\b', re.I)
+WHOLE_GRAIN = re.compile(r'whole\s*(?:wheat|grain)|oats|millet|ragi|multigrain|brown rice', re.I)
+
+# Packaging keyword -> (packaging, eco adjustment)
+PACKAGING = [
+    (re.compile(r'glass\s*(?:bottle|jar)', re.I), 'Glass Bottle', 5),
+    (re.compile(r'tetra\s*pa[ck]k?|aseptic\s*carton', re.I), 'Tetra Pak', 0),
+    (re.compile(r'\b(?:metal|aluminium|aluminum|tin)\s*can\b|\bcanned\b', re.I), 'Metal Can', 5),
+    (re.compile(r'\bpet\s*bottle|plastic\s*bottle', re.I), 'Plastic Bottle', -10),
+    (re.compile(r'\bpouch\b', re.I), 'Plastic Pouch', -10),
+    (re.compile(r'cardboard|paperboard|\bcarton\b|\bbox\b', re.I), 'Cardboard Box', 5),
+    (re.compile(r'\bplastic\b', re.I), 'Plastic', -10),
+]
+
+INGREDIENTS_HEADER = re.compile(r'\bingredients?\s*[:\-–]?\s*', re.I)
+# Headers that end the ingredient list or name the next label section
+SECTION_HEADER = re.compile(
+    r'\b(?:contains|allergen|nutrition(?:al)?|mfd|manufactured|marketed|packed|mrp|net\s*(?:wt|weight|qty|quantity)'
+    r'|best\s*before|use\s*by|expiry|storage|store\s|fssai|batch|lic(?:ence|ense)?\s*no)', re.I)
+NUTRITION_HEADER = re.compile(r'nutrition(?:al)?\s*(?:information|facts|value)?', re.I)
+NUTRITION_END = re.compile(r'\b(?:ingredients?|mfd|manufactured|marketed|packed|mrp|net\s*(?:wt|weight)|best\s*before)\b', re.I)
+MANUFACTURER = re.compile(r'(?:mfd|manufactured|marketed|packed)\.?\s*(?:&\s*\w+\.?\s*)?by\s*[:\-]?\s*([^\n]+)', re.I)
+COMPANY_SUFFIX = re.compile(r'\s*(?:pvt\.?|private|ltd\.?|limited|inc\.?|llp|co\.|corporation|industries)\b.*$', re.I)
+
+NUMBER = r'(\d+(?:[.,]\d+)?)'
+# Nutrient -> label pattern; the value is the first number (with unit) shortly after the label
+NUTRIENTS = {
+    'calories': r'energy|calories|calorific\s*value',
+    'protein': r'proteins?',
+    'carbs': r'(?:total\s*)?carbohydrates?|carbs',
+    'sugar': r'(?:total\s*|added\s*)?sugars?',
+    'fat': r'(?:total\s*)?fats?',
+    'fiber': r'(?:dietary\s*)?fib(?:re|er)',
+    'salt': r'salt|sodium',
+}
+MINOR_FATS = re.compile(r'(?:saturat|trans|mono|poly)\w*\s*$', re.I)
+
+
+class FastPathStats:
+    """Counters for /api/cache/stats: how many scans the parser answered and how much LLM time that saved."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.served = 0
+        self.llm_samples = 0
+        self.llm_seconds = 0.0
+        self.local_seconds = 0.0
+
+    def record_attempt(self, served, seconds):
+        with self._lock:
+            self.attempts += 1
+            if served:
+                self.served += 1
+                self.local_seconds += seconds
+                if self.llm_samples:
+                    metrics.FAST_PATH_SAVED_SECONDS.inc(max(0.0, self.llm_seconds / self.llm_samples - seconds))
+
+    def record_llm(self, seconds):
+        with self._lock:
+            self.llm_samples += 1
+            self.llm_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            avg_llm = self.llm_seconds / self.llm_samples if self.llm_samples else None
+            saved = avg_llm * self.served - self.local_seconds if avg_llm is not None else None
+            return {
+                "enabled": FAST_PATH_ENABLED,
+                "minConfidence": FAST_PATH_MIN_CONFIDENCE,
+                "attempts": self.attempts,
+                "served": self.served,
+                "servedRatio": round(self.served / self.attempts, 3) if self.attempts else 0.0,
+                "avgLlmSeconds": round(avg_llm, 3) if avg_llm is not None else None,
+                "estimatedSecondsSaved": round(saved, 1) if saved is not None else None,
+            }
+
+
+stats = FastPathStats()
+
+
+def _title(value):
+    value = re.sub(r'\s+', ' ', value).strip(' .,:;-')
+    return value.title() if value.isupper() else value
+
+
+def _alpha_ratio(value):
+    chars = [c for c in value if not c.isspace()]
+    return sum(c.isalpha() for c in chars) / len(chars) if chars else 0.0
+
+
+def _split_top_level(text):
+    """Split on commas/semicolons that are not inside brackets."""
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char in '([{':
+            depth += 1
+        elif char in ')]}':
+            depth = max(0, depth - 1)
+        if char in ',;' and depth == 0:
+            parts.append(''.join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append(''.join(current))
+    return [part.strip() for part in parts if part.strip()]
+
+
+def ingredient_section(text):
+    match = INGREDIENTS_HEADER.search(text)
+    if not match:
+        return None
+    rest = text[match.end():]
+    end = len(rest)
+    for pattern in (SECTION_HEADER, re.compile(r'\n\s*\n'), re.compile(r'(?<!\d)\.(?!\d)\s*(?:\n|$)')):
+        found = pattern.search(rest)
+        if found:
+            end = min(end, found.start())
+    # Rejoin words hyphenated across OCR lines, then lines
+    section = re.sub(r'-\s*\n\s*', '', rest[:end])
+    return re.sub(r'\s*\n\s*', ' ', section).strip()
+
+
+def parse_ingredients(section):
+    ingredients = []
+    for token in _split_top_level(section):
+        percentage = re.search(r'(\d+(?:\.\d+)?)\s*%', token)
+        name = re.sub(r'[(\[]\s*\d+(?:\.\d+)?\s*%\s*[)\]]|\d+(?:\.\d+)?\s*%', '', token)
+        name = _title(name.replace('[', '(').replace(']', ')'))
+        if not name:
+            continue
+        allergen = bool(ingredient_groups(name.lower()))
+        ingredients.append({"name": name, "percentage": f"{percentage.group(1)}%" if percentage else "",
+                            "allergen": allergen})
+    return ingredients
+
+
+def parse_additives(section):
+    found = {}
+    for match in re.finditer(r'\b(?:E|INS)?\s?(\d{3,4}[a-d]?)(?:\s?\((?:i{1,3}|iv|v|vi)\))?', section, re.I):
+        code = match.group(1).lower()
+        entry = ADDITIVES.get(code) or ADDITIVES.get(code.rstrip('abcd'))
+        if entry and code not in found:
+            found[code] = {"code": f"INS {code}", "name": entry[0], "concern": entry[1]}
+    return list(found.values())
+
+
+def _format_amount(value, unit):
+    return f"{round(value, 2):g} {unit}" if unit == 'kcal' else f"{round(value, 2):g}{unit}"
+
+
+def parse_nutrition(text):
+    header = NUTRITION_HEADER.search(text)
+    if header:
+        section = text[header.end():]
+        end = NUTRITION_END.search(section)
+        section = section[:end.start()] if end else section
+    else:
+        section = text
+    facts = {}
+    for key, label in NUTRIENTS.items():
+        for match in re.finditer(rf'\b({label})\b[^\d\n]{{0,20}}?{NUMBER}\s*(kcal|kj|mg|g|gm)?\b', section, re.I):
+            if key == 'fat' and MINOR_FATS.search(section[max(0, match.start() - 14):match.start()]):
+                continue
+            value = float(match.group(2).replace(',', '.'))
+            unit = (match.group(3) or '').lower()
+            if key == 'calories':
+                if unit == 'kj':
+                    # Prefer a kcal figure printed next to the kJ one
+                    kcal = re.match(rf'[^\d\n]{{0,6}}{NUMBER}\s*kcal', section[match.end():], re.I)
+                    value = float(kcal.group(1).replace(',', '.')) if kcal else value / 4.184
+                facts[key] = _format_amount(value, 'kcal')
+            elif key == 'salt':
+                if match.group(1).lower() == 'sodium':
+                    grams = value / 1000 if unit == 'mg' else value
+                    value = grams * 2.5
+                elif unit == 'mg':
+                    value /= 1000
+                facts[key] = _format_amount(value, 'g')
+            else:
+                facts[key] = _format_amount(value / 1000 if unit == 'mg' else value, 'g')
+            break
+    return facts
+
+
+def _header_lines(text):
+    match = INGREDIENTS_HEADER.search(text)
+    head = text[:match.start()] if match else text[:200]
+    lines = []
+    for line in head.splitlines():
+        line = line.strip(' .,:;-|*')
+        words = line.split()
+        if (1 <= len(words) <= 8 and _alpha_ratio(line) >= 0.8 and not SECTION_HEADER.search(line)
+                and not re.search(r'\b(?:veg|non-veg|new|pack of|net)\b', line, re.I)):
+            lines.append(line)
+    return lines
+
+
+def parse_identity(text):
+    """(product name, brand, manufacturer details)."""
+    manufacturer = MANUFACTURER.search(text)
+    details = manufacturer.group(1).strip() if manufacturer else ''
+    company = COMPANY_SUFFIX.sub('', details.split(',')[0]).strip() if details else ''
+    brand = _title(company) if company else ''
+    name = None
+    for line in _header_lines(text):
+        if brand and line.lower() == brand.lower():
+            continue
+        if len(line.split()) >= 2 or name is None:
+            name = _title(line)
+            if len(line.split()) >= 2:
+                break
+    return name, brand, details
+
+
+def _search(pattern, text, group=1):
+    match = re.search(pattern, text, re.I)
+    return match.group(group).strip(' .,;') if match else ''
+
+
+def parse_other_info(text, brand, manufacturer_details):
+    certifications = [label for label, pattern in (('Organic', r'\borganic\b'), ('Halal', r'\bhalal\b'),
+                                                   ('Vegan', r'\bvegan\b'), ('ISO', r'\biso\s*\d{4,5}'))
+                      if re.search(pattern, text, re.I)]
+    return {
+        "manufacturer_details": manufacturer_details,
+        "manufacturer_contact": {
+            "phone": _search(r'((?:\+91[\s-]?)?(?:1800[\s-]?\d{3}[\s-]?\d{4}|\d{10}|\d{3,5}[\s-]\d{6,8}))', text),
+            "email": _search(r'([\w.+-]+@[\w-]+\.[\w.]+)', text),
+            "website": _search(r'((?:https?://)?www\.[\w-]+\.[\w.]+)', text),
+        },
+        "fssai_or_license_numbers": sorted(set(fssai_numbers(text))),
+        "expiry_or_best_before": _search(r'((?:best\s*before|use\s*by|expiry)[^\n]{0,40})', text),
+        "manufacturing_date": _search(r'(?:mfg|mfd|packed)\.?\s*(?:date|on)\s*[:\-]?\s*([\d/.\-]{6,10})', text),
+        "mrp_price": _search(r'mrp\s*[:\-]?\s*((?:rs\.?|₹|inr)?\s*\d+(?:\.\d{1,2})?)', text),
+        "net_quantity": _search(r'net\s*(?:wt|weight|qty|quantity|content)s?\.?\s*[:\-]?\s*(\d+(?:\.\d+)?\s*(?:kg|gm|g|ml|l|ltr))\b', text),
+        "brand": brand,
+        "origin": _title(_search(r'(?:country\s*of\s*origin\s*[:\-]?|made\s*in)\s*([a-z ]{3,20})', text)),
+        "certifications": certifications,
+    }
+
+
+def eco_assessment(text, ingredient_text, palm_oil):
+    score, reasons = 60, []
+    if palm_oil:
+        score -= 15
+        reasons.append("contains palm oil")
+    if MEAT.search(ingredient_text):
+        score -= 20
+        footprint = 'High'
+        reasons.append("contains meat, fish or egg")
+    elif DAIRY.search(ingredient_text):
+        score -= 10
+        footprint = 'Medium'
+        reasons.append("contains dairy")
+    else:
+        score += 5
+        footprint = 'Low'
+        reasons.append("plant-based ingredients")
+    packaging = 'Unknown'
+    for pattern, name, adjustment in PACKAGING:
+        if pattern.search(text):
+            packaging = name
+            score += adjustment
+            reasons.append(f"{name.lower()} packaging")
+            break
+    reasoning = f"{reasons[0][0].upper()}{reasons[0][1:]}" + ''.join(f", {r}" for r in reasons[1:]) + "."
+    return max(0, min(100, score)), reasoning, packaging, footprint
+
+
+def nutritional_benefits(facts, ingredient_text):
+    amounts = {key: float(re.match(r'[\d.]+', value).group()) for key, value in facts.items()}
+    benefits = []
+    if amounts.get('fiber', 0) >= 6:
+        benefits.append("High in dietary fibre")
+    elif amounts.get('fiber', 0) >= 3:
+        benefits.append("Source of dietary fibre")
+    if amounts.get('protein', 0) >= 10:
+        benefits.append("Good source of protein")
+    if WHOLE_GRAIN.search(ingredient_text):
+        benefits.append("Contains whole grains")
+    if 'sugar' in amounts and amounts['sugar'] <= 5:
+        benefits.append("Low in sugar")
+    if 'salt' in amounts and amounts['salt'] <= 0.3:
+        benefits.append("Low in salt")
+    return benefits
+
+
+def parse_label(ocr_text):
+    """Extraction in the LLM's schema plus a confidence in [0, 1] that it is complete and correct."""
+    text = ocr_text or ''
+    section = ingredient_section(text) or ''
+    ingredients = parse_ingredients(section) if section else []
+    facts = parse_nutrition(text)
+    name, brand, manufacturer_details = parse_identity(text)
+    palm_oil = bool(PALM_OIL.search(section or text))
+    additives = parse_additives(section)
+
+    extraction = {
+        "product_name": name or "Unknown Product",
+        "product_description": "",
+        "ingredients": ingredients,
+        "nutritional_facts": facts,
+        "additives": additives,
+        "palm_oil": 'Detected' if palm_oil else 'Not Detected',
+        "nutritional_benefits": nutritional_benefits(facts, section),
+        "other_info": parse_other_info(text, brand, manufacturer_details),
+        "extraction_source": 'local',
+    }
+    eco_score, reasoning, packaging, footprint = eco_assessment(text, section, palm_oil)
+    extraction.update(eco_score=eco_score, eco_score_reasoning=reasoning, packaging=packaging,
+                      carbon_footprint=footprint)
+    concerns = sum(1 for additive in additives if additive['concern'])
+    extraction['base_health_score'] = max(0, base_health_score(extraction) - min(15, 5 * concerns))
+
+    # Confidence: a name, a real ingredient list, most of the nutrition table, and clean OCR in between
+    clean = [i for i in ingredients if 2 <= len(i['name']) <= 60 and _alpha_ratio(i['name']) >= 0.6]
+    confidence = 0.0
+    if name:
+        confidence += 0.2
+    if len(ingredients) >= 3:
+        confidence += 0.35
+    elif ingredients:
+        confidence += 0.15
+    confidence += 0.3 * min(1.0, len(facts) / 5)
+    if ingredients:
+        confidence += 0.15 * len(clean) / len(ingredients)
+    return extraction, round(confidence, 3)
+
+
+def fast_path(ocr_text, timings=None):
+    """The local extraction if it is confident enough to skip the LLM, else None."""
+    if not FAST_PATH_ENABLED:
+        return None
+    started = time.perf_counter()
+    try:
+        extraction, confidence = parse_label(ocr_text)
+    except Exception as e:
+        logger.warning(f"Local label parser failed: {e}", exc_info=True)
+        return None
+    elapsed = time.perf_counter() - started
+    served = confidence >= FAST_PATH_MIN_CONFIDENCE and extraction['product_name'] != "Unknown Product"
+    stats.record_attempt(served, elapsed)
+    metrics.FAST_PATH_CONFIDENCE.observe(confidence)
+    if timings is not None:
+        timings['local_extract'] = elapsed
+    logger.info(f"Local parser confidence {confidence:.2f} in {elapsed * 1000:.1f}ms"
+                f" ({'served' if served else 'falling back to the LLM'})")
+    return extraction if served else None
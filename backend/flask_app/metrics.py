@@ -0,0 +1,98 @@
+"""Prometheus metrics for the Flask app and its scan workers.
+
+Exposed at GET /metrics. Standalone workers (worker.py) run in their own
+process and serve their own copy with --metrics-port.
+"""
+import time
+import uuid
+
+from flask import g, request
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# Scan stages range from sub-millisecond cache lookups to multi-second LLM calls
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    'ecoscan_http_request_seconds', 'HTTP request latency', ['method', 'endpoint', 'status'],
+    buckets=STAGE_BUCKETS)
+SCAN_STAGE_SECONDS = Histogram(
+    'ecoscan_scan_stage_seconds', 'Time spent in each scan stage', ['stage'], buckets=STAGE_BUCKETS)
+SCAN_QUEUE_WAIT_SECONDS = Histogram(
+    'ecoscan_scan_queue_wait_seconds', 'Time from enqueue to a worker claiming the scan',
+    buckets=STAGE_BUCKETS)
+SCAN_TOTAL_SECONDS = Histogram(
+    'ecoscan_scan_total_seconds', 'Worker time per scan attempt', ['outcome'], buckets=STAGE_BUCKETS)
+SCAN_ERRORS = Counter(
+    'ecoscan_scan_errors_total', 'Failed scan attempts by stage reached and error class', ['stage', 'error'])
+SCAN_SOURCES = Counter(
+    'ecoscan_scan_extraction_source_total', 'Where the product extraction came from', ['source'])
+FAST_PATH_CONFIDENCE = Histogram(
+    'ecoscan_fast_path_confidence', 'Confidence of the local label parser per scan',
+    buckets=(0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 1.0))
+FAST_PATH_SAVED_SECONDS = Counter(
+    'ecoscan_fast_path_saved_seconds_total', 'Estimated LLM time saved by scans the local parser answered')
+DB_QUERIES_PER_REQUEST = Histogram(
+    'ecoscan_db_queries_per_request', 'SQL statements run while handling a request', ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+QUEUE_DEPTH = Gauge('ecoscan_scan_queue_depth', 'PENDING scan tasks (background tasks excluded)')
+WORKERS = Gauge('ecoscan_scan_workers', 'Scan worker threads in this process')
+WORKERS_BUSY = Gauge('ecoscan_scan_workers_busy', 'Scan worker threads currently running a task')
+
+LLM_TOKENS = Counter('ecoscan_llm_tokens_total', 'Groq tokens used', ['call', 'kind'])
+LLM_ERRORS = Counter('ecoscan_llm_errors_total', 'Groq call failures by class', ['call', 'error'])
+LLM_ROUTE_SECONDS = Histogram(
+    'ecoscan_llm_route_seconds', 'Groq call latency by call and model', ['call', 'model'], buckets=STAGE_BUCKETS)
+LLM_COST_USD = Counter('ecoscan_llm_route_cost_usd_total', 'Estimated Groq spend by call and model', ['call', 'model'])
+LLM_ESCALATIONS = Counter(
+    'ecoscan_llm_escalations_total', 'Calls retried on the large model, by reason', ['call', 'reason'])
+LLM_BUDGET_REJECTIONS = Counter(
+    'ecoscan_llm_budget_rejections_total', 'Calls refused by a token budget', ['scope'])
+CHAT_REPLIES = Counter('ecoscan_chat_replies_total', 'Chat replies by source', ['source'])
+CHAT_FIRST_TOKEN_SECONDS = Histogram(
+    'ecoscan_chat_first_token_seconds', 'Time until the first streamed chat token from Groq', buckets=STAGE_BUCKETS)
+CHAT_CANCELLED = Counter('ecoscan_chat_cancelled_total', 'Chat streams abandoned by the client before the end')
+LLM_FIRST_FIELD_SECONDS = Histogram(
+    'ecoscan_llm_first_field_seconds', 'Time until the first JSON field streamed back', buckets=STAGE_BUCKETS)
+
+OCR_CALL_SECONDS = Histogram(
+    'ecoscan_ocr_call_seconds', 'OCR latency seen by the Flask app', ['path', 'outcome'], buckets=STAGE_BUCKETS)
+
+TRACE_HEADER = 'X-Trace-Id'
+
+
+def record_llm_usage(call, usage):
+    """Count prompt/completion tokens from a Groq `usage` object (absent on some stream chunks)."""
+    if usage is None:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        count = getattr(usage, kind, None)
+        if count:
+            LLM_TOKENS.labels(call, kind.replace('_tokens', '')).inc(count)
+
+
+def current_trace_id():
+    return getattr(g, 'trace_id', None)
+
+
+def init_app(app):
+    """Time every request and give it a trace id (taken from X-Trace-Id when the caller sent one)."""
+
+    @app.before_request
+    def _start_timer():
+        g.request_started = time.perf_counter()
+        g.trace_id = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_SECONDS.labels(request.method, endpoint, response.status_code).observe(
+                time.perf_counter() - started)
+        response.headers[TRACE_HEADER] = g.get('trace_id', '')
+        return response
+
+
+def render():
+    """(body, content_type) for the /metrics route."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,97 @@
+"""baseline: user, product, scan_history and task
+
+Revision ID: 0001_baseline
+Revises:
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_baseline'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=150), nullable=False),
+        sa.Column('email', sa.String(length=150), nullable=False),
+        sa.Column('password', sa.String(length=150), nullable=False),
+        sa.Column('health_conditions', sa.String(length=500), nullable=True),
+        sa.Column('allergies', sa.String(length=500), nullable=True),
+        sa.Column('diet_type', sa.String(length=100), nullable=True),
+        sa.Column('ingredients_to_avoid', sa.String(length=500), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('product',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('product_key', sa.String(length=64), nullable=False),
+        sa.Column('name', sa.String(length=200), nullable=False),
+        sa.Column('brand', sa.String(length=200), nullable=True),
+        sa.Column('fssai_number', sa.String(length=20), nullable=True),
+        sa.Column('extraction', sa.Text(), nullable=False),
+        sa.Column('scan_count', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('product_key')
+    )
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_fssai_number'), ['fssai_number'], unique=False)
+
+    op.create_table('task',
+        sa.Column('id', sa.String(length=36), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('stage', sa.String(length=20), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('attempts', sa.Integer(), nullable=True),
+        sa.Column('available_at', sa.DateTime(), nullable=True),
+        sa.Column('worker_id', sa.String(length=100), nullable=True),
+        sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+        sa.Column('timings', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('scan_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('product_name', sa.String(length=200), nullable=False),
+        sa.Column('health_score', sa.Integer(), nullable=True),
+        sa.Column('eco_score', sa.Integer(), nullable=True),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('verdict', sa.String(length=20), nullable=True),
+        sa.Column('image_filename', sa.String(length=200), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('full_analysis', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('scan_history', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_scan_history_product_id'), ['product_id'], unique=False)
+        batch_op.create_index('ix_scan_history_user_timestamp', ['user_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('scan_history', schema=None) as batch_op:
+        batch_op.drop_index('ix_scan_history_user_timestamp')
+        batch_op.drop_index(batch_op.f('ix_scan_history_product_id'))
+
+    op.drop_table('scan_history')
+    op.drop_table('task')
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_fssai_number'))
+
+    op.drop_table('product')
+    op.drop_table('user')
@@ -0,0 +1,28 @@
+"""task.batch_id: child scans of a basket (batch) scan
+
+Revision ID: 0003_task_batch
+Revises: 0002_task_kind
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_task_batch'
+down_revision = '0002_task_kind'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('task', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.String(length=36), nullable=True))
+        batch_op.create_index(batch_op.f('ix_task_batch_id'), ['batch_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('task', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_task_batch_id'))
+        batch_op.drop_column('batch_id')
@@ -0,0 +1,36 @@
+"""product_barcode: EAN/UPC codes of catalog products
+
+Revision ID: 0004_product_barcode
+Revises: 0003_task_batch
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_product_barcode'
+down_revision = '0003_task_batch'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('product_barcode',
+        sa.Column('code', sa.String(length=14), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(length=20), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ),
+        sa.PrimaryKeyConstraint('code')
+    )
+    with op.batch_alter_table('product_barcode', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_product_barcode_product_id'), ['product_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('product_barcode', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_product_barcode_product_id'))
+
+    op.drop_table('product_barcode')
@@ -0,0 +1,28 @@
+"""user.preferences and user.prefs_version: stored, versioned preference snapshot
+
+Revision ID: 0005_user_preferences
+Revises: 0004_product_barcode
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005_user_preferences'
+down_revision = '0004_product_barcode'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('preferences', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('prefs_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('prefs_version')
+        batch_op.drop_column('preferences')
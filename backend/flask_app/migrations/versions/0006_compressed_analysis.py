@@ -0,0 +1,45 @@
+"""scan_history.full_analysis becomes binary, holding zlib-compressed JSON
+
+Existing rows are copied as plain UTF-8 bytes, which models.CompressedText
+still reads; `flask --app app compact-storage` compresses them.
+
+Revision ID: 0006_compressed_analysis
+Revises: 0005_user_preferences
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006_compressed_analysis'
+down_revision = '0005_user_preferences'
+branch_labels = None
+depends_on = None
+
+COMPRESSED_PREFIX = b'\x00z'  # models.COMPRESSED_PREFIX at the time of this revision
+
+
+def upgrade():
+    with op.batch_alter_table('scan_history', schema=None) as batch_op:
+        batch_op.alter_column('full_analysis', existing_type=sa.Text(), type_=sa.LargeBinary(),
+                              postgresql_using="convert_to(full_analysis, 'UTF8')")
+
+
+def downgrade():
+    # Text cannot hold compressed values, so inflate them first
+    scan_history = sa.table('scan_history', sa.column('id', sa.Integer), sa.column('full_analysis', sa.LargeBinary))
+    bind = op.get_bind()
+    rows = bind.execute(sa.select(scan_history.c.id, scan_history.c.full_analysis)
+                        .where(scan_history.c.full_analysis.isnot(None))).all()
+    for scan_id, raw in rows:
+        raw = bytes(raw) if not isinstance(raw, str) else raw.encode('utf-8')
+        if raw.startswith(COMPRESSED_PREFIX):
+            bind.execute(scan_history.update().where(scan_history.c.id == scan_id)
+                         .values(full_analysis=zlib.decompress(raw[len(COMPRESSED_PREFIX):])))
+    with op.batch_alter_table('scan_history', schema=None) as batch_op:
+        batch_op.alter_column('full_analysis', existing_type=sa.LargeBinary(), type_=sa.Text(),
+                              postgresql_using="convert_from(full_analysis, 'UTF8')")
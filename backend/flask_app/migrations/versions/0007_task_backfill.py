@@ -0,0 +1,40 @@
+"""task: backfill available_at and fail unrunnable tasks left from before the job queue
+
+Databases adopted before this revision added task.available_at without filling
+it in, so their older PENDING tasks were never claimed. Unfinished tasks with
+no payload were queued in process memory and cannot be resumed.
+
+Revision ID: 0007_task_backfill
+Revises: 0006_compressed_analysis
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007_task_backfill'
+down_revision = '0006_compressed_analysis'
+branch_labels = None
+depends_on = None
+
+# models.LEGACY_TASK_ERROR at the time of this revision
+LEGACY_TASK_ERROR = "Queued before this server version and cannot be resumed; please scan again"
+
+
+def upgrade():
+    task = sa.table('task', sa.column('status', sa.String), sa.column('stage', sa.String),
+                    sa.column('result', sa.Text), sa.column('payload', sa.Text),
+                    sa.column('created_at', sa.DateTime), sa.column('available_at', sa.DateTime))
+    op.execute(task.update().where(task.c.available_at.is_(None))
+               .values(available_at=sa.func.coalesce(task.c.created_at, datetime.utcnow())))
+    op.execute(task.update().where(task.c.status.in_(('WAITING', 'PENDING', 'PROCESSING')),
+                                   task.c.payload.is_(None))
+               .values(status='FAILED', stage='FAILED', result=LEGACY_TASK_ERROR))
+
+
+def downgrade():
+    pass  # data only; the filled-in values are valid under the previous revision too
@@ -0,0 +1,63 @@
+"""scan_history.verdict: backfill from full_analysis for scans saved before the column
+
+The history verdict filter runs in SQL on scan_history.verdict, which only
+scans saved or re-scored since the column was added have.
+
+Revision ID: 0008_scan_verdict_backfill
+Revises: 0007_task_backfill
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+import json
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008_scan_verdict_backfill'
+down_revision = '0007_task_backfill'
+branch_labels = None
+depends_on = None
+
+COMPRESSED_PREFIX = b'\x00z'  # models.COMPRESSED_PREFIX at the time of this revision
+VERDICTS = ('safe', 'warning', 'avoid')
+BATCH_SIZE = 500
+
+
+def _verdict(raw):
+    if not isinstance(raw, str):
+        raw = bytes(raw)
+        if raw.startswith(COMPRESSED_PREFIX):
+            raw = zlib.decompress(raw[len(COMPRESSED_PREFIX):])
+        raw = raw.decode('utf-8')
+    try:
+        verdict = json.loads(raw).get('verdict')
+    except (ValueError, AttributeError):
+        return None
+    verdict = str(verdict or '').strip().lower()
+    return verdict if verdict in VERDICTS else None
+
+
+def upgrade():
+    scan_history = sa.table('scan_history', sa.column('id', sa.Integer), sa.column('verdict', sa.String),
+                            sa.column('full_analysis', sa.LargeBinary))
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(sa.select(scan_history.c.id, scan_history.c.full_analysis)
+                            .where(scan_history.c.id > last_id, scan_history.c.verdict.is_(None),
+                                   scan_history.c.full_analysis.isnot(None))
+                            .order_by(scan_history.c.id).limit(BATCH_SIZE)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for scan_id, raw in rows:
+            verdict = _verdict(raw)
+            if verdict:
+                bind.execute(scan_history.update().where(scan_history.c.id == scan_id).values(verdict=verdict))
+
+
+def downgrade():
+    pass  # data only; the column itself belongs to the baseline revision
@@ -0,0 +1,176 @@
+from flask_login import UserMixin
+from flask_sqlalchemy import SQLAlchemy
+import json
+import zlib
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.types import LargeBinary, TypeDecorator
+from datetime import datetime
+
+db = SQLAlchemy()
+
+COMPRESSED_PREFIX = b'\x00z'  # never starts UTF-8 JSON, so compressed and plain values can share a column
+COMPRESS_MIN_BYTES = 200  # shorter values are stored as plain UTF-8; zlib would barely shrink them
+
+
+def is_compressed(raw):
+    return isinstance(raw, (bytes, memoryview)) and bytes(raw[:2]) == COMPRESSED_PREFIX
+
+
+class CompressedText(TypeDecorator):
+    """Text stored zlib-compressed in a binary column. Reads return str whichever way a value was stored:
+    compressed, plain UTF-8 bytes, or a str left in the column from before it was binary."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        data = value.encode('utf-8')
+        if len(data) < COMPRESS_MIN_BYTES:
+            return data
+        packed = COMPRESSED_PREFIX + zlib.compress(data, 6)
+        return packed if len(packed) < len(data) else data
+
+    def process_result_value(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        value = bytes(value)
+        if value.startswith(COMPRESSED_PREFIX):
+            value = zlib.decompress(value[len(COMPRESSED_PREFIX):])
+        return value.decode('utf-8')
+
+# User model
+class User(UserMixin, db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(150), unique=True, nullable=False)
+    email = db.Column(db.String(150), unique=True, nullable=False)
+    password = db.Column(db.String(150), nullable=False)
+    health_conditions = db.Column(db.String(500), default='')
+    allergies = db.Column(db.String(500), default='')
+    diet_type = db.Column(db.String(100), default='general')
+    ingredients_to_avoid = db.Column(db.String(500), default='')
+    preferences = db.Column(db.Text) # JSON: parsed snapshot of the four columns above (see preferences.py)
+    prefs_version = db.Column(db.Integer, nullable=False, default=0, server_default='0') # bumped on every profile save
+
+# Scan History model
+class ScanHistory(db.Model):
+    __table_args__ = (
+        # Serves "latest scans of a user" pages without sorting the user's whole history
+        db.Index('ix_scan_history_user_timestamp', 'user_id', 'timestamp', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_name = db.Column(db.String(200), nullable=False)
+    health_score = db.Column(db.Integer)
+    eco_score = db.Column(db.Integer)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=True, index=True)
+    verdict = db.Column(db.String(20)) # copied out of full_analysis so it can be filtered in SQL
+    image_filename = db.Column(db.String(200))
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    full_analysis = db.Column(CompressedText)  # JSON analysis (only the per-user part when product_id is set), compressed
+
+# Deduplicated product catalog: one row per distinct product, shared by every scan of it
+class Product(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_key = db.Column(db.String(64), unique=True, nullable=False) # hash of normalized name + brand + FSSAI
+    name = db.Column(db.String(200), nullable=False)
+    brand = db.Column(db.String(200), default='')
+    fssai_number = db.Column(db.String(20), index=True)
+    extraction = db.Column(db.Text, nullable=False) # JSON: preference-independent product data
+    scan_count = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# EAN/UPC codes of catalog products, learned from scans whose photo showed a barcode or bulk-imported
+class ProductBarcode(db.Model):
+    code = db.Column(db.String(14), primary_key=True) # GTIN, check digit verified (UPC-A widened to EAN-13)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    source = db.Column(db.String(20), default='scan') # scan, import
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Task(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    kind = db.Column(db.String(20), nullable=False, default='scan', server_default='scan') # scan, batch, enrich
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id')) # None for background tasks
+    batch_id = db.Column(db.String(36), index=True) # parent batch task of a basket scan's child scans
+    status = db.Column(db.String(20), default='PENDING') # WAITING (batch child before its OCR), PENDING, PROCESSING, COMPLETED, FAILED
+    stage = db.Column(db.String(20), default='PENDING') # finer progress while PROCESSING: OCR_DONE, AI_DONE
+    result = db.Column(db.Text, nullable=True) # JSON string
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Job queue bookkeeping
+    payload = db.Column(db.Text, nullable=True) # JSON: everything a worker needs to run the scan
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow) # not claimable before this (retry backoff)
+    worker_id = db.Column(db.String(100), nullable=True)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    timings = db.Column(db.Text, nullable=True) # JSON: per-stage durations in seconds
+
+
+def ensure_schema():
+    """Add columns and indexes introduced after a table was first created (create_all never alters tables)."""
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            if column.server_default is not None:
+                column_type += f" DEFAULT '{column.server_default.arg}'"  # fills in existing rows
+            with db.engine.begin() as conn:
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+LEGACY_TASK_ERROR = "Queued before this server version and cannot be resumed; please scan again"
+
+
+def backfill_tasks():
+    """Make tasks from before the job queue consistent with it: a missing available_at (which no claim
+    matches) becomes created_at, and unfinished tasks without a payload, which no worker can run, fail."""
+    # Keeps updated_at, which task expiry and compaction go by
+    Task.query.filter(Task.available_at.is_(None)).update(
+        {Task.available_at: func.coalesce(Task.created_at, datetime.utcnow()), Task.updated_at: Task.updated_at},
+        synchronize_session=False)
+    Task.query.filter(Task.status.in_(('WAITING', 'PENDING', 'PROCESSING')), Task.payload.is_(None)).update(
+        {Task.status: 'FAILED', Task.stage: 'FAILED', Task.result: LEGACY_TASK_ERROR}, synchronize_session=False)
+    db.session.commit()
+
+
+VERDICTS = ('safe', 'warning', 'avoid')
+BACKFILL_BATCH_SIZE = 500
+
+
+def verdict_of(analysis_json):
+    """The verdict stored in a scan's analysis JSON, lowercased, or None."""
+    try:
+        verdict = json.loads(analysis_json).get('verdict')
+    except (TypeError, ValueError, AttributeError):
+        return None
+    verdict = str(verdict or '').strip().lower()
+    return verdict if verdict in VERDICTS else None
+
+
+def backfill_scan_verdicts():
+    """Copy the verdict out of full_analysis for scans saved before ScanHistory.verdict existed."""
+    last_id = 0
+    while True:
+        rows = (db.session.query(ScanHistory.id, ScanHistory.full_analysis)
+                .filter(ScanHistory.id > last_id, ScanHistory.verdict.is_(None),
+                        ScanHistory.full_analysis.isnot(None))
+                .order_by(ScanHistory.id).limit(BACKFILL_BATCH_SIZE).all())
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for scan_id, analysis in rows:
+            verdict = verdict_of(analysis)
+            if verdict:
+                ScanHistory.query.filter_by(id=scan_id).update({ScanHistory.verdict: verdict},
+                                                               synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,228 @@
+"""Client for the FastAPI OCR service.
+
+Keeps one pooled keep-alive session for all workers, retries transient
+failures, stops calling the service for a while after repeated failures
+(circuit breaker), and falls back to running Tesseract in-process when the
+service is unavailable.
+"""
+import io
+import logging
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+OCR_SERVICE_URL = os.getenv('OCR_SERVICE_URL', 'http://localhost:8000')
+OCR_TIMEOUT_SECONDS = float(os.getenv('OCR_TIMEOUT_SECONDS', '30'))
+OCR_RETRIES = int(os.getenv('OCR_RETRIES', '2'))
+OCR_POOL_SIZE = int(os.getenv('OCR_POOL_SIZE', '10'))
+OCR_BREAKER_THRESHOLD = int(os.getenv('OCR_BREAKER_THRESHOLD', '3'))
+OCR_BREAKER_COOLDOWN_SECONDS = float(os.getenv('OCR_BREAKER_COOLDOWN_SECONDS', '30'))
+OCR_LOCAL_FALLBACK = os.getenv('OCR_LOCAL_FALLBACK', 'true').lower() == 'true'
+
+
+class OCRUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets one trial call through after `cooldown`."""
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            return time.monotonic() - self.opened_at >= self.cooldown
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                    logger.warning(f"OCR service circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            return 'half-open' if time.monotonic() - self.opened_at >= self.cooldown else 'open'
+
+
+def _make_session():
+    session = requests.Session()
+    retry = Retry(
+        total=OCR_RETRIES,
+        connect=OCR_RETRIES,
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({'POST'}),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=OCR_POOL_SIZE, max_retries=retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+session = _make_session()
+breaker = CircuitBreaker(OCR_BREAKER_THRESHOLD, OCR_BREAKER_COOLDOWN_SECONDS)
+
+_counters_lock = threading.Lock()
+counters = {"requests": 0, "failures": 0, "fallbacks": 0, "fallbackFailures": 0, "shortCircuited": 0,
+            "barcodeRequests": 0, "barcodeFailures": 0}
+
+
+def _incr(name):
+    with _counters_lock:
+        counters[name] += 1
+
+
+def _call_service(images, headers=None):
+    if len(images) == 1:
+        filename, data = images[0]
+        files = {'file': (filename, data, 'image/jpeg')}
+        response = session.post(f'{OCR_SERVICE_URL}/ocr', files=files, headers=headers,
+                                timeout=OCR_TIMEOUT_SECONDS)
+    else:
+        files = [('files', (filename, data, 'image/jpeg')) for filename, data in images]
+        response = session.post(f'{OCR_SERVICE_URL}/ocr/batch', files=files, headers=headers,
+                                timeout=OCR_TIMEOUT_SECONDS * 2)
+    if response.status_code != 200:
+        raise OCRUnavailable(f"OCR API error: {response.status_code}")
+    ocr_data = response.json()
+    results = ocr_data['results'] if len(images) > 1 else [ocr_data]
+    return [result.get('raw_text', '').strip() for result in results]
+
+
+def _local_ocr(images):
+    """Run Tesseract in this process. Slower and without the service's preprocessing presets."""
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    tesseract_cmd = os.getenv('TESSERACT_CMD')
+    if tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+    texts = []
+    for _, data in images:
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+        image.thumbnail((2000, 2000))
+        texts.append(pytesseract.image_to_string(image.convert('L')).strip())
+    return texts
+
+
+def extract_texts(images, headers=None):
+    """
+    OCR a list of (filename, image_bytes). Returns one text per image ('' when unreadable).
+    Raises OCRUnavailable if both the service and the local fallback fail.
+    """
+    if breaker.allow():
+        _incr('requests')
+        started = time.perf_counter()
+        try:
+            texts = _call_service(images, headers=headers)
+            breaker.success()
+            metrics.OCR_CALL_SECONDS.labels('service', 'ok').observe(time.perf_counter() - started)
+            return texts
+        except Exception as e:
+            _incr('failures')
+            breaker.failure()
+            metrics.OCR_CALL_SECONDS.labels('service', type(e).__name__).observe(time.perf_counter() - started)
+            logger.error(f"OCR service call failed: {e}")
+    else:
+        _incr('shortCircuited')
+
+    if not OCR_LOCAL_FALLBACK:
+        raise OCRUnavailable("OCR service unavailable and local fallback disabled")
+    _incr('fallbacks')
+    started = time.perf_counter()
+    try:
+        texts = _local_ocr(images)
+        metrics.OCR_CALL_SECONDS.labels('local', 'ok').observe(time.perf_counter() - started)
+        return texts
+    except Exception as e:
+        _incr('fallbackFailures')
+        metrics.OCR_CALL_SECONDS.labels('local', type(e).__name__).observe(time.perf_counter() - started)
+        raise OCRUnavailable(f"Local OCR fallback failed: {e}")
+
+
+def detect_barcodes(images, headers=None):
+    """
+    EAN/UPC codes (GTIN strings) found in a list of (filename, image_bytes), in image order without
+    duplicates. Best effort: returns [] when the service is unavailable, so the scan goes on to OCR.
+    """
+    if not breaker.allow():
+        _incr('shortCircuited')
+        return []
+    _incr('barcodeRequests')
+    started = time.perf_counter()
+    files = [('files', (filename, data, 'image/jpeg')) for filename, data in images]
+    try:
+        response = session.post(f'{OCR_SERVICE_URL}/barcode', files=files, headers=headers,
+                                timeout=OCR_TIMEOUT_SECONDS)
+    except requests.RequestException as e:
+        _incr('barcodeFailures')
+        breaker.failure()
+        metrics.OCR_CALL_SECONDS.labels('barcode', type(e).__name__).observe(time.perf_counter() - started)
+        logger.error(f"Barcode detection failed: {e}")
+        return []
+    metrics.OCR_CALL_SECONDS.labels('barcode', 'ok' if response.status_code == 200 else str(response.status_code)).observe(time.perf_counter() - started)
+    if response.status_code != 200:
+        # An OCR service without barcode support answers 404; that is not a failure of the service
+        _incr('barcodeFailures')
+        logger.warning(f"Barcode detection unavailable: HTTP {response.status_code}")
+        return []
+    breaker.success()
+    codes = []
+    for result in response.json().get('results', []):
+        for barcode in result.get('barcodes', []):
+            if barcode['code'] not in codes:
+                codes.append(barcode['code'])
+    return codes
+
+
+def connection_stats():
+    """Requests sent vs. connections opened per pooled host (the difference is reuse)."""
+    pools = {}
+    for adapter in set(session.adapters.values()):
+        for key in adapter.poolmanager.pools.keys():
+            pool = adapter.poolmanager.pools[key]
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connectionsOpened": pool.num_connections,
+                "requests": pool.num_requests,
+                "reused": max(pool.num_requests - pool.num_connections, 0),
+            }
+    return pools
+
+
+def ocr_stats():
+    with _counters_lock:
+        snapshot = dict(counters)
+    return {
+        "serviceUrl": OCR_SERVICE_URL,
+        "counters": snapshot,
+        "breaker": {"state": breaker.state, "timesOpened": breaker.times_opened},
+        "connections": connection_stats(),
+    }
@@ -0,0 +1,63 @@
+"""Normalized user preferences.
+
+The profile is kept as the user typed it: comma-separated allergies, health
+conditions and ingredients to avoid, plus a diet type. snapshot() is the parsed
+form that scans, scoring and chat use: lowercase, de-duplicated term lists and
+the diet. It is stored on the row (User.preferences) together with
+User.prefs_version, which counts profile changes, so it is parsed once per
+profile save rather than once per scan. Rows saved before snapshots existed
+are parsed on read.
+"""
+import json
+
+SNAPSHOT_SCHEMA = 1  # bump when build() changes; older stored snapshots are then rebuilt on read
+TERM_FIELDS = ('allergies', 'health_conditions', 'ingredients_to_avoid')
+
+
+def split_terms(value):
+    """Lowercase, de-duplicated terms of a comma-separated preference string, in the user's order."""
+    terms = []
+    for term in (value or '').split(','):
+        term = ' '.join(term.lower().split())
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def build(user):
+    return {
+        "schema": SNAPSHOT_SCHEMA,
+        "version": user.prefs_version or 0,
+        "allergies": split_terms(user.allergies),
+        "health_conditions": split_terms(user.health_conditions),
+        "ingredients_to_avoid": split_terms(user.ingredients_to_avoid),
+        "diet_type": (user.diet_type or '').strip().lower() or 'general',
+    }
+
+
+def snapshot(user):
+    """The user's stored snapshot, or one parsed from the profile columns if it is missing or stale."""
+    if user.preferences:
+        stored = json.loads(user.preferences)
+        if stored.get('schema') == SNAPSHOT_SCHEMA and stored.get('version') == (user.prefs_version or 0):
+            return stored
+    return build(user)
+
+
+def refresh(user):
+    """Store a new snapshot after the profile columns changed. Caller commits."""
+    user.prefs_version = (user.prefs_version or 0) + 1
+    user.preferences = json.dumps(build(user))
+
+
+def terms(prefs, field):
+    """A term list from a snapshot (or from the strings of a scan queued before snapshots existed)."""
+    value = prefs.get(field)
+    return value if isinstance(value, list) else split_terms(value)
+
+
+def display(prefs):
+    """Preferences as comma-separated strings, as the web client and the chat context show them."""
+    shown = {field: ", ".join(terms(prefs, field)) for field in TERM_FIELDS}
+    shown['diet_type'] = prefs.get('diet_type') or 'general'
+    return shown
@@ -0,0 +1,291 @@
+"""Task expiry and garbage collection of stored scan data.
+
+Finished tasks are only read while a client polls or streams them, so COMPLETED
+and FAILED tasks older than TASK_RETENTION_HOURS are deleted (a basket's child
+scans are kept until the basket itself has finished). Uploads that no scan and
+no unfinished task uses any more (a cleared history, a failed scan) are deleted
+once they are older than ORPHAN_GRACE_HOURS, which leaves time for an upload's
+task to be created. Workers run sweep() every SWEEP_INTERVAL_SECONDS.
+
+compact-storage does the same on demand, and also rewrites what was stored
+before results became references and analyses were compressed, then reports
+the space reclaimed:
+
+    flask --app app compact-storage [--dry-run]
+"""
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import column, func, or_, select, table, text, update
+from sqlalchemy.orm import aliased
+
+import storage
+from models import db, is_compressed, COMPRESS_MIN_BYTES, Product, ScanHistory, Task
+
+logger = logging.getLogger(__name__)
+
+TASK_RETENTION_HOURS = int(os.getenv('TASK_RETENTION_HOURS', '168'))  # 0 keeps finished tasks forever
+ORPHAN_GRACE_HOURS = int(os.getenv('ORPHAN_GRACE_HOURS', '24'))  # 0 keeps orphaned uploads
+SWEEP_INTERVAL_SECONDS = int(os.getenv('SWEEP_INTERVAL_SECONDS', '3600'))  # 0: only compact-storage sweeps
+COMPACT_BATCH_SIZE = 500
+LEGACY_MATCH_SECONDS = 300  # a scan is saved in the same commit that completes its task; allow for clock skew
+
+FINISHED_STATUSES = ('COMPLETED', 'FAILED')
+UNFINISHED_STATUSES = ('WAITING', 'PENDING', 'PROCESSING')
+
+# Columns whose size the report shows: (table, column)
+REPORTED_COLUMNS = (
+    (ScanHistory, 'full_analysis'),
+    (Task, 'result'),
+    (Task, 'payload'),
+    (Product, 'extraction'),
+)
+
+
+class SweepStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sweeps = 0
+        self.tasks_expired = 0
+        self.images_deleted = 0
+        self.bytes_freed = 0
+        self.last_sweep_at = None
+
+    def record(self, tasks, images, freed):
+        with self._lock:
+            self.sweeps += 1
+            self.tasks_expired += tasks
+            self.images_deleted += images
+            self.bytes_freed += freed
+            self.last_sweep_at = datetime.utcnow()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "sweeps": self.sweeps,
+                "tasksExpired": self.tasks_expired,
+                "imagesDeleted": self.images_deleted,
+                "bytesFreed": self.bytes_freed,
+                "lastSweepAt": self.last_sweep_at.isoformat() if self.last_sweep_at else None,
+                "taskRetentionHours": TASK_RETENTION_HOURS,
+                "orphanGraceHours": ORPHAN_GRACE_HOURS,
+            }
+
+
+stats = SweepStats()
+_sweep_lock = threading.Lock()
+_last_sweep = None
+
+
+# --- Sweeping -----------------------------------------------------------------
+
+def expired_tasks():
+    cutoff = datetime.utcnow() - timedelta(hours=TASK_RETENTION_HOURS)
+    parent = aliased(Task)
+    running_baskets = select(parent.id).where(parent.kind == 'batch', parent.status.in_(UNFINISHED_STATUSES))
+    return Task.query.filter(Task.status.in_(FINISHED_STATUSES),
+                             func.coalesce(Task.updated_at, Task.created_at) < cutoff,
+                             or_(Task.batch_id.is_(None), Task.batch_id.not_in(running_baskets)))
+
+
+def expire_tasks(dry_run=False):
+    """Delete finished tasks past TASK_RETENTION_HOURS. Returns how many. Caller commits."""
+    if TASK_RETENTION_HOURS <= 0:
+        return 0
+    query = expired_tasks()
+    return query.count() if dry_run else query.delete(synchronize_session=False)
+
+
+def images_in_use():
+    """Stems of the uploads that scans or unfinished tasks refer to."""
+    stems = {storage.stem(name) for (name,) in db.session.query(ScanHistory.image_filename).distinct() if name}
+    unfinished = db.session.query(Task.payload).filter(Task.status.in_(UNFINISHED_STATUSES),
+                                                       Task.payload.isnot(None))
+    for (payload,) in unfinished:
+        payload = json.loads(payload)
+        for image in payload.get('images') or [{"filename": payload.get('filename')}]:
+            if image.get('filename'):
+                stems.add(storage.stem(image['filename']))
+    return stems
+
+
+def sweep(dry_run=False):
+    """Expire old tasks and delete orphaned uploads. Returns (tasks, images, bytes freed)."""
+    tasks = expire_tasks(dry_run)
+    if not dry_run:
+        db.session.commit()
+    images = freed = 0
+    if ORPHAN_GRACE_HOURS > 0:
+        images, freed = storage.purge_orphans(images_in_use(), ORPHAN_GRACE_HOURS, dry_run=dry_run)
+    if not dry_run:
+        stats.record(tasks, images, freed)
+    logger.info(f"Sweep{' (dry run)' if dry_run else ''}: {tasks} expired task(s), "
+                f"{images} orphaned image(s), {freed} bytes")
+    return tasks, images, freed
+
+
+def maybe_sweep():
+    """Run sweep() if this process has not in SWEEP_INTERVAL_SECONDS. Called from the worker loop, inside an
+    app context; other processes' workers sweep too, which is harmless."""
+    global _last_sweep
+    if SWEEP_INTERVAL_SECONDS <= 0:
+        return
+    with _sweep_lock:
+        if _last_sweep is not None and time.monotonic() - _last_sweep < SWEEP_INTERVAL_SECONDS:
+            return
+        _last_sweep = time.monotonic()
+    try:
+        sweep()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Storage sweep failed: {e}", exc_info=True)
+
+
+# --- Compaction of existing data ------------------------------------------------
+
+def _legacy_scan_ids(tasks, results):
+    """Scan ids for full results stored without a scanId (before results named their scan): the scan of the
+    task's user with the result's image, saved closest to when the task finished."""
+    filenames = {}
+    for task in tasks:
+        image = results[task.id].get('productImage') or ''
+        if 'scanId' not in results[task.id] and task.user_id is not None and image.startswith('/uploads/'):
+            filenames[task.id] = image[len('/uploads/'):]
+    if not filenames:
+        return {}
+    candidates = {}
+    for scan_id, user_id, name, saved_at in (
+            db.session.query(ScanHistory.id, ScanHistory.user_id, ScanHistory.image_filename,
+                             ScanHistory.timestamp)
+            .filter(ScanHistory.image_filename.in_(set(filenames.values())))):
+        candidates.setdefault((user_id, name), []).append((scan_id, saved_at))
+    resolved = {}
+    for task in tasks:
+        scans = candidates.get((task.user_id, filenames.get(task.id)))
+        finished = task.updated_at or task.created_at
+        if not scans or finished is None:
+            continue
+        scan_id, saved_at = min(scans, key=lambda scan: abs((scan[1] - finished).total_seconds())
+                                if scan[1] else float('inf'))
+        if saved_at is not None and abs((saved_at - finished).total_seconds()) <= LEGACY_MATCH_SECONDS:
+            resolved[task.id] = scan_id
+    return resolved
+
+
+def compact_task_results(dry_run=False):
+    """Replace the full results stored by scans completed before results were references. A result without
+    a scanId (written before results named their scan) is matched to its scan by user, image and the time
+    it was saved. Tasks whose scan was deleted or cannot be matched keep theirs until they expire. Returns
+    how many were (or would be) rewritten."""
+    rewritten = 0
+    last_id = ''
+    while True:
+        tasks = (Task.query.filter(Task.id > last_id, Task.status == 'COMPLETED', Task.kind == 'scan',
+                                   Task.result.like('%"structureData"%'))
+                 .order_by(Task.id).limit(COMPACT_BATCH_SIZE).all())
+        if not tasks:
+            break
+        last_id = tasks[-1].id
+        results = {task.id: json.loads(task.result) for task in tasks}
+        scan_ids = {task_id: result.get('scanId') for task_id, result in results.items()}
+        scan_ids.update(_legacy_scan_ids(tasks, results))
+        existing = {scan_id for (scan_id,) in
+                    db.session.query(ScanHistory.id).filter(ScanHistory.id.in_(set(scan_ids.values()) - {None}))}
+        for task in tasks:
+            if scan_ids[task.id] in existing:
+                if not dry_run:
+                    # Keeps updated_at, which the expiry goes by
+                    db.session.execute(update(Task).where(Task.id == task.id).values(
+                        result=json.dumps({"scanId": scan_ids[task.id]}), updated_at=Task.updated_at))
+                rewritten += 1
+        if not dry_run:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    return rewritten
+
+
+def _stored_uncompressed(raw):
+    # str: left from before the column was binary; bytes: copied over by the migration
+    if isinstance(raw, str):
+        return True
+    return not is_compressed(raw) and len(raw) >= COMPRESS_MIN_BYTES
+
+
+def compress_analyses(dry_run=False):
+    """Compress the analyses stored before scan_history.full_analysis was compressed. Returns how many."""
+    # Read through a bare table so values come back as stored rather than decoded by CompressedText
+    raw = table('scan_history', column('id'), column('full_analysis'))
+    rewritten = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(select(raw.c.id, raw.c.full_analysis)
+                                  .where(raw.c.id > last_id, raw.c.full_analysis.isnot(None))
+                                  .order_by(raw.c.id).limit(COMPACT_BATCH_SIZE)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for scan_id, value in rows:
+            if not _stored_uncompressed(value):
+                continue
+            if not dry_run:
+                value = value if isinstance(value, str) else bytes(value).decode('utf-8')
+                db.session.execute(update(ScanHistory).where(ScanHistory.id == scan_id).values(full_analysis=value))
+            rewritten += 1
+        if not dry_run:
+            db.session.commit()
+    return rewritten
+
+
+def vacuum():
+    """Give the space freed by deletes and rewrites back to the filesystem (SQLite) or to PostgreSQL."""
+    db.session.remove()
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text('VACUUM'))
+        if db.engine.dialect.name == 'sqlite':
+            conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+
+
+def compact(dry_run=False):
+    """Sweep, rewrite older rows in their compact form, and vacuum. Returns counts by step."""
+    summary = {}
+    # Sweep first: no point rewriting tasks that are about to be deleted
+    summary["tasksExpired"], summary["imagesDeleted"], summary["imageBytesFreed"] = sweep(dry_run)
+    summary["taskResults"] = compact_task_results(dry_run)
+    summary["analyses"] = compress_analyses(dry_run)
+    if not dry_run:
+        vacuum()
+    return summary
+
+
+# --- Reporting ----------------------------------------------------------------
+
+def database_bytes():
+    """Size of the database: its files (SQLite, including the WAL) or pg_database_size (PostgreSQL)."""
+    engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        path = engine.url.database
+        if not path or path == ':memory:':
+            return db.session.execute(text('PRAGMA page_count')).scalar() * \
+                db.session.execute(text('PRAGMA page_size')).scalar()
+        return sum(os.path.getsize(p) for p in (path, f"{path}-wal") if os.path.exists(p))
+    if engine.dialect.name == 'postgresql':
+        return db.session.execute(text('SELECT pg_database_size(current_database())')).scalar()
+    return None
+
+
+def report():
+    """Database size, rows and stored bytes of the large columns, and upload usage."""
+    tables = {}
+    for model, name in REPORTED_COLUMNS:
+        if model.__tablename__ not in tables:
+            tables[model.__tablename__] = {"rows": db.session.query(func.count()).select_from(model).scalar(),
+                                           "bytes": {}}
+        stored = db.session.query(func.sum(func.length(getattr(model, name)))).scalar()
+        tables[model.__tablename__]["bytes"][name] = int(stored or 0)
+    db.session.rollback()
+    return {"databaseBytes": database_bytes(), "tables": tables, "uploads": storage.usage()}
@@ -0,0 +1,200 @@
+import re
+
+import preferences
+
+# Allergen group -> words that indicate it in an ingredient name
+ALLERGENS = {
+    'wheat': ['wheat', 'maida', 'atta', 'semolina', 'suji', 'barley', 'rye', 'gluten'],
+    'milk': ['milk', 'whey', 'casein', 'caseinate', 'butter', 'buttermilk', 'cream', 'cheese', 'ghee', 'lactose',
+             'paneer', 'curd', 'khoa'],
+    'egg': ['egg', 'albumin'],
+    'peanut': ['peanut', 'groundnut'],
+    'nuts': ['nut', 'almond', 'cashew', 'walnut', 'hazelnut', 'pistachio', 'pecan', 'macadamia'],
+    'soy': ['soy', 'soya', 'soybean'],
+    'fish': ['fish', 'anchovy', 'tuna', 'salmon', 'sardine'],
+    'shellfish': ['shrimp', 'prawn', 'crab', 'lobster'],
+    'sesame': ['sesame', 'til'],
+    'mustard': ['mustard'],
+}
+
+# What users write in their allergies -> the allergen group it means, where that is not a word of the group
+ALLERGY_ALIASES = {
+    'gluten': 'wheat', 'dairy': 'milk', 'lactose': 'milk', 'tree nut': 'nuts', 'tree nuts': 'nuts',
+    'nuts': 'nuts', 'eggs': 'egg', 'peanuts': 'peanut', 'groundnuts': 'peanut', 'seafood': 'shellfish',
+    'shell fish': 'shellfish', 'soya': 'soy',
+}
+
+# Ingredient keywords that break a diet. Matched as whole words of ingredient names.
+DIET_CONFLICTS = {
+    'vegan': ['milk', 'butter', 'cream', 'cheese', 'whey', 'casein', 'lactose', 'ghee',
+              'egg', 'honey', 'gelatin', 'meat', 'chicken', 'beef', 'pork', 'fish', 'shrimp'],
+    'vegetarian': ['gelatin', 'meat', 'chicken', 'beef', 'pork', 'fish', 'shrimp', 'anchovy'],
+    'keto': ['sugar', 'glucose', 'syrup', 'wheat', 'flour', 'rice', 'maltodextrin', 'starch'],
+    'gluten-free': ['wheat', 'barley', 'rye', 'malt', 'semolina', 'maida', 'gluten'],
+    'dairy-free': ['milk', 'butter', 'cream', 'cheese', 'whey', 'casein', 'lactose', 'ghee'],
+}
+
+# Health condition keyword -> (nutrient, limit per 100g, note)
+CONDITION_LIMITS = {
+    'diabetes': ('sugar', 5, "High sugar content is a concern for diabetes."),
+    'hypertension': ('salt', 0.3, "Salt content may raise blood pressure."),
+    'blood pressure': ('salt', 0.3, "Salt content may raise blood pressure."),
+    'cholesterol': ('fat', 3, "Fat content may affect cholesterol levels."),
+    'heart': ('fat', 3, "Fat content is a concern for heart health."),
+    'obesity': ('calories', 400, "This product is energy dense."),
+}
+
+
+def _parse_amount(value):
+    """Pull the first number out of a nutrition value such as '12.5 g'."""
+    if value is None:
+        return None
+    match = re.search(r'\d+(?:\.\d+)?', str(value))
+    return float(match.group()) if match else None
+
+
+def base_health_score(extraction):
+    """Preference-free health score; the LLM's estimate when present, else derived from nutrition."""
+    if isinstance(extraction.get('base_health_score'), (int, float)):
+        return max(0, min(100, int(extraction['base_health_score'])))
+
+    facts = extraction.get('nutritional_facts') or {}
+    score = 70
+    sugar = _parse_amount(facts.get('sugar'))
+    fat = _parse_amount(facts.get('fat'))
+    salt = _parse_amount(facts.get('salt'))
+    fiber = _parse_amount(facts.get('fiber'))
+    protein = _parse_amount(facts.get('protein'))
+
+    if sugar is not None:
+        score -= 20 if sugar > 22.5 else 10 if sugar > 5 else 0
+    if fat is not None:
+        score -= 15 if fat > 17.5 else 5 if fat > 3 else 0
+    if salt is not None:
+        score -= 15 if salt > 1.5 else 5 if salt > 0.3 else 0
+    if fiber is not None and fiber >= 6:
+        score += 10
+    if protein is not None and protein >= 10:
+        score += 10
+    return max(0, min(100, score))
+
+
+def _ingredient_names(extraction):
+    names = []
+    for ingredient in extraction.get('ingredients') or []:
+        if isinstance(ingredient, dict):
+            names.append(str(ingredient.get('name', '')).lower())
+        else:
+            names.append(str(ingredient).lower())
+    return names
+
+
+def _word_pattern(words):
+    """Any of `words` as a whole word, singular or plural: 'egg' matches 'eggs' but not 'eggplant'."""
+    return re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words) + r')(?:e?s)?\b')
+
+
+def _matches_any(terms, names):
+    pattern = _word_pattern(terms)
+    return any(pattern.search(name) for name in names)
+
+
+def _matches(term, names):
+    return _matches_any([term], names)
+
+
+def allergen_group(term):
+    """The ALLERGENS group a user's allergy names, or None for one outside the common groups."""
+    if term in ALLERGY_ALIASES:
+        return ALLERGY_ALIASES[term]
+    for group, words in ALLERGENS.items():
+        if term == group or term in words or term.rstrip('s') in words:
+            return group
+    return None
+
+
+def ingredient_groups(name):
+    """The ALLERGENS groups an ingredient name belongs to."""
+    return {group for group, words in ALLERGENS.items() if _word_pattern(words).search(name)}
+
+
+def _detect_allergens(extraction, allergies):
+    """The user's allergies the ingredients contain. An allergy matches the words of its group (e.g. 'nuts'
+    matches cashew, 'gluten' matches maida). For a user with allergies, an ingredient the extraction flagged
+    as an allergen that is outside the known groups is reported too, by its name."""
+    ingredients = [ingredient if isinstance(ingredient, dict) else {"name": ingredient}
+                   for ingredient in extraction.get('ingredients') or []]
+    names = [str(ingredient.get('name', '')).lower() for ingredient in ingredients]
+    detected = []
+    for allergy in allergies:
+        group = allergen_group(allergy)
+        if _matches_any(ALLERGENS[group] + [allergy] if group else [allergy], names):
+            detected.append(allergy)
+    if not allergies:
+        return detected
+    for ingredient, name in zip(ingredients, names):
+        # Flagged ingredients of a known group were matched above if the user listed that group
+        if ingredient.get('allergen') is True and name and not ingredient_groups(name) \
+                and not _matches_any(allergies, [name]) and name not in detected:
+            detected.append(name)
+    return detected
+
+
+def personalize(extraction, user_prefs):
+    """
+    Compute health_score, verdict, detected_allergens and personalized_notes
+    for one user from preference-independent product data. Deterministic and
+    free of LLM calls, so it can be rerun whenever the user's profile changes.
+    """
+    analysis = dict(extraction)
+    names = _ingredient_names(extraction)
+    facts = extraction.get('nutritional_facts') or {}
+
+    allergies = preferences.terms(user_prefs, 'allergies')
+    avoid_terms = preferences.terms(user_prefs, 'ingredients_to_avoid')
+    conditions = preferences.terms(user_prefs, 'health_conditions')
+    diet = (user_prefs.get('diet_type') or 'general').strip().lower()
+
+    detected_allergens = _detect_allergens(extraction, allergies)
+    avoided = [term for term in avoid_terms if _matches(term, names)]
+    diet_conflicts = [term for term in DIET_CONFLICTS.get(diet, []) if _matches(term, names)]
+
+    notes = []
+    score = base_health_score(extraction)
+    for allergen in detected_allergens:
+        if allergen in allergies:
+            notes.append(f"Contains {allergen}, which is listed in your allergies.")
+        else:
+            notes.append(f"Contains {allergen}, which is marked as an allergen.")
+    for term in avoided:
+        notes.append(f"Contains {term}, which you prefer to avoid.")
+        score -= 15
+    if diet_conflicts:
+        notes.append(f"Not suitable for a {diet} diet (contains {', '.join(diet_conflicts)}).")
+        score -= 25
+
+    for condition in conditions:
+        for keyword, (nutrient, limit, note) in CONDITION_LIMITS.items():
+            if keyword not in condition:
+                continue
+            amount = _parse_amount(facts.get(nutrient))
+            if amount is not None and amount > limit:
+                notes.append(note)
+                score -= 20
+
+    if detected_allergens:
+        score = min(score, 30)
+    score = max(0, min(100, score))
+
+    if detected_allergens or score < 40:
+        verdict = 'avoid'
+    elif avoided or diet_conflicts or score < 65:
+        verdict = 'warning'
+    else:
+        verdict = 'safe'
+
+    analysis['health_score'] = score
+    analysis['verdict'] = verdict
+    analysis['detected_allergens'] = detected_allergens
+    analysis['personalized_notes'] = notes or ["No conflicts found with your preferences."]
+    return analysis
@@ -0,0 +1,349 @@
+"""Storage for uploaded label images and their WebP derivatives.
+
+Originals are named by a hash of their content, so uploading the same photo
+twice stores it once. Each original gets a small thumbnail (history list)
+and a web-sized copy (results page), both WebP, generated once and served
+with immutable caching headers. Originals are only needed for OCR and can be
+purged after STORAGE_ORIGINALS_RETENTION_DAYS (flask --app app purge-originals).
+Images that no scan or queued task uses any more are deleted by
+purge_orphans (see retention.py).
+
+Keys:  <name>               original, e.g. 3f5c...9a.jpg (older uploads keep their timestamped names)
+       thumb/<stem>.webp    thumbnail
+       web/<stem>.webp      web-sized copy
+
+STORAGE_BACKEND selects where they live: 'local' (UPLOAD_FOLDER) or 's3'
+(any S3-compatible store, e.g. MinIO via S3_ENDPOINT_URL; needs boto3).
+"""
+import hashlib
+import io
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from PIL import Image, ImageOps
+from werkzeug.security import safe_join
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+S3_BUCKET = os.getenv('S3_BUCKET', 'ecoscan-uploads')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')  # e.g. http://localhost:9000 for MinIO
+S3_REGION = os.getenv('S3_REGION', 'us-east-1')
+STORAGE_ORIGINALS_RETENTION_DAYS = int(os.getenv('STORAGE_ORIGINALS_RETENTION_DAYS', '30'))  # 0 keeps them forever
+WEBP_QUALITY = int(os.getenv('STORAGE_WEBP_QUALITY', '75'))
+
+# variant -> longest side in pixels
+VARIANTS = {
+    'thumb': int(os.getenv('STORAGE_THUMB_SIZE', '160')),  # shown at 80px in the history list; 2x for HiDPI
+    'web': int(os.getenv('STORAGE_WEB_SIZE', '1024')),
+}
+CACHE_CONTROL = 'public, max-age=31536000, immutable'  # keys never change content
+HASH_CHARS = 32
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp', 'GIF': '.gif', 'BMP': '.bmp', 'TIFF': '.tiff'}
+CONTENT_TYPES = {'.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.png': 'image/png', '.webp': 'image/webp',
+                 '.gif': 'image/gif', '.bmp': 'image/bmp', '.tiff': 'image/tiff'}
+# Stems that can be stored: content hashes, and the <YYYYmmdd_HHMMSS>[_<n>]_<secure_filename> of older uploads
+HASH_STEM = re.compile(rf'[0-9a-f]{{{HASH_CHARS}}}')
+LEGACY_STEM = re.compile(r'\d{8}_\d{6}(?:_\d+)?_[A-Za-z0-9_.-]*')
+
+backend = None
+
+
+class LocalStorage:
+    def __init__(self, root):
+        self.root = root
+        for variant in VARIANTS:
+            os.makedirs(os.path.join(root, variant), exist_ok=True)
+
+    def _path(self, key):
+        path = safe_join(self.root, *key.split('/'))
+        if path is None:
+            raise ValueError(f"Unsafe storage key: {key!r}")
+        return path
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data, content_type):
+        # Write then rename, so a concurrent reader never sees half a file
+        path = self._path(key)
+        partial = f"{path}.{os.getpid()}.part"
+        with open(partial, 'wb') as f:
+            f.write(data)
+        os.replace(partial, path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def touch(self, key):
+        try:
+            os.utime(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def listing(self, folder=''):
+        """(key, modified datetime in UTC, size) for every object directly in `folder` ('' for originals)."""
+        with os.scandir(os.path.join(self.root, folder)) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith('.part'):
+                    stat = entry.stat()
+                    key = f"{folder}/{entry.name}" if folder else entry.name
+                    yield key, datetime.fromtimestamp(stat.st_mtime, timezone.utc), stat.st_size
+
+    def originals(self):
+        """(key, modified datetime in UTC) for every original."""
+        for key, modified, _ in self.listing():
+            yield key, modified
+
+
+class S3Storage:
+    def __init__(self, bucket, endpoint_url=None, region=None):
+        import boto3
+        from botocore.exceptions import ClientError
+
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self._client_error = ClientError
+
+    def _missing(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except self._client_error as e:
+            if self._missing(e):
+                return False
+            raise
+
+    def get(self, key):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self._client_error as e:
+            if self._missing(e):
+                return None
+            raise
+
+    def put(self, key, data, content_type):
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data, ContentType=content_type)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def touch(self, key):
+        # S3 has no mtime to set; copying an object onto itself (with REPLACE) renews LastModified
+        self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={'Bucket': self.bucket, 'Key': key},
+                                MetadataDirective='REPLACE', ContentType=content_type(key))
+
+    def listing(self, folder=''):
+        # Derivatives sit under thumb/ and web/; originals are the top-level keys
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{folder}/" if folder else '', Delimiter='/'):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['LastModified'], item['Size']
+
+    def originals(self):
+        for key, modified, _ in self.listing():
+            yield key, modified
+
+
+def init_app(app):
+    global backend
+    if STORAGE_BACKEND == 's3':
+        backend = S3Storage(S3_BUCKET, S3_ENDPOINT_URL, S3_REGION)
+    else:
+        backend = LocalStorage(app.config['UPLOAD_FOLDER'])
+    logger.info(f"Image storage: {type(backend).__name__}")
+
+
+def _stem(name):
+    return os.path.splitext(name)[0]
+
+
+def stem(key):
+    """The name shared by an original and its derivatives, e.g. '3f5c...9a' for 3f5c...9a.jpg or thumb/3f5c...9a.webp."""
+    return _stem(key.rsplit('/', 1)[-1])
+
+
+def valid_stem(stem):
+    """Whether `stem` is one this module stores under, so it is safe to build a key from."""
+    return bool(HASH_STEM.fullmatch(stem) or LEGACY_STEM.fullmatch(stem))
+
+
+def valid_original(name):
+    """Whether `name` can be the name of a stored original: a content hash with a known image extension, or an
+    older upload's name."""
+    if LEGACY_STEM.fullmatch(name):
+        return True
+    stem_part, extension = os.path.splitext(name)
+    return bool(HASH_STEM.fullmatch(stem_part)) and extension.lower() in CONTENT_TYPES
+
+
+def derivative_key(name, variant):
+    return f"{variant}/{_stem(name)}.webp"
+
+
+def content_type(key):
+    return CONTENT_TYPES.get(os.path.splitext(key)[1].lower(), 'application/octet-stream')
+
+
+def etag(name, variant):
+    # Names are content hashes (or unique timestamped names for older uploads), so they identify the bytes
+    return f"{variant}-{_stem(name)}"
+
+
+def image_url(name, variant):
+    """URL of a derivative ('thumb' or 'web') of the stored image `name`."""
+    if not name:
+        return None
+    return f"/images/{variant}/{_stem(name)}.webp"
+
+
+def save_original(data, uploaded_filename):
+    """Store an upload under a content-hash name and return that name. Identical uploads are stored once."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            extension = FORMAT_EXTENSIONS.get(image.format)
+    except Exception:
+        extension = None
+    if not extension:
+        extension = os.path.splitext(secure_filename(uploaded_filename))[1].lower() or '.bin'
+    name = hashlib.sha256(data).hexdigest()[:HASH_CHARS] + extension
+    if backend.exists(name):
+        # Renew its age, or purge_orphans could delete an old unreferenced copy before this upload's task exists
+        backend.touch(name)
+        logger.info(f"Upload {name} already stored")
+    else:
+        backend.put(name, data, content_type(name))
+    return name
+
+
+def read_original(name):
+    return backend.get(name)
+
+
+def _render(data, max_side):
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, 'WEBP', quality=WEBP_QUALITY, method=4)
+        return out.getvalue()
+
+
+def ensure_derivatives(name, data=None):
+    """Create any missing derivatives of `name` (from `data` if given, else the stored original).
+    Returns False if the original is needed but gone."""
+    missing = [variant for variant in VARIANTS if not backend.exists(derivative_key(name, variant))]
+    if not missing:
+        return True
+    if data is None:
+        data = backend.get(name)
+        if data is None:
+            return False
+    for variant in missing:
+        backend.put(derivative_key(name, variant), _render(data, VARIANTS[variant]), 'image/webp')
+    return True
+
+
+def load_derivative(stem, variant):
+    """Bytes of a derivative, generating it from the original on first use (covers uploads that predate
+    derivatives). None if neither is stored."""
+    key = derivative_key(stem, variant)
+    data = backend.get(key)
+    if data is None:
+        original = _find_original(stem)
+        if original is None:
+            return None
+        data = _render(original, VARIANTS[variant])
+        backend.put(key, data, 'image/webp')
+    return data
+
+
+def load_original(name):
+    """(bytes, content type) of an original, or of its web copy once the original was purged."""
+    data = backend.get(name)
+    if data is not None:
+        return data, content_type(name)
+    data = backend.get(derivative_key(name, 'web'))
+    return (data, 'image/webp') if data is not None else (None, None)
+
+
+def _find_original(stem):
+    # Derivative URLs carry only the stem; the original keeps its extension
+    for extension in dict.fromkeys([*FORMAT_EXTENSIONS.values(), '.jpeg']):
+        for candidate in (stem + extension, stem + extension.upper()):
+            data = backend.get(candidate)
+            if data is not None:
+                return data
+    return None
+
+
+def purge_originals(retention_days=STORAGE_ORIGINALS_RETENTION_DAYS, keep=()):
+    """Delete originals older than retention_days once their derivatives exist. `keep` holds names still
+    needed (e.g. queued scans). Returns (deleted, bytes freed)."""
+    if retention_days <= 0:
+        return 0, 0
+    cutoff = datetime.now(timezone.utc) - timedelta(days=retention_days)
+    deleted = freed = 0
+    for name, modified in list(backend.originals()):
+        if modified >= cutoff or name in keep:
+            continue
+        data = backend.get(name)
+        if data is None:
+            continue
+        try:
+            ensure_derivatives(name, data)
+        except Exception as e:
+            logger.warning(f"Keeping {name}: could not build derivatives ({e})")
+            continue
+        backend.delete(name)
+        deleted += 1
+        freed += len(data)
+    logger.info(f"Purged {deleted} originals older than {retention_days} days ({freed} bytes)")
+    return deleted, freed
+
+
+def usage():
+    """{folder: {"files", "bytes"}} for originals and each derivative folder."""
+    report = {}
+    for folder in ('', *VARIANTS):
+        files = size = 0
+        for _, _, nbytes in backend.listing(folder):
+            files += 1
+            size += nbytes
+        report[folder or 'originals'] = {"files": files, "bytes": size}
+    return report
+
+
+def purge_orphans(in_use, grace_hours, dry_run=False):
+    """Delete originals and derivatives whose stem is not in `in_use` (stems of images that scans or queued
+    tasks refer to) and that are older than grace_hours, so an upload whose task is still being created is
+    safe. Returns (deleted, bytes freed)."""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+    deleted = freed = 0
+    for folder in ('', *VARIANTS):
+        for key, modified, size in list(backend.listing(folder)):
+            if modified >= cutoff or stem(key) in in_use:
+                continue
+            if not dry_run:
+                backend.delete(key)
+            deleted += 1
+            freed += size
+    logger.info(f"{'Would purge' if dry_run else 'Purged'} {deleted} orphaned images ({freed} bytes)")
+    return deleted, freed
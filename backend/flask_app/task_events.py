@@ -0,0 +1,68 @@
+"""In-process publish/subscribe for task state transitions.
+
+Workers publish every stage change; the SSE endpoint subscribes per task.
+Subscribers in another process than the worker fall back to re-reading the
+Task row on their keepalive interval.
+"""
+import asyncio
+import queue
+import threading
+from collections import defaultdict
+
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+
+
+class AsyncSubscription:
+    """Hands events published from worker threads to an asyncio.Queue on the subscriber's event loop."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+        except RuntimeError:
+            pass  # the loop has shut down
+
+    async def get(self, timeout):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+class TaskEventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, task_id, q=None):
+        q = q if q is not None else queue.Queue()
+        with self._lock:
+            self._subscribers[task_id].append(q)
+        return q
+
+    def unsubscribe(self, task_id, q):
+        with self._lock:
+            subscribers = self._subscribers.get(task_id)
+            if subscribers and q in subscribers:
+                subscribers.remove(q)
+            if not subscribers:
+                self._subscribers.pop(task_id, None)
+
+    def publish(self, task_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(task_id, ()))
+        for q in subscribers:
+            q.put(event)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+
+bus = TaskEventBus()
+
+
+def publish(task_id, status, stage=None, **extra):
+    event = {"status": status, "stage": stage or status}
+    event.update(extra)
+    bus.publish(task_id, event)
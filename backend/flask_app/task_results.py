@@ -0,0 +1,45 @@
+"""Results of completed scan tasks, stored as a reference to the scan.
+
+A scan task used to keep a full copy of its result in Task.result: the merged
+analysis, its chat context and the preferences, repeating what scan_history
+and the catalog already hold. It now stores {"scanId": ...} and the result is
+built from the ScanHistory row when the task is read, so a re-scored scan
+also shows its new scores. Tasks completed before keep their full result,
+which is returned as stored. The COMPLETED task event still carries the full
+result, built once by the worker.
+"""
+import json
+
+import chat
+import preferences
+import storage
+
+
+def reference(scan):
+    """What Task.result stores for a completed scan."""
+    return json.dumps({"scanId": scan.id})
+
+
+def referenced_scan(task):
+    """Id of the scan a completed task's result refers to, or None if the result is stored in full."""
+    if task.status != 'COMPLETED' or task.kind not in (None, 'scan') or not task.result:
+        return None
+    result = json.loads(task.result)
+    return result.get('scanId') if 'structureData' not in result else None
+
+
+def build(scan, analysis, user_prefs):
+    """A scan's result as the task endpoints return it. `analysis` is the scan's merged analysis."""
+    return {
+        "scanId": scan.id,
+        "structureData": analysis,
+        "healthScore": scan.health_score,
+        "ecoScore": scan.eco_score,
+        "ecoScoreReasoning": analysis.get('eco_score_reasoning', ''),
+        "benefits": analysis.get('nutritional_benefits', []),
+        "notes": analysis.get('personalized_notes', []),
+        "context": chat.build_context(analysis, user_prefs),
+        "userPreferences": preferences.display(user_prefs),
+        "detectedAllergens": analysis.get('detected_allergens', []),
+        "productImage": storage.image_url(scan.image_filename, 'web'),
+    }
@@ -0,0 +1,66 @@
+import pytest
+
+import scoring
+
+LABEL = {
+    "product_name": "Cashew Cookies",
+    "base_health_score": 80,
+    "ingredients": [
+        {"name": "Maida (Wheat Flour)", "percentage": "", "allergen": False},
+        {"name": "Cashew", "percentage": "8%", "allergen": False},
+        {"name": "Almond", "percentage": "", "allergen": False},
+        {"name": "Whey Powder", "percentage": "", "allergen": False},
+        {"name": "Sugar", "percentage": "", "allergen": False},
+    ],
+}
+
+
+def prefs(allergies='', avoid='', diet='general'):
+    return {"allergies": allergies, "ingredients_to_avoid": avoid, "health_conditions": "", "diet_type": diet}
+
+
+@pytest.mark.parametrize('allergy', ['nuts', 'tree nuts', 'gluten', 'wheat', 'dairy', 'lactose', 'milk', 'cashew'])
+def test_allergy_matches_its_group(allergy):
+    analysis = scoring.personalize(LABEL, prefs(allergies=allergy))
+    assert analysis['detected_allergens'] == [allergy]
+    assert analysis['verdict'] == 'avoid'
+    assert analysis['health_score'] <= 30
+
+
+@pytest.mark.parametrize('allergy, ingredient', [('peanut', 'Roasted Peanuts'), ('peanuts', 'Groundnut Oil'),
+                                                 ('egg', 'Egg Powder'), ('eggs', 'Egg Albumin')])
+def test_allergy_matches_plural_and_synonym(allergy, ingredient):
+    extraction = {"base_health_score": 80, "ingredients": [{"name": ingredient}]}
+    assert scoring.personalize(extraction, prefs(allergies=allergy))['detected_allergens'] == [allergy]
+
+
+def test_allergy_matches_whole_words_only():
+    extraction = {"base_health_score": 80, "ingredients": ["Eggplant", "Coconut", "Nutmeg"]}
+    analysis = scoring.personalize(extraction, prefs(allergies='egg, nuts'))
+    assert analysis['detected_allergens'] == []
+    assert analysis['verdict'] == 'safe'
+
+
+def test_flagged_ingredient_outside_known_groups_is_detected():
+    extraction = {"base_health_score": 80, "ingredients": [{"name": "Lupin Flour", "allergen": True}]}
+    analysis = scoring.personalize(extraction, prefs(allergies='milk'))
+    assert analysis['detected_allergens'] == ['lupin flour']
+    assert analysis['verdict'] == 'avoid'
+
+
+def test_flagged_ingredient_of_an_unlisted_group_is_not_detected():
+    extraction = {"base_health_score": 80, "ingredients": [{"name": "Soy Lecithin", "allergen": True}]}
+    assert scoring.personalize(extraction, prefs(allergies='milk'))['detected_allergens'] == []
+
+
+def test_flagged_ingredient_without_allergies_keeps_verdict():
+    extraction = {"base_health_score": 80, "ingredients": [{"name": "Lupin Flour", "allergen": True}]}
+    assert scoring.personalize(extraction, prefs())['verdict'] == 'safe'
+
+
+def test_diet_and_avoid_terms_match_whole_words():
+    extraction = {"base_health_score": 80, "ingredients": ["Eggplant", "Palm Oil"]}
+    analysis = scoring.personalize(extraction, prefs(avoid='palm oil', diet='vegan'))
+    assert not any('vegan' in note for note in analysis['personalized_notes'])
+    assert analysis['verdict'] == 'warning'
+    assert analysis['health_score'] == 65
@@ -0,0 +1,58 @@
+"""Cache of logged-in users, so an authenticated request does not start with a User query.
+
+Flask-Login's user_loader and the ASGI routes get a CachedUser: a read-only
+copy of the row with its preference snapshot. Entries are dropped when the
+profile is saved and on logout. Every process keeps its own cache, so
+USER_CACHE_TTL_SECONDS bounds how long another process can serve a profile
+that was just changed.
+"""
+import os
+
+from flask_login import UserMixin
+
+import preferences
+from analysis_cache import LRUCache
+from models import db, User
+
+USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', '4096'))
+USER_CACHE_TTL_SECONDS = int(os.getenv('USER_CACHE_TTL_SECONDS', '60'))
+
+cache = LRUCache(USER_CACHE_MAX_ENTRIES, USER_CACHE_TTL_SECONDS)
+
+
+class CachedUser(UserMixin):
+    """What a request needs to know about its user. To change the user, load the row with db.session.get."""
+
+    def __init__(self, user):
+        self.id = user.id
+        self.username = user.username
+        self.email = user.email
+        self.health_conditions = user.health_conditions
+        self.allergies = user.allergies
+        self.diet_type = user.diet_type
+        self.ingredients_to_avoid = user.ingredients_to_avoid
+        self.prefs = preferences.snapshot(user)
+
+
+def remember(user):
+    cached = CachedUser(user)
+    cache.set(user.id, cached)
+    return cached
+
+
+def load(user_id):
+    """Flask-Login user_loader: the cached user, reading the row only on a miss."""
+    user_id = int(user_id)
+    cached = cache.get(user_id)
+    if cached is not None:
+        return cached
+    user = db.session.get(User, user_id)
+    return remember(user) if user is not None else None
+
+
+def invalidate(user_id):
+    cache.delete(int(user_id))
+
+
+def cache_stats():
+    return cache.stats()
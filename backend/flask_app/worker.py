@@ -0,0 +1,49 @@
+"""Standalone scan worker.
+
+Run any number of these (on any machine that shares the database and upload
+folder) alongside or instead of the Flask app's embedded worker threads:
+
+    python worker.py --concurrency 4
+
+Set SCAN_WORKER_THREADS=0 for the web process to leave all scans to workers.
+"""
+import argparse
+import logging
+import signal
+
+from prometheus_client import start_http_server
+
+import job_queue
+from app import app, run_task
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EcoScan scan worker")
+    parser.add_argument('--concurrency', type=int, default=max(job_queue.WORKER_THREADS, 1),
+                        help="number of worker threads in this process")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="serve this process's Prometheus metrics on the given port")
+    args = parser.parse_args()
+
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+        logger.info(f"Metrics on :{args.metrics_port}/metrics")
+
+    threads, stop_event = job_queue.start_workers(app, run_task, args.concurrency, daemon=False)
+    logger.info(f"Worker process running {args.concurrency} thread(s)")
+
+    def shutdown(signum, frame):
+        logger.info("Shutting down, finishing in-flight scans...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -80,10 +80,92 @@ export const logoutUser = async () => {
     }
 };
 
-export const scanProduct = async (imageFile) => {
+// Poll task status every 2s. Used only when the event stream is unavailable.
+const pollTask = (taskId, signal) => new Promise((resolve) => {
+    const checkStatus = async () => {
+        if (signal?.aborted) {
+            resolve({ success: false, aborted: true });
+            return;
+        }
+        try {
+            const taskRes = await api.get(`/api/tasks/${taskId}`);
+            const taskData = taskRes.data.data;
+            console.log('Task status:', taskData.status);
+
+            if (taskData.status === 'COMPLETED') {
+                resolve({ success: true, data: taskData.result });
+            } else if (taskData.status === 'FAILED') {
+                resolve({ success: false, message: taskData.error || 'Scan analysis failed' });
+            } else {
+                // Still processing, check again in 2s
+                setTimeout(checkStatus, 2000);
+            }
+        } catch (e) {
+            console.error('Polling error:', e);
+            resolve({ success: false, message: 'Lost connection to scan task' });
+        }
+    };
+    checkStatus();
+});
+
+// Wait for a scan task via Server-Sent Events, falling back to polling.
+// onProgress receives every event ({ taskId, status, stage, ... }) as it arrives;
+// PARTIAL events carry one extracted field ({ field, value }) while the AI is still writing.
+// Aborting signal stops listening and resolves with { aborted: true }.
+export const waitForTask = (taskId, onProgress, signal) => {
+    if (typeof EventSource === 'undefined') {
+        return pollTask(taskId, signal);
+    }
+
+    return new Promise((resolve) => {
+        console.log(`Streaming events for task ${taskId}...`);
+        const source = new EventSource(`/api/tasks/${taskId}/events`, { withCredentials: true });
+        let settled = false;
+
+        signal?.addEventListener('abort', () => {
+            if (settled) return;
+            settled = true;
+            source.close();
+            resolve({ success: false, aborted: true });
+        });
+
+        const handleEvent = (e) => {
+            if (settled) return;
+            const event = JSON.parse(e.data);
+            console.log('Task stage:', event.stage);
+            if (onProgress) onProgress({ ...event, taskId });
+
+            if (event.status === 'COMPLETED') {
+                settled = true;
+                source.close();
+                resolve({ success: true, data: event.result });
+            } else if (event.status === 'FAILED') {
+                settled = true;
+                source.close();
+                resolve({ success: false, message: event.error || 'Scan analysis failed' });
+            }
+        };
+
+        ['pending', 'processing', 'ocr_done', 'partial', 'ai_done', 'retrying', 'completed', 'failed'].forEach((name) => {
+            source.addEventListener(name, handleEvent);
+        });
+
+        source.onerror = () => {
+            if (settled) return;
+            console.warn('Task event stream unavailable, falling back to polling');
+            settled = true;
+            source.close();
+            pollTask(taskId, signal).then(resolve);
+        };
+    });
+};
+
+export const scanProduct = async (imageFile, onProgress, signal) => {
     try {
+        // Accepts one image or an array of label faces (front, back...) of the same product
         const formData = new FormData();
-        formData.append('product_image', imageFile);
+        const images = Array.isArray(imageFile) ? imageFile : [imageFile];
+        images.forEach((image) => formData.append('product_image', image));
 
         // 1. Submit Scan Job
         const response = await api.post('/api/scan', formData, {
@@ -95,32 +177,7 @@ export const scanProduct = async (imageFile) => {
 
         // Status 202 means Accepted/Async
         if (response.status === 202 && response.data.task_id) {
-            const taskId = response.data.task_id;
-            console.log(`Polling for task ${taskId}...`);
-
-            // 2. Poll for Completion
-            return new Promise((resolve, reject) => {
-                const checkStatus = async () => {
-                    try {
-                        const taskRes = await api.get(`/api/tasks/${taskId}`);
-                        const taskData = taskRes.data.data;
-                        console.log('Task status:', taskData.status);
-
-                        if (taskData.status === 'COMPLETED') {
-                            resolve({ success: true, data: taskData.result });
-                        } else if (taskData.status === 'FAILED') {
-                            resolve({ success: false, message: taskData.error || 'Scan analysis failed' });
-                        } else {
-                            // Still processing, check again in 2s
-                            setTimeout(checkStatus, 2000);
-                        }
-                    } catch (e) {
-                        console.error('Polling error:', e);
-                        resolve({ success: false, message: 'Lost connection to scan task' });
-                    }
-                };
-                checkStatus();
-            });
+            return await waitForTask(response.data.task_id, onProgress, signal);
         }
 
         // Fallback for immediate response (if logic changes back)
@@ -176,9 +233,10 @@ export const updateProfile = async (profileData) => {
     }
 };
 
-export const chatWithAI = async (query, context) => {
+// scan: { scanId, taskId }; the server builds the product context from the stored scan
+export const chatWithAI = async (query, { scanId, taskId } = {}) => {
     try {
-        const response = await api.post('/api/chat', { query, context }, {
+        const response = await api.post('/api/chat', { query, scanId, taskId }, {
             headers: {
                 'Content-Type': 'application/json'
             }
@@ -187,13 +245,78 @@ export const chatWithAI = async (query, context) => {
         return response.data.response;
     } catch (error) {
         console.log('Chat error:', error);
-        return "Sorry, I couldn't reach the AI.";
+        // 429: the server explains the chat limit in the usual reply field
+        return error.response?.data?.response || "Sorry, I couldn't reach the AI.";
+    }
+};
+
+// Stream a chat reply over Server-Sent Events. onToken receives each piece of text as
+// Groq produces it. Aborting signal closes the connection, which also stops generation
+// on the server. Resolves with { success, text, source, firstTokenMs } or { aborted: true };
+// falls back to the non-streaming endpoint if streaming is unavailable.
+export const streamChat = async (query, { scanId, taskId } = {}, onToken, signal) => {
+    const started = performance.now();
+    let text = '';
+    try {
+        const response = await fetch('/api/chat/stream', {
+            method: 'POST',
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ query, scanId, taskId }),
+            signal,
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Chat stream failed: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let firstTokenMs = null;
+        let done = null;
+        for (;;) {
+            const { value, done: finished } = await reader.read();
+            if (finished) break;
+            buffer += decoder.decode(value, { stream: true });
+            const messages = buffer.split('\n\n');
+            buffer = messages.pop();
+            for (const message of messages) {
+                const eventLine = message.split('\n').find((line) => line.startsWith('event: '));
+                const dataLine = message.split('\n').find((line) => line.startsWith('data: '));
+                if (!eventLine || !dataLine) continue;
+                const event = eventLine.slice(7);
+                const data = JSON.parse(dataLine.slice(6));
+                if (event === 'token') {
+                    if (firstTokenMs === null) firstTokenMs = Math.round(performance.now() - started);
+                    text += data.text;
+                    if (onToken) onToken(data.text, text);
+                } else if (event === 'done') {
+                    done = data;
+                } else if (event === 'error') {
+                    return { success: false, text: data.message };
+                }
+            }
+        }
+        console.log(`Chat first token after ${firstTokenMs}ms (server ${done?.firstTokenMs}ms, ${done?.source})`);
+        return { success: true, text, source: done?.source, firstTokenMs };
+    } catch (error) {
+        if (signal?.aborted) {
+            return { success: false, aborted: true, text };
+        }
+        console.log('Chat stream error, falling back:', error);
+        if (text) {
+            return { success: false, text };
+        }
+        const reply = await chatWithAI(query, { scanId, taskId });
+        if (onToken) onToken(reply, reply);
+        return { success: true, text: reply };
     }
 };
 
-export const getHistory = async () => {
+// params: { limit, cursor, minHealth, maxHealth, minEco, maxEco, verdict, q }
+export const getHistory = async (params = {}) => {
     try {
-        const response = await api.get('/api/history');
+        const response = await api.get('/api/history', { params });
         console.log('History fetch successful:', response.data);
         return response.data;
     } catch (error) {
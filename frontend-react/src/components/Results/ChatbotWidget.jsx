@@ -1,13 +1,14 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { MessageSquare, X, Send } from 'lucide-react';
-import { chatWithAI } from '../../api/client';
+import { streamChat } from '../../api/client';
 
-const ChatbotWidget = ({ context }) => {
+const ChatbotWidget = ({ scanId, taskId }) => {
     const [isOpen, setIsOpen] = useState(false);
     const [query, setQuery] = useState('');
     const [history, setHistory] = useState([]);
     const [isTyping, setIsTyping] = useState(false);
     const bottomRef = useRef(null);
+    const streamRef = useRef(null);
 
     useEffect(() => {
         if (isOpen) {
@@ -15,19 +16,53 @@ const ChatbotWidget = ({ context }) => {
         }
     }, [history, isOpen]);
 
+    // Stop any reply still streaming when the chat is closed or the page is left,
+    // so the server stops generating tokens nobody will read
+    useEffect(() => {
+        if (!isOpen) streamRef.current?.abort();
+    }, [isOpen]);
+    useEffect(() => () => streamRef.current?.abort(), []);
+
+    const setReply = (id, text) => {
+        setHistory(prev => prev.map(msg => (msg.id === id ? { ...msg, text } : msg)));
+    };
+
     const handleSend = async (e) => {
         e.preventDefault();
         if (!query.trim()) return;
 
+        streamRef.current?.abort();
+        const controller = new AbortController();
+        streamRef.current = controller;
+
         const userMsg = query;
+        const replyId = Date.now();
         setQuery('');
         setHistory(prev => [...prev, { sender: 'user', text: userMsg }]);
         setIsTyping(true);
 
-        const response = await chatWithAI(userMsg, context);
+        let started = false;
+        const result = await streamChat(userMsg, { scanId, taskId }, (piece, text) => {
+            if (!started) {
+                started = true;
+                setIsTyping(false);
+                setHistory(prev => [...prev, { id: replyId, sender: 'ai', text }]);
+            } else {
+                setReply(replyId, text);
+            }
+        }, controller.signal);
 
+        if (result.aborted) {
+            // A newer message may have taken over the typing indicator
+            if (!started && streamRef.current === controller) setIsTyping(false);
+            return;
+        }
         setIsTyping(false);
-        setHistory(prev => [...prev, { sender: 'ai', text: response }]);
+        if (!started) {
+            setHistory(prev => [...prev, { id: replyId, sender: 'ai', text: result.text || "Sorry, I couldn't reach the AI." }]);
+        } else if (!result.success) {
+            setReply(replyId, result.text);
+        }
     };
 
     return (
@@ -5,23 +5,37 @@ import { Calendar, AlertCircle, Leaf, Activity, Trash2 } from 'lucide-react';
 const History = () => {
     const [history, setHistory] = useState([]);
     const [loading, setLoading] = useState(true);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         const fetchHistory = async () => {
             const result = await getHistory();
             if (result.success) {
                 setHistory(result.data);
+                setNextCursor(result.nextCursor || null);
             }
             setLoading(false);
         };
         fetchHistory();
     }, []);
 
+    const loadMore = async () => {
+        setLoadingMore(true);
+        const result = await getHistory({ cursor: nextCursor });
+        if (result.success) {
+            setHistory((prev) => [...prev, ...result.data]);
+            setNextCursor(result.nextCursor || null);
+        }
+        setLoadingMore(false);
+    };
+
     const handleClearHistory = async () => {
         if (window.confirm('Are you sure you want to clear your entire scan history? This action cannot be undone.')) {
             const result = await clearHistory();
             if (result.success) {
                 setHistory([]);
+                setNextCursor(null);
             } else {
                 alert('Failed to clear history');
             }
@@ -70,6 +84,10 @@ const History = () => {
                                 <img
                                     src={item.image}
                                     alt={item.productName}
+                                    width={80}
+                                    height={80}
+                                    loading="lazy"
+                                    decoding="async"
                                     style={{ width: '100%', height: '100%', objectFit: 'cover' }}
                                     onError={(e) => e.target.src = 'https://placehold.co/80x80?text=No+Image'}
                                 />
@@ -100,6 +118,14 @@ const History = () => {
                 </div>
             )}
 
+            {nextCursor && (
+                <div className="text-center" style={{ marginTop: '1.5rem' }}>
+                    <button onClick={loadMore} className="btn-primary" disabled={loadingMore}>
+                        {loadingMore ? 'Loading...' : 'Load More'}
+                    </button>
+                </div>
+            )}
+
             <style>{`
                 .history-grid {
                     display: grid;
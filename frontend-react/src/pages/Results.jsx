@@ -1,4 +1,4 @@
-import React, { useEffect } from 'react';
+import React, { useEffect, useState } from 'react';
 import { useLocation, useNavigate, Link } from 'react-router-dom';
 import { ArrowLeft } from 'lucide-react';
 import ProductHeader from '../components/Results/ProductHeader';
@@ -12,11 +12,36 @@ import EnvironmentalPanel from '../components/Results/EnvironmentalPanel';
 import ChatbotWidget from '../components/Results/ChatbotWidget';
 import CompliancePanel from '../components/Results/CompliancePanel';
 import Footer from '../components/Footer';
+import Loader from '../components/Loader';
+import { waitForTask } from '../api/client';
 
 const Results = () => {
     const location = useLocation();
     const navigate = useNavigate();
-    const { result } = location.state || {};
+    const { result: initialResult, taskId, partial } = location.state || {};
+    const [result, setResult] = useState(initialResult);
+    const [partialData, setPartialData] = useState(partial || null);
+    const [error, setError] = useState(null);
+
+    // Arrived mid-scan: keep merging streamed fields until the final result lands
+    useEffect(() => {
+        if (initialResult || !taskId) return;
+        const controller = new AbortController();
+        const onProgress = (event) => {
+            if (event.stage === 'PARTIAL') {
+                setPartialData((prev) => ({ ...prev, [event.field]: event.value }));
+            }
+        };
+        waitForTask(taskId, onProgress, controller.signal).then((res) => {
+            if (res.aborted) return;
+            if (res.success) {
+                setResult(res.data);
+            } else {
+                setError(res.message || 'Scan analysis failed');
+            }
+        });
+        return () => controller.abort();
+    }, [taskId, initialResult]);
 
     useEffect(() => {
         if (!result) {
@@ -28,6 +53,34 @@ const Results = () => {
         }
     }, [result, navigate]);
 
+    if (!result && error) {
+        return (
+            <div className="results-container text-center" style={{ marginTop: '100px' }}>
+                <h2>Analysis Failed</h2>
+                <p>{error}</p>
+                <Link to="/scan" className="btn-primary" style={{ textDecoration: 'none', marginTop: '20px', display: 'inline-block' }}>
+                    Try Again
+                </Link>
+            </div>
+        );
+    }
+
+    if (!result && partialData) {
+        return (
+            <div className="results-container" style={{ paddingBottom: '100px' }}>
+                <ProductHeader product={{}} structureData={partialData} />
+
+                <Loader text="Personalizing your results..." />
+
+                {partialData.ingredients && <IngredientBreakdown ingredients={partialData.ingredients} />}
+
+                {partialData.nutritional_facts && <NutritionSnapshot nutrition={partialData.nutritional_facts} />}
+
+                {partialData.packaging && <EnvironmentalPanel ecoData={partialData} />}
+            </div>
+        );
+    }
+
     if (!result) {
         return (
             <div className="results-container text-center" style={{ marginTop: '100px' }}>
@@ -46,7 +99,7 @@ const Results = () => {
         structureData,
         benefits,
         notes,
-        context,
+        scanId,
         userPreferences,
         detectedAllergens,
         productImage
@@ -93,7 +146,7 @@ const Results = () => {
                 <p>EcoScan AI Beta</p>
             </div>
 
-            <ChatbotWidget context={context} />
+            <ChatbotWidget scanId={scanId} taskId={taskId} />
         </div>
     );
 };
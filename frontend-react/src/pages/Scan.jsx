@@ -9,11 +9,20 @@ import Cropper from 'react-easy-crop';
 import { getCroppedImg } from '../utils/cropUtils';
 import '../styles/Scan.css';
 
+const STAGE_MESSAGES = {
+    PENDING: "Waiting for a free scanner...",
+    PROCESSING: "Reading the label...",
+    OCR_DONE: "Label read. Consulting AI Models...",
+    RETRYING: "Retrying analysis...",
+    AI_DONE: "Personalizing your results...",
+};
+
 const Scan = () => {
     const webcamRef = useRef(null);
     const [imgSrc, setImgSrc] = useState(null); // The final image to analyze (cropped)
     const [originalImgSrc, setOriginalImgSrc] = useState(null); // The raw input for cropping
     const [isScanning, setIsScanning] = useState(false);
+    const [scanStage, setScanStage] = useState(null);
     const [useCamera, setUseCamera] = useState(true);
     const [isCropping, setIsCropping] = useState(false);
 
@@ -103,9 +112,27 @@ const Scan = () => {
                 file = new File([blob], "scan.jpg", { type: "image/jpeg" });
             }
 
-            const result = await scanProduct(file);
+            // Hand over to the Results page as soon as the AI has named the product;
+            // it keeps rendering the remaining fields as they stream in.
+            const controller = new AbortController();
+            const partial = {};
+            const onProgress = (event) => {
+                if (event.stage !== 'PARTIAL') {
+                    setScanStage(event.stage);
+                    return;
+                }
+                partial[event.field] = event.value;
+                if (event.field === 'product_name' && !controller.signal.aborted) {
+                    controller.abort();
+                    navigate('/results', { state: { taskId: event.taskId, partial: { ...partial } } });
+                }
+            };
+
+            const result = await scanProduct(file, onProgress, controller.signal);
 
-            if (result.success) {
+            if (result.aborted) {
+                return;
+            } else if (result.success) {
                 navigate('/results', { state: { result: result.data } });
             } else {
                 alert(result.message || "Scan failed. Please try again.");
@@ -115,13 +142,14 @@ const Scan = () => {
             alert("An error occurred during scanning.");
         } finally {
             setIsScanning(false);
+            setScanStage(null);
         }
     };
 
     if (isScanning) {
         return (
             <div className="scan-loader">
-                <Loader text="Analyzing Product... Consulting AI Models..." />
+                <Loader text={STAGE_MESSAGES[scanStage] || "Analyzing Product... Consulting AI Models..."} />
             </div>
         );
     }
@@ -15,7 +15,8 @@ export default defineConfig({
     proxy: {
       '/static': 'http://localhost:5000',
       '/api': 'http://localhost:5000',
-      '/uploads': 'http://localhost:5000'
+      '/uploads': 'http://localhost:5000',
+      '/images': 'http://localhost:5000'
     }
   }
 }